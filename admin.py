@@ -1,5 +1,86 @@
-from us_reactors.models import Facility, Reactor
+from us_reactors.models import Facility, Reactor, EventNotification, EventReactorStatus, \
+    EventPerson, CFRSection
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator, InvalidPage
+from django.db import connection
+
+class EstimatedCountPaginator(Paginator):
+    """ Paginator that uses the database's row estimate for the unfiltered
+    count of big tables, instead of a COUNT(*) over every row on every page
+    view. Filtered lists and small tables still get an exact count.
+
+    """
+    # Tables estimated smaller than this get counted exactly.
+    EXACT_BELOW = 10000
+
+    def _get_count(self):
+        if self._count is None:
+            self._count = self.estimated_count(self.object_list)
+        return self._count
+    count = property(_get_count)
+
+    @classmethod
+    def estimated_count(cls, queryset):
+        """ The row estimate for an unfiltered queryset over a big table,
+        otherwise an exact count.
+
+        """
+        estimate = None
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model._meta.db_table)
+        if estimate is not None and estimate >= cls.EXACT_BELOW:
+            return estimate
+        return queryset.count()
+
+class EstimatedCountChangeList(ChangeList):
+    """ Change list that also uses the estimate for the unfiltered total it
+    shows next to the filtered count ("5 results (123456 total)"). Django
+    counts every row for that on each filtered, searched or date page.
+
+    """
+    def get_results(self, request):
+        # Same as ChangeList.get_results, apart from full_result_count.
+        paginator = self.model_admin.get_paginator(request, self.query_set, self.list_per_page)
+        result_count = paginator.count
+        if not self.query_set.query.where:
+            full_result_count = result_count
+        else:
+            full_result_count = EstimatedCountPaginator.estimated_count(self.root_query_set)
+
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+def estimate_rows(table):
+    """ Rough number of rows in a table, or None if the database can't say. """
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [table])
+    elif connection.vendor == 'mysql':
+        cursor.execute("SELECT table_rows FROM information_schema.tables "
+                       "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+    elif connection.vendor == 'sqlite':
+        # Rows are hardly ever deleted, so the highest id is close enough.
+        cursor.execute("SELECT MAX(rowid) FROM %s" % table)
+    else:
+        return None
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
 
 class FacilityAdmin(admin.ModelAdmin):
     list_display = ('name', 'region', 'city', 'state',)
@@ -9,5 +90,48 @@ class ReactorAdmin(admin.ModelAdmin):
     list_display = ('short_title', 'nrc_id', 'facility',)
     list_filter = ('facility__region','facility__state')
 
+class EventReactorStatusInline(admin.TabularInline):
+    model = EventReactorStatus
+    raw_id_fields = ('reactor',)
+    extra = 0
+
+    def queryset(self, request):
+        # Each row is labeled with its __unicode__, which needs the event
+        # number and reactor name. Fetch them up front, minus the event body.
+        qs = super(EventReactorStatusInline, self).queryset(request)
+        return qs.select_related('event', 'reactor__facility').defer('event__body')
+
+class EventNotificationAdmin(admin.ModelAdmin):
+    list_display = ('event_num', 'event_time', 'facility', 'subject', 'emergency_status',
+                    'retracted',)
+    list_filter = ('retracted', 'emergency_status',)
+    list_select_related = True
+    # Exact match on the indexed event number rather than a LIKE scan.
+    search_fields = ('=event_num',)
+    # event_time is indexed, so the date drill-down and sorting by event time
+    # don't scan the table.
+    date_hierarchy = 'event_time'
+    paginator = EstimatedCountPaginator
+    raw_id_fields = ('facility', 'cfr_sections', 'people',)
+    inlines = (EventReactorStatusInline,)
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+    def queryset(self, request):
+        # The change list never shows the body, which is most of the row.
+        return super(EventNotificationAdmin, self).queryset(request).defer('body')
+
+class EventPersonAdmin(admin.ModelAdmin):
+    list_display = ('name', 'organization',)
+    search_fields = ('name', 'organization',)
+
+class CFRSectionAdmin(admin.ModelAdmin):
+    list_display = ('section', 'title',)
+    search_fields = ('section', 'title',)
+
 admin.site.register(Facility, FacilityAdmin)
-admin.site.register(Reactor, ReactorAdmin)
\ No newline at end of file
+admin.site.register(Reactor, ReactorAdmin)
+admin.site.register(EventNotification, EventNotificationAdmin)
+admin.site.register(EventPerson, EventPersonAdmin)
+admin.site.register(CFRSection, CFRSectionAdmin)
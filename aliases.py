@@ -0,0 +1,182 @@
+""" Index for matching the facility names in event reports to Facility and
+Reactor rows.
+
+Event reports name the site the way the NRC operations center does, which
+rarely matches the names in the reactor data: "INDIAN POINT" for Indian Point
+Energy Center, "DAVIS BESSE" for Davis-Besse, "HATCH" for Edwin I. Hatch.
+Names are normalized into keys (upper case, no punctuation or spaces), and
+each facility is indexed under its name, its short name, and those names
+without generic words like "Nuclear" and "Station" or leading initials. A
+curated table covers the names that still don't line up.
+
+Everything is loaded in two queries when the index is built, so resolving an
+event is a couple of dict lookups. Names that can't be resolved are collected
+so they can be reported together at the end of a load.
+
+"""
+
+import re
+
+from us_reactors.models import Facility, Reactor
+
+# Event report facility names that don't match a facility's name or short
+# name, even after normalizing, mapped to the facility's name or short name
+# (which is matched the same way as a name from an event report). Entries
+# that don't match exactly one facility are listed by AliasIndex.report().
+FACILITY_ALIASES = {
+    'ARKANSAS NUCLEAR': 'Arkansas Nuclear One',
+    'COLUMBIA GENERATING STATIO': 'Columbia',
+    'COOK': 'Donald C. Cook',
+    'FARLEY': 'Joseph M. Farley',
+    'FERMI': 'Enrico Fermi',
+    'FITZPATRICK': 'James A. FitzPatrick',
+    'HARRIS': 'Shearon Harris',
+    'HATCH': 'Edwin I. Hatch',
+    'SOUTH TEXAS': 'South Texas Project',
+    'SUMMER': 'Virgil C. Summer',
+    'VOGTLE': 'Alvin W. Vogtle',
+}
+
+# Words that are left out of the shorter keys a facility is indexed under.
+GENERIC_WORDS = set(['NUCLEAR', 'GENERATING', 'POWER', 'PLANT', 'STATION', 'ENERGY',
+                     'CENTER', 'ELECTRIC', 'STEAM', 'FACILITY', 'PROJECT', 'SITE'])
+NAME_SPLIT_RE = re.compile(r'[^A-Z0-9]+')
+
+
+def name_words(name):
+    """ The words in a facility name, upper case and without punctuation.
+    "Saint" is spelled "St" in event reports.
+
+    """
+    words = [w for w in NAME_SPLIT_RE.split(name.upper()) if w]
+    return ['ST' if w == 'SAINT' else w for w in words]
+
+
+def name_key(name):
+    """ Lookup key for a facility name. Spaces are dropped too, since event
+    reports write "LASALLE" and "LA SALLE" both ways.
+
+    """
+    return ''.join(name_words(name))
+
+
+def short_keys(name):
+    """ Shorter keys a facility name is also indexed under: without generic
+    words, and without leading initials.
+
+    """
+    words = [w for w in name_words(name) if w not in GENERIC_WORDS]
+    keys = set()
+    if words:
+        keys.add(''.join(words))
+    while len(words) > 1 and len(words[0]) == 1:
+        words = words[1:]
+        keys.add(''.join(words))
+    return keys
+
+
+class AliasIndex(object):
+    """ Resolves facility names and unit numbers from event reports to
+    Facility and Reactor ids.
+
+    A key can belong to more than one facility (a short key like "SALEM" for
+    two sites that share a name). Keys from names and short names take
+    precedence over curated aliases, which take precedence over the shorter
+    keys. If a key still belongs to several facilities, the one that has a
+    reactor numbered for every unit the event mentions is picked.
+
+    """
+    def __init__(self, aliases=FACILITY_ALIASES):
+        exact = {}
+        derived = {}
+        for facility_id, name, short_name in Facility.objects.values_list(
+                'id', 'name', 'short_name'):
+            for value in (name, short_name):
+                exact.setdefault(name_key(value), set()).add(facility_id)
+                for key in short_keys(value):
+                    derived.setdefault(key, set()).add(facility_id)
+        curated = {}
+        # Curated aliases whose target matched no facility, or several.
+        self.unresolved_aliases = {}
+        for alias, target in aliases.items():
+            key = name_key(target)
+            facility_ids = exact.get(key) or derived.get(key)
+            if facility_ids and len(facility_ids) == 1:
+                curated[name_key(alias)] = facility_ids
+            else:
+                self.unresolved_aliases[alias] = target
+        # key -> tuple of facility ids
+        self.facilities = {}
+        for table in (derived, curated, exact):
+            for key, facility_ids in table.items():
+                self.facilities[key] = tuple(sorted(facility_ids))
+
+        self.reactors = {}
+        self.facility_reactors = {}
+        for reactor_id, facility_id, unit in Reactor.objects.values_list(
+                'id', 'facility_id', 'unit'):
+            self.reactors[(facility_id, unit)] = reactor_id
+            self.facility_reactors.setdefault(facility_id, []).append(reactor_id)
+        # Facility names that didn't resolve, with how many times each was
+        # seen, and (facility name, unit) pairs with no matching reactor.
+        self.unresolved = {}
+        self.unresolved_units = set()
+
+    def facility(self, name, units=()):
+        """ The Facility id for a name from an event report, or None. `units`
+        are the unit numbers the event mentions, used to pick between
+        facilities that share a name.
+
+        """
+        candidates = self.facilities.get(name_key(name), ())
+        if len(candidates) > 1:
+            candidates = [f for f in candidates
+                          if all((f, unit) in self.reactors for unit in units)]
+        if len(candidates) == 1:
+            return candidates[0]
+        self.unresolved[name] = self.unresolved.get(name, 0) + 1
+        return None
+
+    def reactor(self, facility_id, unit, name=None):
+        """ The Reactor id for a unit number at a facility, or None.
+        Facilities with a single reactor are stored with unit 0, so fall back
+        to the only reactor at the site. Pass the facility name from the
+        event to have a missing unit reported.
+
+        """
+        reactor_id = self.reactors.get((facility_id, unit))
+        if reactor_id is None and len(self.facility_reactors.get(facility_id, [])) == 1:
+            reactor_id = self.facility_reactors[facility_id][0]
+        if reactor_id is None and name is not None:
+            self.unresolved_units.add((name, unit))
+        return reactor_id
+
+    def resolve(self, name, unit):
+        """ The Reactor id for a facility name and unit number from an event
+        report, or None.
+
+        """
+        facility_id = self.facility(name, [unit])
+        if facility_id is None:
+            return None
+        return self.reactor(facility_id, unit, name)
+
+    def report(self):
+        """ Lines describing everything that didn't resolve, for printing at
+        the end of a load.
+
+        """
+        lines = []
+        if self.unresolved_aliases:
+            lines.append("Aliases that don't match a single facility:")
+            for alias, target in sorted(self.unresolved_aliases.items()):
+                lines.append("  %s -> %s" % (alias, target))
+        if self.unresolved:
+            lines.append("Unresolved facilities:")
+            for name, count in sorted(self.unresolved.items()):
+                lines.append("  %s (%d events)" % (name, count))
+        if self.unresolved_units:
+            lines.append("Unresolved units:")
+            for name, unit in sorted(self.unresolved_units):
+                lines.append("  %s unit %s" % (name, unit))
+        return lines
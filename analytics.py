@@ -0,0 +1,133 @@
+""" Reactor status analytics with NumPy.
+
+Every EventReactorStatus row is loaded once into column arrays, alongside
+arrays of the reactor attributes, and the rollups are computed with array
+operations instead of looping over model instances. Both the arrays and the
+results are cached per process until the loaders bump the data version (see
+DataVersion).
+
+"""
+
+import calendar
+import datetime
+import threading
+from functools import wraps
+
+import numpy as np
+
+from us_reactors.models import Reactor, EventReactorStatus, DataVersion
+
+SECONDS_PER_YEAR = 365.25 * 24 * 60 * 60
+# Reactor attributes that rollups can be grouped by.
+GROUP_FIELDS = ('vendor', 'model', 'containment', 'type')
+
+
+def epoch(value):
+    """ Seconds since the epoch for a date or datetime. """
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    return calendar.timegm(value.timetuple())
+
+
+class StatusArrays(object):
+    """ Column arrays for every reactor status row in non-retracted events,
+    plus reactor attributes indexed the same way as `reactor_ids`.
+
+    """
+    def __init__(self):
+        reactors = list(Reactor.objects.order_by('id').values_list(
+            'id', 'operational_on', *GROUP_FIELDS))
+        self.reactor_ids = np.array([r[0] for r in reactors], dtype=np.int64)
+        self.operational = np.array([epoch(r[1]) for r in reactors], dtype=np.float64)
+        self.attributes = {}
+        for i, field in enumerate(GROUP_FIELDS):
+            self.attributes[field] = np.array([r[i + 2] for r in reactors], dtype=object)
+
+        rows = EventReactorStatus.objects.filter(event__retracted=False).values_list(
+            'event__event_num', 'event__event_time', 'reactor', 'initial_power',
+            'current_power', 'scram', 'critical')
+        columns = zip(*rows) or [()] * 7
+        self.event_nums = np.array(columns[0], dtype=np.int64)
+        self.event_times = np.array([epoch(t) for t in columns[1]], dtype=np.float64)
+        # Position of each row's reactor in the reactor arrays.
+        self.reactor_index = np.searchsorted(self.reactor_ids, np.array(columns[2], dtype=np.int64))
+        self.initial_power = np.array(columns[3], dtype=np.int32)
+        self.current_power = np.array(columns[4], dtype=np.int32)
+        self.scrammed = np.array([s not in ('', 'N') for s in columns[5]], dtype=bool)
+        self.critical = np.array(columns[6], dtype=bool)
+
+    def reactor_years(self):
+        """ Years each reactor was operating during the span covered by the
+        event data.
+
+        """
+        if not len(self.event_times):
+            return np.zeros(len(self.reactor_ids))
+        start = np.maximum(self.operational, self.event_times.min())
+        return np.clip(self.event_times.max() - start, 0, None) / SECONDS_PER_YEAR
+
+
+_arrays = None
+_results = {}
+_lock = threading.Lock()
+
+
+def cached(function):
+    """ Caches a rollup's results under the data version and its arguments.
+    The arrays are reloaded at the same time the cache is dropped.
+
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        global _arrays
+        version = kwargs.pop('version', None) or DataVersion.current()
+        etag = version.etag if version else None
+        key = (function.__name__, args, tuple(sorted(kwargs.items())))
+        with _lock:
+            if _arrays is None or _arrays[0] != etag:
+                _arrays = (etag, StatusArrays())
+                _results.clear()
+            if key not in _results:
+                _results[key] = function(_arrays[1], *args, **kwargs)
+            return _results[key]
+    return wrapper
+
+
+@cached
+def scram_rates(arrays, by='vendor'):
+    """ Scrams per reactor-year, grouped by a reactor attribute (one of
+    GROUP_FIELDS). Returns a list of dicts sorted by rate, highest first.
+
+    """
+    groups, group_of_reactor = np.unique(arrays.attributes[by].astype(str), return_inverse=True)
+    years = np.bincount(group_of_reactor, weights=arrays.reactor_years(),
+                        minlength=len(groups))
+    row_groups = group_of_reactor[arrays.reactor_index]
+    scrams = np.bincount(row_groups[arrays.scrammed], minlength=len(groups))
+    rates = np.where(years > 0, scrams / np.maximum(years, 1e-9), 0.0)
+    order = np.argsort(-rates, kind='mergesort')
+    return [{
+        by: groups[i],
+        'scrams': int(scrams[i]),
+        'reactor_years': round(float(years[i]), 2),
+        'rate': round(float(rates[i]), 4),
+    } for i in order]
+
+
+@cached
+def power_drops(arrays, min_drop=50):
+    """ Reactor status rows where power fell by more than `min_drop`
+    percentage points, biggest drops first.
+
+    """
+    drops = arrays.initial_power - arrays.current_power
+    rows = np.nonzero(drops > min_drop)[0]
+    rows = rows[np.argsort(-drops[rows], kind='mergesort')]
+    return [{
+        'event_num': int(arrays.event_nums[i]),
+        'reactor': int(arrays.reactor_ids[arrays.reactor_index[i]]),
+        'initial_power': int(arrays.initial_power[i]),
+        'current_power': int(arrays.current_power[i]),
+        'drop': int(drops[i]),
+        'scram': bool(arrays.scrammed[i]),
+    } for i in rows]
@@ -0,0 +1,8 @@
+from django.db.models.signals import post_syncdb
+
+from us_reactors import models, search, stats
+
+# The search table isn't a model, so syncdb needs to be told to create it.
+post_syncdb.connect(search.create_index, sender=models)
+# Count up events that were loaded before the stats tables existed.
+post_syncdb.connect(stats.rebuild_stats, sender=models)
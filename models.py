@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.localflavor.us import us_states
 
 # Most of these definitions come from the NRC's data dictionary for the
@@ -165,10 +167,10 @@ class EventNotification(models.Model):
     subject = models.CharField("report subject", max_length=255)
     body = models.TextField()
     emergency_status = models.CharField("emergency status", max_length=25)
-    report_time = models.DateTimeField("report submitted at")
-    event_time = models.DateTimeField("event time")
+    report_time = models.DateTimeField("report submitted at", db_index=True)
+    event_time = models.DateTimeField("event time", db_index=True)
     update_date = models.DateField("report last updated")   # TODO might change to DateTime
-    crawl_time = models.DateTimeField("report retrieved from NRC")
+    crawl_time = models.DateTimeField("report retrieved from NRC", db_index=True)
     retracted = models.BooleanField(default=False)
     reactors = models.ManyToManyField(Reactor, through='EventReactorStatus')
     facility = models.ForeignKey(Facility)
@@ -179,6 +181,9 @@ class EventNotification(models.Model):
     nrc_notified_by = models.CharField(max_length=100)
     hq_ops_officer = models.CharField(max_length=100)
     # TODO people, nrc_notified_by, hq_ops_officer, cfr10_sections
+    # There's also a composite index on (facility, event_time) for listing a
+    # facility's events newest first. Django can't declare those, so it's
+    # created in sql/eventnotification.sql.
     
     def __unicode__(self):
         return self.subject
@@ -217,4 +222,65 @@ class CFRSection(models.Model):
     title = models.CharField(max_length=50)
     
     def __unicode__(self):
-        return self.section + ' ' + self.title
\ No newline at end of file
+        return self.section + ' ' + self.title
+
+class EventStats(models.Model):
+    """ Running event totals, kept current by load_events.py as events are
+    loaded so they never have to be counted when a page is viewed.
+    
+    """
+    events = models.IntegerField("number of events", default=0)
+    scrams = models.IntegerField("events with a scram", default=0)
+    retractions = models.IntegerField("retracted events", default=0)
+    last_event_time = models.DateTimeField("most recent event", blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+class FacilityEventStats(EventStats):
+    """ Event totals for a facility. An event counts as a scram if any of
+    its reactors scrammed. """
+    facility = models.OneToOneField(Facility, related_name='event_stats')
+
+    def __unicode__(self):
+        return unicode(self.facility)
+
+class ReactorEventStats(EventStats):
+    """ Event totals for a single reactor. """
+    reactor = models.OneToOneField(Reactor, related_name='event_stats')
+
+    def __unicode__(self):
+        return unicode(self.reactor)
+
+class DataVersion(models.Model):
+    """ A single row that the loaders bump whenever they change anything.
+    Views use it for ETag/Last-Modified headers and as part of their cache
+    keys, so a load invalidates every cached response at once without the
+    views having to look at the event tables.
+    
+    """
+    version = models.IntegerField(default=0)
+    updated = models.DateTimeField()
+
+    @classmethod
+    def current(cls):
+        """ Returns the current version row, or None before the first load. """
+        try:
+            return cls.objects.get(pk=1)
+        except cls.DoesNotExist:
+            return None
+
+    @classmethod
+    def bump(cls):
+        """ Records that data has changed. Call inside the loader's transaction. """
+        now = timezone.now()
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1, updated=now):
+            cls.objects.create(pk=1, version=1, updated=now)
+
+    @property
+    def etag(self):
+        # The timestamp makes tags unique even if the table is ever reset.
+        return '%d-%s' % (self.version, self.updated.strftime('%Y%m%d%H%M%S%f'))
+
+    def __unicode__(self):
+        return unicode(self.version)
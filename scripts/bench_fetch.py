@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+""" Benchmark for the threaded page fetcher. Starts a local HTTP server that
+stands in for the NRC site, answering every request after a fixed delay, then
+fetches the same set of pages with different worker counts and request rates.
+
+usage: bench_fetch.py [pages] [latency-seconds]
+
+"""
+
+import sys
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import fetcher
+import events_scraper
+
+PAGE_BODY = "<html><body><pre>" + ("x" * 79 + "\n") * 400 + "</pre></body></html>"
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+    latency = 0.2
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(PAGE_BODY)))
+        self.end_headers()
+        self.wfile.write(PAGE_BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(latency):
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.latency = latency
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def run(base_url, pages, workers, rate):
+    urls = [base_url + '/%d/%den.html' % (2002, 20020101 + i) for i in range(pages)]
+    events_scraper.THROTTLE = fetcher.HostThrottle(rate)
+    scheduler = fetcher.FetchScheduler(events_scraper.fetch_page, workers)
+    start = time.time()
+    for url, body in scheduler.map(urls):
+        # Simulate a little parsing work on the main thread.
+        body.count('\n')
+    return time.time() - start
+
+
+def main(argv):
+    pages = int(argv[1]) if len(argv) > 1 else 40
+    latency = float(argv[2]) if len(argv) > 2 else 0.2
+    server = start_server(latency)
+    base_url = 'http://127.0.0.1:%d' % (server.server_address[1])
+    # Never touch the real cache while benchmarking.
+    events_scraper.PAGE_CACHE_BASE = None
+
+    print "%d pages, %.2fs simulated latency" % (pages, latency)
+    print "%8s %8s %10s %10s" % ('workers', 'rate', 'seconds', 'pages/sec')
+    for workers, rate in [(1, 0), (4, 0), (8, 0), (1, 10), (4, 10), (8, 10)]:
+        elapsed = run(base_url, pages, workers, rate)
+        print "%8d %8s %10.2f %10.1f" % (workers, rate or '-', elapsed, pages / elapsed)
+    server.shutdown()
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+
+""" Per-page speed comparison of the lxml and html5lib engines for HTML event
+pages. Also checks that both engines find the same events on every page.
+
+usage: bench_parse.py [page.html ...]
+
+With no arguments, runs over the HTML pages in the fixtures directory.
+
+"""
+
+import os
+import sys
+import glob
+import time
+import StringIO
+
+import events_scraper
+
+FIXTURE_PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'fixtures', 'pages')
+REPEAT = 5
+
+
+def time_engine(url, body, engine):
+    """ Returns the best time out of REPEAT runs, and the events from the
+    last run.
+
+    """
+    best = None
+    # The parser prints a line per event, which would swamp the results.
+    real_stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+    try:
+        for i in range(REPEAT):
+            start = time.time()
+            events = events_scraper.parse_event_page_html(url, body, engine)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        sys.stdout = real_stdout
+    for event in events:
+        del event.crawl_time
+    return best, events
+
+
+def main(argv):
+    paths = argv[1:] or sorted(glob.glob(os.path.join(FIXTURE_PAGES, '*en.html')))
+    # Only pages after the switch to HTML reports use this parser.
+    paths = [p for p in paths if int(os.path.basename(p)[0:8]) > 20030815]
+    print "%-20s %10s %10s %8s %7s" % ('page', 'html5lib', 'lxml', 'speedup', 'parity')
+    totals = [0.0, 0.0]
+    for path in paths:
+        name = os.path.basename(path)
+        with open(path) as f:
+            body = f.read()
+        url = events_scraper.EVENT_DAY_URL_TMPL % (name[0:4], name[0:8])
+        slow, slow_events = time_engine(url, body, 'html5lib')
+        fast, fast_events = time_engine(url, body, 'lxml')
+        totals[0] += slow
+        totals[1] += fast
+        print "%-20s %9.1fms %9.1fms %7.1fx %7s" % (
+            name, slow * 1000, fast * 1000, slow / fast,
+            'ok' if slow_events == fast_events else 'DIFFER')
+    if paths:
+        print "%-20s %9.1fms %9.1fms %7.1fx" % (
+            'total', totals[0] * 1000, totals[1] * 1000, totals[0] / totals[1])
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+""" Benchmark suite for the event page parsers, run over the pages in the
+fixtures directory. Measures pages/sec, events/sec and peak memory for each
+stage and compares them against the saved baseline, exiting with status 1 if
+any result regressed by more than the threshold.
+
+usage: bench_suite.py [--save] [--threshold PCT] [--repeat N] [page.html ...]
+
+Stages:
+  text           parse_event_page_text on pre-2003 text pages
+  html           parse_event_page_html on HTML pages
+  process_event  process_event on the raw fields the parsers extract
+  serialize      JSON serialization of the events, as the event files are
+                 written
+
+Both parsers call process_event on every event, so the parser timings include
+it; the process_event stage shows how much of that it accounts for.
+
+Each stage runs in a fresh process so its peak memory isn't hidden by an
+earlier stage. Throughput is the best of `repeat` runs. Baselines depend on the
+machine, so run with --save after checking out on a new one.
+
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import resource
+import StringIO
+import subprocess
+
+import records
+import events_scraper
+
+FIXTURE_PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'fixtures', 'pages')
+BASELINE_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                              '..', 'fixtures', 'bench_baseline.json'))
+STAGES = ['text', 'html', 'process_event', 'serialize']
+REPEAT = 5
+# Allowed slowdown (or memory growth) before a result counts as a regression.
+THRESHOLD = 0.25
+# Memory growth under this many KB is noise, whatever the percentage.
+MEMORY_SLACK_KB = 2048
+
+
+def load_pages(paths):
+    """ Returns (url, body) for each page. """
+    pages = []
+    for path in paths:
+        name = os.path.basename(path)
+        with open(path) as f:
+            pages.append((events_scraper.EVENT_DAY_URL_TMPL % (name[0:4], name[0:8]), f.read()))
+    return pages
+
+
+def plain_copy(value):
+    """ Copies the records, dicts, lists and tuples in an event. Strings from
+    the HTML parser are still attached to the tree, so they're copied as
+    plain unicode.
+
+    """
+    if isinstance(value, records.Record):
+        return type(value)(**plain_copy(value.fields()))
+    if isinstance(value, records.Person):
+        return value
+    if isinstance(value, dict):
+        return dict((k, plain_copy(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return type(value)(plain_copy(v) for v in value)
+    if isinstance(value, unicode):
+        return unicode(value)
+    return value
+
+
+def raw_events(pages):
+    """ Parses `pages` and returns the events as the parsers pass them to
+    process_event, before any fields are converted.
+
+    """
+    raw = []
+    process_event = events_scraper.process_event
+    def recording_process_event(event):
+        raw.append(plain_copy(event))
+        process_event(event)
+    events_scraper.process_event = recording_process_event
+    try:
+        for url, body in pages:
+            events_scraper.parse_page(url, body)
+    finally:
+        events_scraper.process_event = process_event
+    return raw
+
+
+def parsed_events(pages):
+    events = []
+    for url, body in pages:
+        events.extend(events_scraper.parse_page(url, body))
+    return events
+
+
+def stage_runner(stage, pages):
+    """ Returns a function that runs `stage` once over `pages` and returns the
+    number of events it handled, plus a function to call before each run.
+
+    """
+    if stage in ('text', 'html'):
+        parse = (events_scraper.parse_event_page_text if stage == 'text'
+                 else events_scraper.parse_event_page_html)
+        pages = [p for p in pages if (events_scraper.parser_engine(p[0]) == 'text') == (stage == 'text')]
+        def run():
+            return sum(len(parse(url, body)) for url, body in pages)
+        return run, lambda: None, len(pages)
+    if stage == 'process_event':
+        raw = raw_events(pages)
+        # process_event changes events in place, so every run gets fresh copies.
+        batch = []
+        def prepare():
+            batch[:] = [plain_copy(event) for event in raw]
+        def run():
+            for event in batch:
+                events_scraper.process_event(event)
+            return len(batch)
+        return run, prepare, len(pages)
+    if stage == 'serialize':
+        events = parsed_events(pages)
+        def run():
+            for event in events:
+                json.dumps(event, indent=4, default=events_scraper.freeze_time)
+            return len(events)
+        return run, lambda: None, len(pages)
+    raise ValueError("Unknown stage: %s" % (stage))
+
+
+def max_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, Mac OS X reports bytes.
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss
+
+
+def run_stage(stage, pages, repeat=REPEAT):
+    """ Runs a stage in this process and returns its results. Peak memory is
+    the growth in the process's maximum resident size while the stage ran, so
+    it's only meaningful in a process that hasn't done anything bigger yet.
+    For process_event and serialize it includes parsing the pages for their
+    input.
+
+    """
+    # The parsers print a line per event, which would swamp the results.
+    real_stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+    try:
+        start_rss = max_rss_kb()
+        run, prepare, page_count = stage_runner(stage, pages)
+        best = None
+        for i in range(repeat):
+            prepare()
+            # Start every run with an empty timestamp cache, so later runs
+            # don't look faster just because the earlier ones filled it.
+            events_scraper._time_cache.clear()
+            start = time.time()
+            event_count = run()
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        sys.stdout = real_stdout
+    best = max(best, 1e-9)
+    return {
+        'pages': page_count,
+        'events': event_count,
+        'seconds': round(best, 6),
+        'pages_per_sec': round(page_count / best, 1),
+        'events_per_sec': round(event_count / best, 1),
+        'peak_kb': max_rss_kb() - start_rss,
+    }
+
+
+def measure(stage, paths, repeat=REPEAT):
+    """ Runs a stage in a child process and returns its results. """
+    command = [sys.executable, os.path.abspath(__file__), '--stage', stage,
+               '--repeat', str(repeat)] + list(paths)
+    return json.loads(subprocess.check_output(command))
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """ Returns a message for each result that's worse than the baseline by
+    more than `threshold` (a fraction).
+
+    """
+    problems = []
+    for stage, result in sorted(results.items()):
+        base = baseline.get(stage)
+        if not base:
+            continue
+        for field in ('pages_per_sec', 'events_per_sec'):
+            if base[field] and result[field] < base[field] * (1 - threshold):
+                problems.append("%s: %s fell from %.1f to %.1f" % (
+                    stage, field, base[field], result[field]))
+        limit = max(base['peak_kb'] * (1 + threshold), base['peak_kb'] + MEMORY_SLACK_KB)
+        if result['peak_kb'] > limit:
+            problems.append("%s: peak_kb rose from %d to %d" % (
+                stage, base['peak_kb'], result['peak_kb']))
+    return problems
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the event page parsers.")
+    parser.add_argument('pages', nargs='*', metavar='page.html')
+    parser.add_argument('--save', action='store_true',
+                        help="save the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD * 100,
+                        help="percent regression that fails the run (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help="runs per stage; the best one counts (default: %(default)s)")
+    parser.add_argument('--stage', choices=STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv[1:])
+    paths = args.pages or sorted(glob.glob(os.path.join(FIXTURE_PAGES, '*en.html')))
+
+    # Child process for a single stage: print the results for measure().
+    if args.stage:
+        print json.dumps(run_stage(args.stage, load_pages(paths), args.repeat))
+        return 0
+
+    results = {}
+    print "%-14s %6s %7s %10s %11s %9s" % ('stage', 'pages', 'events', 'pages/s', 'events/s',
+                                           'peak KB')
+    for stage in STAGES:
+        result = results[stage] = measure(stage, paths, args.repeat)
+        print "%-14s %6d %7d %10.1f %11.1f %9d" % (
+            stage, result['pages'], result['events'], result['pages_per_sec'],
+            result['events_per_sec'], result['peak_kb'])
+
+    if args.save:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print "Saved baseline to %s" % (BASELINE_PATH)
+        return 0
+    if not os.path.exists(BASELINE_PATH):
+        print "No baseline yet; run with --save to create one."
+        return 0
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    problems = compare(results, baseline, args.threshold / 100.0)
+    for problem in problems:
+        print "REGRESSION %s" % (problem)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
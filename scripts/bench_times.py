@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+""" Speed and parity check for convert_time. Parses every page in the page
+cache (or the given pages) to collect the arguments convert_time is called
+with, then times the fast paths against plain dateutil and reports any
+timestamps where the two disagree.
+
+usage: bench_times.py [page.html ...]
+
+"""
+
+import os
+import sys
+import time
+import StringIO
+
+import events_scraper
+
+REPEAT = 5
+
+
+def collect_timestamps(pages):
+    """ Returns the set of argument tuples convert_time is called with while
+    parsing `pages`, a list of (url, body) tuples.
+
+    """
+    seen = set()
+    convert_time = events_scraper.convert_time
+    def recording_convert_time(date_part, time_part=None, use_dst=True):
+        seen.add((date_part, time_part, use_dst))
+        return convert_time(date_part, time_part, use_dst)
+    # The parser prints a line per event, which would swamp the results.
+    real_stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+    events_scraper.convert_time = recording_convert_time
+    try:
+        for url, body in pages:
+            events_scraper.parse_page(url, body)
+    finally:
+        events_scraper.convert_time = convert_time
+        sys.stdout = real_stdout
+    return seen
+
+
+def mismatches(timestamps):
+    """ Returns the timestamps where convert_time and dateutil disagree, as
+    (args, fast result, dateutil result) tuples.
+
+    """
+    events_scraper._time_cache.clear()
+    found = []
+    for args in sorted(timestamps):
+        fast = events_scraper.convert_time(*args)
+        slow = events_scraper._dateutil_convert_time(*args)
+        if fast != slow:
+            found.append((args, fast, slow))
+    return found
+
+
+def time_calls(convert, calls):
+    best = None
+    for i in range(REPEAT):
+        events_scraper._time_cache.clear()
+        start = time.time()
+        for args in calls:
+            convert(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv):
+    if argv[1:]:
+        pages = []
+        for path in argv[1:]:
+            name = os.path.basename(path)
+            with open(path) as f:
+                pages.append((events_scraper.EVENT_DAY_URL_TMPL % (name[0:4], name[0:8]), f.read()))
+    else:
+        urls = events_scraper.cached_page_urls(events_scraper.EVENT_INDEX_YEARS)
+        pages = ((url, events_scraper.cached_page(url)) for url in urls)
+    timestamps = collect_timestamps(pages)
+    print "%d distinct timestamps" % (len(timestamps))
+    # Repeat each timestamp a few times, like a real parse does.
+    calls = sorted(timestamps) * 4
+    slow = time_calls(events_scraper._dateutil_convert_time, calls)
+    fast = time_calls(events_scraper.convert_time, calls)
+    print "dateutil:     %8.1fms" % (slow * 1000)
+    print "convert_time: %8.1fms  (%.1fx)" % (fast * 1000, slow / fast)
+    found = mismatches(timestamps)
+    for args, fast_result, slow_result in found:
+        print "DIFFER %r: %r != %r" % (args, fast_result, slow_result)
+    print "parity: %s" % ('ok' if not found else '%d differ' % len(found))
+    return 1 if found else 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
@@ -0,0 +1,234 @@
+""" Canonical record of every event, keyed by NRC event number.
+
+An event shows up on a new daily page each time it's updated or retracted, and
+each of those pages produces its own output (see event_writer.py). The index
+keeps track of all the outputs for an event number and merges them into a
+single canonical record: the fields come from the newest page, and the
+`updates` from every page are combined in timestamp order. The url and
+crawl_time are those of the page that last changed the record.
+
+Canonical records are appended, one per line, to a JSON Lines file, and the
+index holds their offsets, so looking up the latest version of an event is a
+dict lookup and a seek. Seeing a page version again with the same content
+changes nothing, and a new page that adds nothing to the record only adds it
+to the list of versions. Replaced records stay in the file until compact().
+
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+from records import Event
+
+# Fields that differ between sightings of an event without the event itself
+# having changed.
+VOLATILE_FIELDS = ('url', 'crawl_time')
+
+
+class EventIndex(object):
+    """ Index of canonical event records. Like ShardWriter, records are
+    appended as they change and the index is only saved on close, after
+    everything it points to has been written.
+
+    """
+    INDEX_NAME = 'events-by-number.json'
+    RECORDS_NAME = 'events-by-number.jsonl'
+
+    def __init__(self, base, default=None):
+        self.base = base
+        self.default = default
+        self.index_path = os.path.join(base, self.INDEX_NAME)
+        self.records_path = os.path.join(base, self.RECORDS_NAME)
+        # event number (a string, as in the JSON) ->
+        #     {'record': [offset, length], 'latest': output name,
+        #      'versions': {output name: digest}}
+        try:
+            with open(self.index_path) as f:
+                self.entries = json.load(f)
+        except IOError:
+            self.entries = {}
+        self.records = None
+        self.changed = False
+
+    def add(self, name, event):
+        """ Adds the event written as output `name` ("<event number>-<page
+        date>"). Returns "new" for the first version of an event, "updated"
+        if the canonical record changed, "unchanged" if it didn't, or "seen"
+        if this exact version was already in the index.
+
+        """
+        record = json.loads(json.dumps(event, default=self.default))
+        digest = version_digest(record)
+        key = str(record['event_number'])
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = {
+                'record': self._append(record),
+                'latest': name,
+                'versions': {name: digest},
+            }
+            self.changed = True
+            return 'new'
+        if entry['versions'].get(name) == digest:
+            return 'seen'
+        entry['versions'][name] = digest
+        newer = page_date(name) >= page_date(entry['latest'])
+        if newer:
+            entry['latest'] = name
+        self.changed = True
+        current = self._read(entry['record'])
+        merged = merge(current, record, newer)
+        if strip_volatile(merged) == strip_volatile(current):
+            return 'unchanged'
+        entry['record'] = self._append(merged)
+        return 'updated'
+
+    def add_outputs(self, writer):
+        """ Adds every output a writer (see event_writer.py) already has,
+        oldest page first. Used to fill in a new index for an events directory
+        that was written before there was one.
+
+        """
+        for name in sorted(writer.names(), key=page_date):
+            self.add(name, writer.read(name))
+
+    def remove(self, name):
+        """ Forgets an output that's no longer produced. The canonical record
+        is dropped with the event's last version; otherwise it's left as is,
+        since the removed version can't be taken back out of it.
+
+        """
+        number = name.split('-')[0]
+        entry = self.entries.get(number)
+        if not entry or name not in entry['versions']:
+            return
+        del entry['versions'][name]
+        if not entry['versions']:
+            del self.entries[number]
+        elif entry['latest'] == name:
+            entry['latest'] = max(entry['versions'], key=page_date)
+        self.changed = True
+
+    def latest(self, event_number):
+        """ The canonical record for an event number as an Event, or None. """
+        entry = self.entries.get(str(event_number))
+        if entry is None:
+            return None
+        return Event.from_dict(self._read(entry['record']))
+
+    def versions(self, event_number):
+        """ Output names of every page version of an event, oldest first. """
+        entry = self.entries.get(str(event_number))
+        return sorted(entry['versions'], key=page_date) if entry else []
+
+    def events(self):
+        """ Generator that yields every canonical record, in event number
+        order.
+
+        """
+        if not self.entries:
+            return
+        self._flush()
+        with open(self.records_path, 'rb') as f:
+            for number in sorted(self.entries, key=int):
+                offset, length = self.entries[number]['record']
+                f.seek(offset)
+                yield Event.from_dict(json.loads(f.read(length)))
+
+    def close(self):
+        """ Closes the records file and saves the index. """
+        if self.records:
+            self.records.close()
+            self.records = None
+        if self.changed:
+            self._save_index()
+            self.changed = False
+
+    def compact(self):
+        """ Rewrites the records file with only the current records. """
+        self.close()
+        if not os.path.exists(self.records_path):
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.base, suffix='.tmp')
+        position = 0
+        with open(self.records_path, 'rb') as old:
+            with os.fdopen(fd, 'wb') as new:
+                for entry in sorted(self.entries.values(), key=lambda e: e['record'][0]):
+                    offset, length = entry['record']
+                    old.seek(offset)
+                    new.write(old.read(length))
+                    entry['record'] = [position, length]
+                    position += length
+        os.rename(tmp, self.records_path)
+        self._save_index()
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        if self.records is None:
+            self.records = open(self.records_path, 'ab')
+            self.records.seek(0, os.SEEK_END)
+        offset = self.records.tell()
+        self.records.write(line)
+        return [offset, len(line)]
+
+    def _read(self, location):
+        self._flush()
+        offset, length = location
+        with open(self.records_path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def _flush(self):
+        if self.records:
+            self.records.flush()
+
+    def _save_index(self):
+        # Write to a temp file and rename so the index is never left
+        # half-written.
+        fd, tmp = tempfile.mkstemp(dir=self.base, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.entries, f, separators=(',', ':'))
+        os.rename(tmp, self.index_path)
+
+
+def page_date(name):
+    """ The page date from an output name, as a YYYYMMDD int. """
+    return int(name.split('-')[1])
+
+
+def strip_volatile(record):
+    return dict((k, v) for k, v in record.iteritems() if k not in VOLATILE_FIELDS)
+
+
+def version_digest(record):
+    """ SHA-1 of an event's JSON, leaving out the fields that change with
+    every crawl.
+
+    """
+    values = dict(record)
+    values.pop('crawl_time', None)
+    return hashlib.sha1(json.dumps(values, sort_keys=True)).hexdigest()
+
+
+def merge(current, record, newer):
+    """ Merges a version of an event into its canonical record. Fields come
+    from whichever is from the newer page; updates from both are combined,
+    keeping the newer text of any that appear in both, and sorted by
+    timestamp. Updates without a timestamp (the original report, on pages
+    whose headers have none) stay ahead of the timed ones.
+
+    """
+    newest, oldest = (record, current) if newer else (current, record)
+    merged = dict(newest)
+    updates = []
+    seen = set()
+    for update in newest.get('updates', []) + oldest.get('updates', []):
+        key = (update['time'], update['header'])
+        if key not in seen:
+            seen.add(key)
+            updates.append(update)
+    if updates:
+        merged['updates'] = sorted(updates, key=lambda u: u['time'] or '')
+    return merged
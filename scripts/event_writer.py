@@ -0,0 +1,207 @@
+""" Output backends for parsed events.
+
+Every event from a daily page is identified by an output name made from the
+event number and the page date, like "43989-20080228". Two layouts are
+available:
+
+FileWriter writes each event to its own pretty-printed JSON file named after
+the output, which is easy to read by hand but means tens of thousands of tiny
+files for the full corpus.
+
+ShardWriter appends compact events, one per line, to JSON Lines shards split
+by year (and optionally by size), and keeps an index of output name ->
+(shard, offset, length) so any single event can be read back without scanning.
+
+"""
+
+import os
+import re
+import json
+import tempfile
+
+# Shard file names, "events-<year>-<number>.jsonl". Other JSON Lines files in
+# the same directory, like the event index's, are left alone.
+SHARD_NAME_RE = re.compile(r'^events-\d{4}-\d{4}\.jsonl$')
+# Event file names, "<event number>-<page date>.json".
+EVENT_FILE_RE = re.compile(r'^\d+-\d+\.json$')
+
+
+class FileWriter(object):
+    """ One pretty-printed JSON file per event. """
+    def __init__(self, base, default=None):
+        self.base = base
+        self.default = default
+
+    def write(self, page_date, events):
+        """ Writes the events from one daily page. Returns the output names. """
+        names = []
+        for event in events:
+            name = '%s-%s' % (event.event_number, page_date)
+            with open(self._path(name), 'w') as f:
+                json.dump(event, f, indent=4, default=self.default)
+            names.append(name)
+        return names
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def names(self):
+        """ Output names of every event on disk. """
+        return [n[:-5] for n in os.listdir(self.base) if EVENT_FILE_RE.match(n)]
+
+    def read(self, name):
+        """ Reads a single event back by its output name. """
+        with open(self._path(name)) as f:
+            return json.load(f)
+
+    def remove(self, name):
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+    def close(self):
+        pass
+
+    def _path(self, name):
+        return os.path.join(self.base, name + '.json')
+
+
+class ShardWriter(object):
+    """ Appends events to per-year JSON Lines shards. Lines are buffered and
+    written in batches; the index is only saved on close, after everything
+    it points to has been flushed, so a crash never leaves the index pointing
+    at data that isn't there.
+
+    Replacing or removing an output only changes the index. The old line stays
+    in its shard until compact() rewrites the shards.
+
+    """
+    INDEX_NAME = 'events-index.json'
+    # Number of buffered lines per shard before they're written out.
+    FLUSH_EVERY = 200
+
+    def __init__(self, base, default=None, max_bytes=None):
+        self.base = base
+        self.default = default
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(base, self.INDEX_NAME)
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except IOError:
+            self.index = {}
+        # Open shards, keyed by year: [shard name, file, end offset, buffer].
+        self.shards = {}
+        self.changed = False
+
+    def write(self, page_date, events):
+        """ Writes the events from one daily page. Returns the output names. """
+        year = str(page_date)[0:4]
+        names = []
+        for event in events:
+            name = '%s-%s' % (event.event_number, page_date)
+            line = json.dumps(event, default=self.default, separators=(',', ':')) + '\n'
+            shard = self._shard(year, len(line))
+            self.index[name] = [shard[0], shard[2], len(line)]
+            shard[2] += len(line)
+            shard[3].append(line)
+            if len(shard[3]) >= self.FLUSH_EVERY:
+                self._flush(shard)
+            names.append(name)
+        self.changed = True
+        return names
+
+    def exists(self, name):
+        return name in self.index
+
+    def names(self):
+        """ Output names of every event in the index. """
+        return self.index.keys()
+
+    def remove(self, name):
+        if self.index.pop(name, None):
+            self.changed = True
+
+    def read(self, name):
+        """ Reads a single event back by its output name. """
+        shard_name, offset, length = self.index[name]
+        for shard in self.shards.values():
+            if shard[0] == shard_name:
+                self._flush(shard)
+        with open(os.path.join(self.base, shard_name), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def close(self):
+        """ Flushes all shards and saves the index. """
+        for shard in self.shards.values():
+            self._flush(shard)
+            shard[1].close()
+        self.shards = {}
+        if self.changed:
+            self._save_index()
+            self.changed = False
+
+    def compact(self):
+        """ Rewrites every shard with only the lines the index still points
+        to, dropping lines for outputs that were replaced or removed.
+
+        """
+        self.close()
+        by_shard = {}
+        for name, (shard_name, offset, length) in self.index.items():
+            by_shard.setdefault(shard_name, []).append((offset, length, name))
+        for shard_name in os.listdir(self.base):
+            if SHARD_NAME_RE.match(shard_name) and shard_name not in by_shard:
+                os.remove(os.path.join(self.base, shard_name))
+        for shard_name, entries in by_shard.items():
+            path = os.path.join(self.base, shard_name)
+            fd, tmp = tempfile.mkstemp(dir=self.base, suffix='.tmp')
+            position = 0
+            with open(path, 'rb') as old:
+                with os.fdopen(fd, 'wb') as new:
+                    for offset, length, name in sorted(entries):
+                        old.seek(offset)
+                        new.write(old.read(length))
+                        self.index[name] = [shard_name, position, length]
+                        position += length
+            os.rename(tmp, path)
+        self._save_index()
+
+    def _shard(self, year, size):
+        """ Returns the open shard for a year, moving on to a new shard file
+        if adding `size` bytes would go over max_bytes.
+
+        """
+        shard = self.shards.get(year)
+        if shard and self.max_bytes and shard[2] and shard[2] + size > self.max_bytes:
+            self._flush(shard)
+            shard[1].close()
+            shard = None
+        if not shard:
+            number = 0 if year not in self.shards else int(self.shards[year][0][-10:-6]) + 1
+            # Skip past shards that are already full from earlier runs.
+            while True:
+                shard_name = 'events-%s-%04d.jsonl' % (year, number)
+                path = os.path.join(self.base, shard_name)
+                end = os.path.getsize(path) if os.path.exists(path) else 0
+                if not self.max_bytes or not end or end + size <= self.max_bytes:
+                    break
+                number += 1
+            shard = self.shards[year] = [shard_name, open(path, 'ab'), end, []]
+        return shard
+
+    def _flush(self, shard):
+        if shard[3]:
+            shard[1].write(''.join(shard[3]))
+            shard[1].flush()
+            del shard[3][:]
+
+    def _save_index(self):
+        # Write to a temp file and rename so the index is never left
+        # half-written.
+        fd, tmp = tempfile.mkstemp(dir=self.base, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.index, f, separators=(',', ':'))
+        os.rename(tmp, self.index_path)
@@ -1,24 +1,51 @@
 #!/usr/bin/python
 
+import os
 import sys
 import re
-import json
 import urllib2
 import urlparse
 import datetime
-from time import sleep
+import argparse
+import hashlib
+import itertools
+import threading
+import multiprocessing
 
 import pprint
 
 import dateutil.parser
 import dateutil.tz
-from bs4 import BeautifulSoup
-from bs4.element import Comment
+from bs4 import BeautifulSoup, SoupStrainer, FeatureNotFound
+from bs4.element import Comment, Tag
+
+import fetcher
+import http_session
+import instrument
+import page_cache
+import event_writer
+import event_index
+from manifest import Manifest
+from records import Record, Event, ReactorStatus, Update, Person, intern_string, section_tuple
 
 
 PAGE_CACHE_BASE = "/Users/keith/scratch/reactors/raw/"
 PARSED_EVENTS_BASE = "/Users/keith/scratch/reactors/events/"
 
+# How parsed events are written. "files" gives each event its own JSON file;
+# "jsonl" appends them to per-year JSON Lines shards with an offset index. See
+# event_writer.py. Shards roll over to a new file past SHARD_MAX_BYTES, unless
+# it's None.
+OUTPUT_FORMAT = 'files'
+SHARD_MAX_BYTES = None
+
+# How long a cached page can be used before it's revalidated with the server,
+# in seconds. Digest pages gain links every working day. Daily pages rarely
+# change after they're posted, so they're only checked occasionally. None
+# means never revalidate.
+DIGEST_MAX_AGE = 12 * 60 * 60
+EVENT_PAGE_MAX_AGE = 30 * 24 * 60 * 60
+
 EVENT_INDEX_URL_TMPL = "http://www.nrc.gov/reading-rm/doc-collections/event-status/event/%d/"
 EVENT_DAY_URL_TMPL = "http://www.nrc.gov/reading-rm/doc-collections/event-status/event/%s/%sen.html"
 #EVENT_INDEX_YEARS = range(1999, 2013)
@@ -26,9 +53,52 @@ EVENT_INDEX_YEARS = [2002]
 
 # Days with weird problems that are easier to just fix manually. See the
 # cleanup_notes.md file for what needs to be done to each. Easiest way is to
-# try running once, then modify the cached HTML file and run again.
+# save a copy of the page in the "manual" directory under PAGE_CACHE_BASE,
+# edit it, then run again with the date on the command line.
 SKIP_DAYS = [20040923, 20061018, 20081007, 20081006, 20090408, 20021003, 20020426]
 
+# Downloads run in a pool of worker threads so parsing can overlap with waiting
+# on the server. The request rate is limited per host independently of the
+# number of workers, so raising FETCH_WORKERS doesn't hit NRC any harder.
+FETCH_WORKERS = 4
+FETCH_RATE = 1.0        # requests per second, per host
+THROTTLE = fetcher.HostThrottle(FETCH_RATE)
+# Connections to the NRC site are kept alive between pages. Server errors and
+# timeouts are retried FETCH_RETRIES times, waiting about FETCH_BACKOFF seconds
+# before the first retry and twice as long before each one after that.
+FETCH_TIMEOUT = 60
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 1.0
+SESSION = http_session.HTTPSession(FETCH_TIMEOUT, FETCH_RETRIES, FETCH_BACKOFF,
+                                   pool_size=FETCH_WORKERS)
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+# Bump this whenever a change to the parsers would change their output, so
+# pages parsed by the old code get parsed again.
+PARSER_VERSION = 1
+
+# Engine used to build trees for HTML event pages. "lxml" is much faster and
+# falls back to html5lib for any page whose tree doesn't have the expected
+# layout. "html5lib" always uses the slow but reliable parser.
+HTML_ENGINE = 'lxml'
+
+# Event entries on HTML pages start with an anchor named like "en43989".
+EVENT_ANCHOR_RE = re.compile(r'^en\d+')
+
+# Patterns for pulling apart the pre-2003 text reports. These run on every line
+# of every page, so they're compiled once up front.
+TEXT_EVENT_LINE_RE = re.compile(r'^\|[^|]+\|Event Number:\s*\d+', re.U)
+TEXT_TYPE_LINE_RE = re.compile(r'\|([A-Za-z ]+?)\s+\|Event Number:\s*(\d+)', re.U)
+TEXT_PREAMBLE_LIST_RE = re.compile(r'\d{5}\s*(?:\d{5}\s*)*$')
+TEXT_FACILITY_RE = re.compile(r'([-A-Za-z0-9 ()]+?)\s*REGION:\s+(\d+)', re.U)
+TEXT_UNIT_RE = re.compile(r'([][0-9 ]+?)\s{2,}STATE:\s+(\w+)', re.U)
+TEXT_PERSON_SPLIT_RE = re.compile(r'(?u)\s{2,}')
+TEXT_STATUS_ROW_RE = re.compile(r'\|(\d+)\s+([A-Za-z/]+)\s+(\w+)\s+(\d+)\s+([A-Za-z ]+)\s*\|(\d+)\s+([A-Za-z ]+)\s+\|', re.U)
+TEXT_COLUMN_SPLIT_RE = re.compile(r'\||\+')
+TEXT_CELL_RE = re.compile(r'[^-]', re.U)
+
 # Translate field labels used in original report to internal names.
 # All fields are parsed and stored as strings, unless otherwise noted.
 REPORT_FIELDS = {
@@ -51,8 +121,8 @@ REPORT_FIELDS = {
     'event date': 'event_date',          # datetime object
     'event time': 'event_time',          # merged with event_date
     'last update date': 'update_date',   # date object
-    'person (organization)': 'people',   # list of tuples (person, organization)
-    'reactor status': 'reactor_status',  # list of dicts. see REACTOR_STATUS_FIELDS
+    'person (organization)': 'people',   # list of Person (name, organization)
+    'reactor status': 'reactor_status',  # list of ReactorStatus. see REACTOR_STATUS_FIELDS
     'scram code': 'scram',               # text, though might change
     'rx crit': 'critical',               # boolean
     'initial pwr': 'initial_power',      # int
@@ -62,6 +132,9 @@ REPORT_FIELDS = {
     'subject': 'subject',
     'event text': 'body',                # list of strings, one per paragraph
     }
+# Event fields with few distinct values, which are shared between events
+# instead of stored separately in each one (see records.py).
+INTERNED_FIELDS = set(['facility', 'nrc_notified_by', 'hq_ops_officer', 'emergency'])
 # Internal column names for the reactor status table.
 REACTOR_STATUS_FIELDS = [
     'unit', 'scram', 'critical',
@@ -92,46 +165,296 @@ TIMEZONES['CDT'] = TIMEZONES['CST']
 TIMEZONES['MDT'] = TIMEZONES['MST']
 TIMEZONES['PDT'] = TIMEZONES['PST']
 
+# Formats convert_time handles without dateutil: dates like "02/27/2008" or
+# "12/03/01", and times like "10:30 [CST]", "03:55[MST]" or "14:20 EST".
+TIME_DATE_RE = re.compile(r'\s*(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})\s*$', re.U)
+TIME_CLOCK_RE = re.compile(r'\s*(\d{1,2}):(\d{2})\s*(?:\[\s*([A-Z]+)\s*\]|([A-Z]+))?\s*$', re.U)
+TIME_DIGIT_RE = re.compile(r'\d', re.U)
+# Memo of convert_time results. It's simply emptied when it fills up.
+TIME_CACHE_SIZE = 4096
+_time_cache = {}
+
 
 def main(argv=None):
+    global THROTTLE, SESSION, HTML_ENGINE, OUTPUT_FORMAT
+    parser = argparse.ArgumentParser(description="Scrape NRC event reports.")
     # Pass individual dates as YYYYMMDD to process only those pages, regardless
     # of whether they're skipped by the regular loop.
-    if len(argv) > 1:
-        argv.pop(0)
+    parser.add_argument('dates', nargs='*', metavar='YYYYMMDD')
+    parser.add_argument('--workers', type=int, default=FETCH_WORKERS,
+                        help="number of concurrent downloads")
+    parser.add_argument('--rate', type=float, default=FETCH_RATE,
+                        help="max requests per second to each host (0 for no limit)")
+    parser.add_argument('--retries', type=int, default=FETCH_RETRIES,
+                        help="times to retry a request after a server error or timeout")
+    parser.add_argument('--engine', choices=['lxml', 'html5lib'], default=HTML_ENGINE,
+                        help="parser for HTML event pages")
+    parser.add_argument('--output', choices=['files', 'jsonl'], default=OUTPUT_FORMAT,
+                        help="one JSON file per event, or JSON Lines shards")
+    parser.add_argument('--parse-only', action='store_true',
+                        help="re-parse cached pages without touching the network")
+    parser.add_argument('--force', action='store_true',
+                        help="parse every page even if it hasn't changed")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="parser processes for --parse-only (default: one per core)")
+    parser.add_argument('--metrics-json', metavar='FILE',
+                        help="write stage timings and counters to FILE as JSON")
+    parser.add_argument('--metrics-prom', metavar='FILE',
+                        help="write run totals to FILE as a Prometheus textfile")
+    args = parser.parse_args(argv[1:])
+    THROTTLE = fetcher.HostThrottle(args.rate)
+    SESSION = http_session.HTTPSession(FETCH_TIMEOUT, args.retries, FETCH_BACKOFF,
+                                       pool_size=args.workers)
+    HTML_ENGINE = args.engine
+    OUTPUT_FORMAT = args.output
+    if args.dates:
         urls = []
-        for date in argv:
+        for date in args.dates:
             url = EVENT_DAY_URL_TMPL % (date[0:4], date)
             urls.append(url)
         del SKIP_DAYS[:]
-        fetch_all(urls)
+    elif args.parse_only:
+        urls = cached_page_urls(EVENT_INDEX_YEARS)
     # Default is process everything.
     else:
-        fetch_all(gather_page_urls(EVENT_INDEX_YEARS))
+        urls = gather_page_urls(EVENT_INDEX_YEARS)
+    metrics = None
+    if args.metrics_json or args.metrics_prom:
+        metrics = instrument.enable()
+    if args.parse_only:
+        parse_cached(urls, args.processes, args.force)
+    else:
+        fetch_all(urls, args.workers, args.force)
+    if metrics:
+        print_metrics(metrics)
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+        if args.metrics_prom:
+            metrics.write_prometheus(args.metrics_prom)
 
-def fetch_all(urls):
+def print_metrics(metrics):
+    """ Prints the time spent in each stage of the run. """
+    summary = metrics.summary()
+    print "%-14s %8s %10s %10s" % ('stage', 'calls', 'seconds', 'max')
+    for stage, totals in sorted(summary['stages'].items()):
+        print "%-14s %8d %10.3f %10.3f" % (stage, totals['calls'], totals['seconds'],
+                                           totals['max_seconds'])
+    if summary['cache_hit_ratio'] is not None:
+        print "Cache hit ratio %.1f%%" % (summary['cache_hit_ratio'] * 100)
+    print "%d bytes downloaded" % (summary['counters'].get('bytes_downloaded', 0))
+
+def fetch_all(urls, workers=FETCH_WORKERS, force=False):
     """ Loops over urls and downloads each page, then parses out individual 
     events and writes each to a JSON file.
+
+    Pages are downloaded by a pool of `workers` threads that run ahead of the
+    parser, but events are still handled in the same order as `urls`. Pages
+    that haven't changed since they were last parsed by the current parser
+    are skipped unless `force` is set.
+    
+    """
+    pages_seen = pages_skipped = events_seen = 0
+    manifest = open_manifest()
+    writer = open_writer()
+    index = open_event_index(writer)
+    scheduler = fetcher.FetchScheduler(fetch_page, workers)
+    urls = (url for url in urls if page_date(url) not in SKIP_DAYS)
+    try:
+        for url, body in scheduler.map(urls):
+            print url
+            digest = hashlib.sha1(body).hexdigest()
+            if not force and manifest.is_current(url, digest, parser_engine(url),
+                                                 PARSER_VERSION, writer.exists):
+                pages_skipped += 1
+                instrument.count('pages_unchanged')
+                continue
+            # Events go straight from the parser to the writer, one at a time.
+            events_seen += record_page(manifest, writer, url, digest, page_events(url, body),
+                                       index)
+            pages_seen += 1
+            instrument.count('pages_parsed')
+    finally:
+        # Outputs have to be on disk before the manifest says they are.
+        writer.close()
+        index.close()
+        manifest.save()
+    if get_page_cache():
+        get_page_cache().save()
+    print "Done. %d events on %d pages, %d pages unchanged" % (events_seen, pages_seen, pages_skipped)
+
+def parse_cached(urls, processes=None, force=False):
+    """ Re-parses pages that are already in the cache, fanning them out to a
+    pool of `processes` worker processes (one per core by default). Nothing
+    is downloaded; pages missing from the cache are skipped, as are pages
+    that haven't changed since they were last parsed by the current parser
+    unless `force` is set. Events are written in the same order as `urls`,
+    so output doesn't depend on which worker finishes first.
     
     """
-    pages_seen = events_seen = 0
+    pages_seen = pages_skipped = events_seen = 0
+    manifest = open_manifest()
+    writer = open_writer()
+    index = open_event_index(writer)
+    # Decide which pages need parsing up front, using the hashes in the page
+    # cache index, so unchanged pages never get sent to a worker.
+    todo = []
     for url in urls:
-        print url
-        url_date = url.split('/')[-1].replace('en.html', '')
-        if int(url_date) in SKIP_DAYS:
+        if page_date(url) in SKIP_DAYS:
             continue
-        # Magic date: August 15, 2003 is the last day to use text reports.
-        elif int(url_date) <= 20030815:
-            events = parse_event_page_text(url)
+        digest = cached_page_digest(url)
+        if digest is None:
+            print "%s not cached, skipping" % (url)
+        elif not force and manifest.is_current(url, digest, parser_engine(url),
+                                               PARSER_VERSION, writer.exists):
+            pages_skipped += 1
+            instrument.count('pages_unchanged')
         else:
-            events = parse_event_page_html(url)
-        pages_seen += 1
-        events_seen += len(events)
-        for event in events:
-            name_parts = [PARSED_EVENTS_BASE, str(event['event_number']), '-', url_date, '.json']
-            #print " > Event %d" % (event['event_number'])
-            with open(''.join(name_parts), 'w') as f:
-                json.dump(event, f, indent=4, default=freeze_time)
-    print "Done. %d events on %d pages" % (events_seen, pages_seen)
+            todo.append((url, digest))
+    pool = multiprocessing.Pool(processes)
+    try:
+        # Small chunks keep the workers evenly loaded, since page sizes vary
+        # a lot, while still cutting down on per-task overhead.
+        results = pool.imap(_parse_cached_page, [url for url, digest in todo], chunksize=4)
+        for (url, digest), (_, events, metrics) in itertools.izip(todo, results):
+            if metrics and instrument.current():
+                instrument.current().merge(metrics)
+            if events is None:
+                print "%s not cached, skipping" % (url)
+                continue
+            print url
+            pages_seen += 1
+            events_seen += len(events)
+            instrument.count('pages_parsed')
+            record_page(manifest, writer, url, digest, events, index)
+        pool.close()
+    except:
+        # Don't wait for the workers to finish pages nobody will record.
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        writer.close()
+        index.close()
+        manifest.save()
+        # Pages picked up from the old flat cache layout were added to the
+        # cache index above.
+        if get_page_cache():
+            get_page_cache().save()
+    print "Done. %d events on %d pages, %d pages unchanged" % (events_seen, pages_seen, pages_skipped)
+
+def _parse_cached_page(url):
+    # Runs in a worker process, so it has to be a top-level function. Metrics
+    # for the page are recorded separately and sent back to be merged into
+    # the parent's.
+    metrics = instrument.enable() if instrument.current() else None
+    body = cached_page(url)
+    events = parse_page(url, body) if body is not None else None
+    return url, events, metrics.snapshot() if metrics else None
+
+def parse_page(url, body=None):
+    """ Parses a daily event page with the parser for its format and returns
+    the list of events.
+    
+    """
+    return list(page_events(url, body))
+
+def page_events(url, body=None):
+    """ Generator version of parse_page. Each event is yielded as soon as
+    it's been processed, and the page's parse tree is freed once the last one
+    is out.
+    
+    """
+    if parser_engine(url) == 'text':
+        events = text_page_events(url, body)
+    else:
+        events = html_page_events(url, body)
+    return processed_events(url, events)
+
+def processed_events(url, events):
+    """ Generator that runs process_event on each raw event from a parser. """
+    for event in events:
+        # All fields have been extracted from the source document, but all data
+        # is a string. Convert fields to other types as appropriate.
+        with instrument.timer('process_event', url):
+            process_event(event)
+        yield event
+
+def parser_engine(url):
+    """ Name of the parser that handles a daily page: "text" for the old text
+    reports, otherwise the engine used for HTML pages.
+    
+    """
+    # Magic date: August 15, 2003 is the last day to use text reports.
+    if page_date(url) <= 20030815:
+        return 'text'
+    return HTML_ENGINE
+
+def record_page(manifest, writer, url, digest, events, index=None):
+    """ Writes the events from a page and records them in the manifest.
+    Removes outputs from earlier runs that this page no longer produces.
+    `events` can be a generator; each event is written as soon as it comes
+    out. If an EventIndex is given, each event is also merged into its
+    canonical record. Returns the number of events written.
+    
+    """
+    outputs = []
+    for event in events:
+        with instrument.timer('write', url):
+            names = writer.write(page_date(url), [event])
+        outputs.extend(names)
+        if index is not None:
+            with instrument.timer('index', url):
+                for name in names:
+                    # Counted as index_new, index_updated, index_unchanged
+                    # or index_seen.
+                    instrument.count('index_' + index.add(name, event), url=url)
+    instrument.count('events_written', len(outputs), url=url)
+    for name in manifest.record(url, digest, parser_engine(url), PARSER_VERSION, outputs):
+        print " > Removing %s" % (name)
+        writer.remove(name)
+        if index is not None:
+            index.remove(name)
+    return len(outputs)
+
+def open_writer():
+    """ Opens the output backend selected by OUTPUT_FORMAT. """
+    if OUTPUT_FORMAT == 'jsonl':
+        return event_writer.ShardWriter(PARSED_EVENTS_BASE, freeze_time, SHARD_MAX_BYTES)
+    return event_writer.FileWriter(PARSED_EVENTS_BASE, freeze_time)
+
+def open_event_index(writer):
+    """ Opens the index of canonical records kept with the event files. If
+    there's no index yet, it's built from the writer's existing outputs
+    first, since pages that haven't changed won't be parsed again to add
+    their events.
+
+    """
+    index = event_index.EventIndex(PARSED_EVENTS_BASE, freeze_time)
+    if not os.path.exists(index.index_path):
+        index.add_outputs(writer)
+    return index
+
+def open_manifest():
+    """ Opens the manifest of parsed pages kept with the event files. """
+    return Manifest(PARSED_EVENTS_BASE + 'manifest.json')
+
+def page_date(url):
+    """ Returns the date of a daily event page as a YYYYMMDD int. """
+    return int(url.split('/')[-1].replace('en.html', ''))
+
+def cached_page_urls(years):
+    """ Returns URLs of all daily pages from the given years that are in the
+    page cache, sorted by date. Unlike gather_page_urls, this never downloads
+    the digest pages.
+    
+    """
+    cache = get_page_cache()
+    if not cache:
+        return []
+    years = set(years)
+    urls = [url for url in cache.urls()
+            if url.endswith('en.html') and page_date(url) // 10000 in years]
+    return sorted(urls, key=page_date)
 
 def gather_page_urls(years):
     """ Retrieve the event digest pages for the given list of years and find
@@ -163,194 +486,208 @@ def parse_event_digest(url):
         # Links are relative to current page and need to be made absolute.
         daily_url = urlparse.urljoin(url, anchor['href'])
         event_pages.append(daily_url)
+    free_tree(parsed)
     return event_pages
 
-def parse_event_page_html(url):
-    parsed = parser_open(url)
-    events = []
-    # Each event entry on the page starts with an anchor named after the event
-    # number. Pick out those anchors as a starting point for parsing.
-    for anchor in parsed('a', attrs={'name': re.compile(r'^en\d+')}):
-        event = init_event(url + '#' + anchor['name'])
-        # First table after the anchors contains various fields of metadata
-        # about the event. The table is only use for layout; the actual fields
-        # and data are just lines of text.
-        meta_table = anchor.find_next_sibling('table')
-        if not meta_table:
-            continue
-        # Table contains three rows with two cells each. Since the table is
-        # only for layout, grab all six cells (or seven for a retraction).
-        meta_cells = meta_table('td')
-        # First cell usually contains the type of event report. Retracted events
-        # add another cell to the beginning, so check for retraction and shift
-        # off that cell if found.
-        if 'RETRACTED' in meta_cells[0].string:
-            event['retracted'] = True
-            meta_cells.pop(0)
-        # Only look at "Power Reactor" reports.
-        event_type = meta_cells[0].string
-        if event_type != 'Power Reactor':
-            continue
-        event['type'] = event_type
-        # Second cell has the unique number for this event report, and includes
-        # a label that needs to be stripped off.
-        event['event_number'] = meta_cells[1].string.replace('Event Number: ', '')
-        print " > Event %s" % (event['event_number'])
-        # Third cell contains lines of text. Most lines have one field, except
-        # one line has both region and state.
-        parse_event_fields(event, meta_cells[2].stripped_strings)
-        res = re.match(r'(\d*)\s*State:\s+(\w+)', event['region'], flags=re.U)
-        event['region'], event['state'] = res.groups()
-        # Fourth cell also contains lines of text, always one field per line.
-        parse_event_fields(event, meta_cells[3].stripped_strings)
-        # Fifth cell has two fields. The first ("Emergency Class") is on one
-        # line, the second ("10 CFR Section") is split across multiple lines
-        # and can list multiple sections.
-        lines = list(meta_cells[4].stripped_strings)
-        # Extract emergency status.
-        event['emergency'] = lines[0].replace('Emergency Class: ', '')
-        # List sections with number and names separated.
-        event['cfr10_sections'] = [tuple(l.split(' - ')) for l in lines[2:]]
-        # Sixth cell has one field ("Person (Organization)") on multiple lines.
-        # The first line is the header, so just take every other line.
-        # The organization is sometimes missing but the parenthesis are still
-        # included (e.g. "PART 21 GROUP ()")
-        people = list(meta_cells[5].stripped_strings)[1:]
-        event['people'] = [
-            re.match(r'(.*?) ?\(([^)]*)\)', p, re.U).groups() 
-            for p in people]
-        # Move to the second table, which has status information about each
-        # reactor at the facility for before and after the event.
-        rx_table = meta_table.find_next_sibling('table')
-        rx_rows = rx_table('tr')
-        event['reactor_status'] = []
-        # Skip the header by starting with the second row.
-        for row in rx_rows[1:]:
-            values = [f.string for f in row('td')]
-            assert len(values) == 7
-            unit = dict(zip(REACTOR_STATUS_FIELDS, values))
-            event['reactor_status'].append(unit)
-
-        # Move to the third table, which has a single cell holding the body
-        # text. The text is separated by <br> tags, and the first line can
-        # be considered the event subject.
-        text_table = rx_table.find_next_sibling('table')
-        all_text = text_table('td')[0].stripped_strings
-        # all_text is a generator, so can't use list slicing
-        event['subject'] = all_text.next()
-        event['body'] = list(all_text)
+def parse_event_page_html(url, body=None, engine=None):
+    return list(processed_events(url, html_page_events(url, body, engine)))
 
-        # All fields have been extracted from the source document, but all data
-        # is a string. Convert fields to other types as appropriate.
-        process_event(event)
+def html_page_events(url, body=None, engine=None):
+    """ Generator that yields the raw events from an HTML page, before
+    process_event. The parse tree is freed when the generator finishes.
+    
+    """
+    engine = engine or HTML_ENGINE
+    if body is None:
+        body = fetch_page(url)
+    with instrument.timer('tree_build', url):
+        parsed = None
+        if engine == 'lxml':
+            parsed = lxml_event_soup(body)
+            if parsed is None:
+                print "(lxml tree failed checks, using html5lib)"
+        if parsed is None:
+            parsed = parser_open(url, body)
+    try:
+        # Each event entry on the page starts with an anchor named after the
+        # event number. Pick out those anchors as a starting point for parsing.
+        for anchor in parsed('a', attrs={'name': EVENT_ANCHOR_RE}):
+            with instrument.timer('extract', url):
+                event = _html_event(url, anchor)
+            if event is not None:
+                yield event
+    finally:
+        free_tree(parsed)
 
-        # Done. Record the event.
-        events.append(event)
-    return events
+def _html_event(url, anchor):
+    """ Extracts the fields of the event report that starts at `anchor`, all
+    as strings. Returns None if it's not a power reactor report.
     
-def parse_event_page_text(url):
-    lines = _text_get_lines(url)
-    # Start by splitting the blob into individual reports.
-    reports = _text_split_reports(_text_preprocess(lines))
-    events = []
-    for report in reports:
-        event = init_event(url)
-        # Retracted events will have an extra line at the beginning.
-        # Remove that line if it's present.
-        if 'RETRACTED' in report[0]:
-            event['retracted'] = True
-            report.pop(0)
-        # First line will be a separator, and second line will have the
-        # event type. We only care about Power Reactor events.
-        res = re.match(r'\|([A-Za-z ]+?)\s+\|Event Number:\s*(\d+)', report[1], re.U)
-        event_type, event_num = res.groups()
-        if event_type != 'Power Reactor':
-            continue
-        event['type'] = event_type
-        event['event_number'] = event_num
-        print " > Event %s" % (event['event_number'])
-        # Strip off the starting separator lines (plus the just parsed line)
-        # because the number of lines seems to vary between reports. Removing
-        # them makes the other line numbers more consistent.
-        report.pop(1)
-        while report[0][0] == '+':
-            report.pop(0)
-        # http://www.nrc.gov/reading-rm/doc-collections/event-status/event/2001/20011108en.html
-        if report[0][0:4] == '!!!!':
-            continue
-        # It looks like the header region of a report is a fixed number of
-        # lines. Unless this assertion shows otherwise, I'm going to assume
-        # it is for the purpose of parsing.
-        assert 'EVENT TEXT' in report[20]
-        # Two of the lines have two fields, so they have to be reparsed.
-        # This covers facility, unit, rxtype, nrc notified by, hq ops officer,
-        # and emergency class.
-        parse_event_fields(event, _text_get_column(report[0:8], 0))
-        res = re.match(r'([-A-Za-z0-9 ()]+?)\s*REGION:\s+(\d+)', event['facility'], flags=re.U)
-        event['facility'], event['region'] = res.groups()
-        res = re.match(r'([][0-9 ]+?)\s{2,}STATE:\s+(\w+)', event['unit'], flags=re.U)
-        event['unit'], event['state'] = res.groups()
-        # Timestamps are in the second column on lines 4-8.
-        parse_event_fields(event, _text_get_column(report[0:5], 1))
-        # Lines 10-16, second column has related people. Skip first line
-        # because it's the header.
-        event['people'] = []
-        for p in _text_get_column(report[7:13], 1):
-            parts = re.split(r'(?u)\s{2,}', p, 1)
-            # If only one column is given (e.g. the person is "FEMA"), then add
-            # a second empty element to the list, since that's what happens in
-            # the html parser.
-            if len(parts) == 1:
-                parts.append(None)
-            event['people'].append(parts)
-        # Lines 12-16, first column has the related CFR10 sections. First
-        # line is header. There's nothing good to split the line on, so
-        # I'm relying on them to be fixed-width fields.
-        event['cfr10_sections'] = [
-            (s[0:25].strip(), s[25:].strip())
-            for s in _text_get_column(report[9:13], 0)]
-        # Lines 20-22 has status information about each affected reactor.
-        event['reactor_status'] = []
-        for row in report[16:19]:
-            # Parse into columns: unit, scram code, rx crit, init pwr,
-            # init rx mode, curr pwr, curr rx mode.
-            res = re.match(r'\|(\d+)\s+([A-Za-z/]+)\s+(\w+)\s+(\d+)\s+([A-Za-z ]+)\s*\|(\d+)\s+([A-Za-z ]+)\s+\|', row, re.U)
-            if res:
-                unit = dict(zip(REACTOR_STATUS_FIELDS, [f.strip() for f in res.groups()]))
-                event['reactor_status'].append(unit)
-        # Event text is line 26 to the end. Need to trim off the edges and
-        # join lines into paragraphs.
-        body = []
-        prev_line = ""
-        for line in report[22:-1]:
-            line = line.strip("| ")
-            if prev_line:
-                body[-1] = body[-1] + " " + line
-            elif line:
-                body.append(line)
-            prev_line = line
-        # Now that lines are joined into paragraphs, remove the first and
-        # treat it as the subject.
-        event['subject'] = body.pop(0)
-        event['body'] = body
+    """
+    event = init_event(url + '#' + anchor['name'])
+    # First table after the anchors contains various fields of metadata
+    # about the event. The table is only use for layout; the actual fields
+    # and data are just lines of text.
+    meta_table = anchor.find_next_sibling('table')
+    if not meta_table:
+        return None
+    # Table contains three rows with two cells each. Since the table is
+    # only for layout, grab all six cells (or seven for a retraction).
+    meta_cells = meta_table('td')
+    # First cell usually contains the type of event report. Retracted events
+    # add another cell to the beginning, so check for retraction and shift
+    # off that cell if found.
+    if 'RETRACTED' in meta_cells[0].string:
+        event.retracted = True
+        meta_cells.pop(0)
+    # Only look at "Power Reactor" reports.
+    event_type = meta_cells[0].string
+    if event_type != 'Power Reactor':
+        return None
+    event.type = intern_string(event_type)
+    # Second cell has the unique number for this event report, and includes
+    # a label that needs to be stripped off.
+    event.event_number = meta_cells[1].string.replace('Event Number: ', '')
+    print " > Event %s" % (event.event_number)
+    # Third cell contains lines of text. Most lines have one field, except
+    # one line has both region and state.
+    parse_event_fields(event, meta_cells[2].stripped_strings)
+    res = re.match(r'(\d*)\s*State:\s+(\w+)', event.region, flags=re.U)
+    event.region, event.state = res.groups()
+    # Fourth cell also contains lines of text, always one field per line.
+    parse_event_fields(event, meta_cells[3].stripped_strings)
+    # Fifth cell has two fields. The first ("Emergency Class") is on one
+    # line, the second ("10 CFR Section") is split across multiple lines
+    # and can list multiple sections.
+    lines = list(meta_cells[4].stripped_strings)
+    # Extract emergency status.
+    event.emergency = intern_string(lines[0].replace('Emergency Class: ', ''))
+    # List sections with number and names separated.
+    event.cfr10_sections = [section_tuple(l.split(' - ')) for l in lines[2:]]
+    # Sixth cell has one field ("Person (Organization)") on multiple lines.
+    # The first line is the header, so just take every other line.
+    # The organization is sometimes missing but the parenthesis are still
+    # included (e.g. "PART 21 GROUP ()")
+    people = list(meta_cells[5].stripped_strings)[1:]
+    event.people = [
+        Person(*re.match(r'(.*?) ?\(([^)]*)\)', p, re.U).groups())
+        for p in people]
+    # Move to the second table, which has status information about each
+    # reactor at the facility for before and after the event.
+    rx_table = meta_table.find_next_sibling('table')
+    rx_rows = rx_table('tr')
+    event.reactor_status = []
+    # Skip the header by starting with the second row.
+    for row in rx_rows[1:]:
+        values = [f.string for f in row('td')]
+        assert len(values) == 7
+        event.reactor_status.append(ReactorStatus(*values))
 
-        # All fields have been extracted from the source document, but all data
-        # is a string. Convert fields to other types as appropriate.
-        process_event(event)
+    # Move to the third table, which has a single cell holding the body
+    # text. The text is separated by <br> tags, and the first line can
+    # be considered the event subject.
+    text_table = rx_table.find_next_sibling('table')
+    all_text = text_table('td')[0].stripped_strings
+    # all_text is a generator, so can't use list slicing
+    event.subject = all_text.next()
+    event.body = list(all_text)
+    return event
+    
+def parse_event_page_text(url, body=None):
+    return list(processed_events(url, text_page_events(url, body)))
 
-        # Done. Record the event.
-        events.append(event)
-    return events
+def text_page_events(url, body=None):
+    """ Generator that yields the raw events from a text page, before
+    process_event.
+    
+    """
+    with instrument.timer('tree_build', url):
+        lines = _text_get_lines(url, body)
+    for report in _text_reports(lines):
+        with instrument.timer('extract', url):
+            event = _text_event(url, report)
+        if event is not None:
+            yield event
 
-def _text_get_lines(url):
-    parsed = parser_open(url)
+def _text_event(url, report):
+    """ Extracts the fields of one text report, all as strings. Returns None
+    if it's not a power reactor report.
+    
+    """
+    record = _text_report_record(report)
+    # We only care about Power Reactor events.
+    if not record or record['type'] != 'Power Reactor':
+        return None
+    event = init_event(url)
+    event.retracted = record['retracted']
+    event.type = intern_string(record['type'])
+    event.event_number = record['event_number']
+    print " > Event %s" % (event.event_number)
+    left, right = record['left'], record['right']
+    # Two of the lines have two fields, so they have to be reparsed.
+    # This covers facility, unit, rxtype, nrc notified by, hq ops officer,
+    # and emergency class.
+    parse_event_fields(event, _text_cells(left[0:8]))
+    res = TEXT_FACILITY_RE.match(event.facility)
+    event.facility, event.region = res.groups()
+    event.facility = intern_string(event.facility)
+    res = TEXT_UNIT_RE.match(event.unit)
+    event.unit, event.state = res.groups()
+    # Timestamps are in the second column on lines 4-8.
+    parse_event_fields(event, _text_cells(right[0:5]))
+    # Lines 10-16, second column has related people. Skip first line
+    # because it's the header.
+    event.people = []
+    for p in _text_cells(right[7:13]):
+        parts = TEXT_PERSON_SPLIT_RE.split(p, 1)
+        # If only one column is given (e.g. the person is "FEMA"), then add
+        # a second empty element to the list, since that's what happens in
+        # the html parser.
+        if len(parts) == 1:
+            parts.append(None)
+        event.people.append(Person(*parts))
+    # Lines 12-16, first column has the related CFR10 sections. First
+    # line is header. There's nothing good to split the line on, so
+    # I'm relying on them to be fixed-width fields.
+    event.cfr10_sections = [
+        section_tuple((s[0:25].strip(), s[25:].strip()))
+        for s in _text_cells(left[9:13])]
+    # Lines 20-22 has status information about each affected reactor.
+    event.reactor_status = []
+    for row in record['status']:
+        # Parse into columns: unit, scram code, rx crit, init pwr,
+        # init rx mode, curr pwr, curr rx mode.
+        res = TEXT_STATUS_ROW_RE.match(row)
+        if res:
+            event.reactor_status.append(ReactorStatus(*[f.strip() for f in res.groups()]))
+    # Event text needs the edges trimmed off and lines joined into
+    # paragraphs.
+    body = []
+    prev_line = ""
+    for line in record['text']:
+        line = line.strip("| ")
+        if prev_line:
+            body[-1] = body[-1] + " " + line
+        elif line:
+            body.append(line)
+        prev_line = line
+    # Now that lines are joined into paragraphs, remove the first and
+    # treat it as the subject.
+    event.subject = body.pop(0)
+    event.body = body
+    return event
+
+def _text_get_lines(url, body=None):
+    parsed = parser_open(url, body)
     # The HTML of these pages is only a wrapper around text-based reports,
     # all contained in a single PRE tag. The reports are in ASCII tables
     # and wrapped to exactly 80 columns.
     body = parsed.find("pre")
-    if not body:
+    # Only the text is needed from here on, so let the tree go.
+    raw = unicode(body.strings.next()) if body else None
+    free_tree(parsed)
+    if raw is None:
         return []
-    raw = body.strings.next()
     if "Nuclear Regulatory Commission\n\n" in raw:
         # For some reason reports from 2003 have double newlines. Use the
         # NRC header to detect this and remove the extra newlines.
@@ -359,25 +696,74 @@ def _text_get_lines(url):
         lines = raw.split("\n")
     return lines
 
-def _text_preprocess(lines):
-    """ Cleans up odd formatting in some of the text reports. """
+def _text_reports(lines):
+    """ Splits the lines of a text page into individual reports, in a single
+    pass over the lines. Generator that yields each report as a list of lines
+    as soon as the start of the next one is found.
+    
+    Reports are found by scanning for event numbers, then backing up a few
+    lines and taking everything down to the next number or the end of the page.
+    
+    """
+    current = None
+    # Lines seen since the last blank line, which are the ones that get moved
+    # to the next report when its event number turns up.
+    since_blank = []
+    for idx, line in enumerate(_text_clean_lines(lines)):
+        # Record position of blank line but don't do anything with it.
+        if not line.strip():
+            since_blank = []
+            continue
+        # Check whether this line is near the start of a new report.
+        if TEXT_EVENT_LINE_RE.match(line):
+            # The event number appears a few lines farther down than
+            # where we actually want to start capturing, so we both
+            # have to backtrack to get the start of the report and
+            # have to remove the lines from the previous report.
+            if current:
+                back = len(since_blank)
+                # Arbitrary limit on how far to go back. If the distance to
+                # the last blank is more than a few lines, then this report has
+                # probably gotten pushed up against another, so just assume
+                # one line back.
+                # http://www.nrc.gov/reading-rm/doc-collections/event-status/event/2001/20011019en.html
+                if back > 5:
+                    back = 1
+                    since_blank = since_blank[-1:]
+                del current[back*-1:]
+                # The now complete report is ready.
+                yield current
+            # Start a new current report using the backtracked lines.
+            # The current line will be added below.
+            current = list(since_blank)
+        # The first line of the page is never part of a report.
+        if idx:
+            since_blank.append(line)
+        if current:
+            current.append(line)
+    # Last report runs to the end of the page.
+    if current:
+        yield current
+
+def _text_clean_lines(lines):
+    """ Cleans up odd formatting in some of the text reports. Generator that
+    yields cleaned lines, looking at most one line ahead.
+    
+    """
     idx = 0
-    processed = []
     while idx < len(lines):
         cur = lines[idx]
-        try:
-            peek = lines[idx + 1]
-        except IndexError:
-            peek = None
-        new = None
+        peek = lines[idx + 1] if idx + 1 < len(lines) else None
+        idx = idx + 1
         # Some pages use a single period or form feed where others would have
         # a blank line in between reports.
         if cur == '.' or cur == "\x0C":
-            new = ''
+            yield ''
         # Extremely special case, where a period has gotten squished on to
         # another line. e.g. http://www.nrc.gov/reading-rm/doc-collections/event-status/event/2001/20011203en.html
         elif cur[0:2] == '.+':
-            new = ('', cur[1:])
+            yield ''
+            yield cur[1:]
         # Reports marked as not for distribution sound tantalizing but appear
         # to be junk. Strip off the lines so they don't confuse the parser.
         elif 'NOT FOR PUBLIC DISTRIBUTION' in cur:
@@ -392,7 +778,7 @@ def _text_preprocess(lines):
                  ):
             # I think the lines always need a space added between them to get 80.
             assert len(cur) + len(peek) == 79
-            new = cur + ' ' + peek
+            yield cur + ' ' + peek
             # Advance current line an extra time.
             idx = idx + 1
         # Strip short lines that are just ascii art and emptiness.
@@ -402,108 +788,105 @@ def _text_preprocess(lines):
         # Inject a blank line between the list of event numbers in the preamble
         # and the first event report.
         # http://www.nrc.gov/reading-rm/doc-collections/event-status/event/2003/20030122en.html
-        elif re.match(r'\d{5}\s*(?:\d{5}\s*)*$', cur) and peek is not None and peek[0:2] == '+-':
-            new = (cur, '')
+        elif peek is not None and peek[0:2] == '+-' and TEXT_PREAMBLE_LIST_RE.match(cur):
+            yield cur
+            yield ''
         else:
-            new = cur
-        if new is not None:
-            # If new isn't a string, assume it's an iterable and is injecting 
-            # multiple lines.
-            if isinstance(new, basestring):
-                processed.append(new)
-            else:
-                processed.extend(new)
-        idx = idx + 1
-    return processed
+            yield cur
 
-def _text_split_reports(lines):
-    # Scan for event numbers, then backing up a few lines and taking
-    # everything down to the next number or the end of the list.
-    reports = []
-    current = None
-    last_blank = 0
-    for idx, line in enumerate(lines):
-        # Record position of blank line but don't do anything with it.
-        if not line.strip():
-            last_blank = idx
-            continue
-        # Check whether this line is near the start of a new report.
-        if re.match(r'^\|[^|]+\|Event Number:\s*\d+', line, re.U):
-            # The event number appears a few lines farther down than
-            # where we actually want to start capturing, so we both
-            # have to backtrack to get the start of the report and
-            # have to remove the lines from the previous report.
-            if current:
-                back = idx - last_blank - 1
-                # Arbitrary limit on how far to go back. If the distance to
-                # the last blank is more than a few lines, then this report has
-                # probably gotten pushed up against another, so just assume
-                # one line back.
-                # http://www.nrc.gov/reading-rm/doc-collections/event-status/event/2001/20011019en.html
-                if back > 5:
-                    back = 1
-                    last_blank = idx - 2
-                del current[back*-1:]
-                # Save the now complete report.
-                reports.append(current)
-            # Start a new current report using the backtracked lines.
-            # The current line will be added below.
-            current = lines[last_blank+1:idx]
-        if current:
-            current.append(line)
-    # Save the last report.
-    if current:
-        reports.append(current)
-    return reports
-
-def _text_get_column(lines, column):
-    """ Extracts a column from a series of lines in a text-based table.
-        Assumes the table is created with "|+-" characters. The column
-        index starts at zero. """
-    result = []
-    for line in lines:
-        cols = re.split(r'\||\+', line.strip('|+'))
-        col = cols[column].strip()
-        # Skip lines that are only row separator.
-        if re.match(r'[^-]', col, re.U):
-            result.append(col)
-    return result
+def _text_report_record(report):
+    """ Turns the lines of one report into a structured record. The header of
+    each report is a fixed-layout 80-column table, so its two columns are
+    sliced out at the divider instead of being split on every "|" and "+".
+    Returns None for reports that can't be parsed.
+    
+    """
+    record = {'retracted': False}
+    # Retracted events will have an extra line at the beginning.
+    # Remove that line if it's present.
+    if 'RETRACTED' in report[0]:
+        record['retracted'] = True
+        report = report[1:]
+    # First line will be a separator, and second line will have the
+    # event type.
+    res = TEXT_TYPE_LINE_RE.match(report[1])
+    record['type'], record['event_number'] = res.groups()
+    # Strip off the starting separator lines (plus the just parsed line)
+    # because the number of lines seems to vary between reports. Removing
+    # them makes the other line numbers more consistent.
+    start = 2
+    while report[start][0] == '+':
+        start += 1
+    report = report[start:]
+    # http://www.nrc.gov/reading-rm/doc-collections/event-status/event/2001/20011108en.html
+    if report[0][0:4] == '!!!!':
+        return None
+    if record['type'] != 'Power Reactor':
+        return record
+    # It looks like the header region of a report is a fixed number of
+    # lines. Unless this assertion shows otherwise, I'm going to assume
+    # it is for the purpose of parsing.
+    assert 'EVENT TEXT' in report[20]
+    # The column divider is in the same place on every header line, so find
+    # it once on the first line.
+    divider = report[0].find('|', 1)
+    record['left'] = []
+    record['right'] = []
+    for line in report[0:13]:
+        if len(line) > divider and line[divider] in '|+':
+            left = line[1:divider]
+            right = line[divider + 1:].rstrip().rstrip('|+')
+        else:
+            # Line doesn't match the layout of the first one, so fall back
+            # to splitting it on the table characters.
+            cols = TEXT_COLUMN_SPLIT_RE.split(line.strip('|+')) + ['']
+            left, right = cols[0], cols[1]
+        record['left'].append(left.strip())
+        record['right'].append(right.strip())
+    # Lines 20-22 have status information about each affected reactor, and
+    # the event text is line 26 to the end.
+    record['status'] = report[16:19]
+    record['text'] = report[22:-1]
+    return record
+
+def _text_cells(cells):
+    """ Filters a column from the text table down to cells with content,
+    skipping empty cells and cells that are only a row separator. """
+    return [c for c in cells if TEXT_CELL_RE.match(c)]
 
 def init_event(url):
-    event = {
-        'url': url,
-        'retracted': False,
-        'crawl_time': datetime.datetime.now(TIMEZONES['UTC']),
-    }
-    return event
+    return Event(url=url, retracted=False,
+                 crawl_time=datetime.datetime.now(TIMEZONES['UTC']))
 
 def parse_event_fields(event, lines):
-    """ Parse rows of colon-separated key/value pairs and add them to the
-        event dictionary using REPORT_FIELDS to map the names. """
+    """ Parse rows of colon-separated key/value pairs and set them on the
+        event using REPORT_FIELDS to map the names. """
     for line in lines:
         res = re.split(r'(?u):\s*', line, 1)
         if res[0].lower() in REPORT_FIELDS:
-            event[REPORT_FIELDS[res[0].lower()]] = res[1]
+            name = REPORT_FIELDS[res[0].lower()]
+            value = intern_string(res[1]) if name in INTERNED_FIELDS else res[1]
+            setattr(event, name, value)
 
 def process_event(event):
-    event['event_number'] = int(event['event_number'])
+    event.event_number = int(event.event_number)
 
     # Don't store the region, state, and reactor type fields because we have
     # that information in a separate database and can match based on the
     # Facility field. However, peek at the state code to see if this unit is 
     # in Arizona (see comments at the TIMEZONES declaration).
     use_dst = True
-    if event['state'] == 'AZ':
+    if event.state == 'AZ':
         use_dst = False
-    del event['region'], event['state'], event['rx_type']
+    del event.region, event.state, event.rx_type
 
     # Parse dates and times to native objects. update_date is easy because
     # there is no time component.
-    event['update_date'] = convert_time(event['update_date'])
+    event.update_date = convert_time(event.update_date)
 
     # Save local timezone in case it's needed later to resolve other times.
     # Default to Eastern if timezone can't be extracted.
-    tz_res = re.search(r'\[(UTC|[ECMP][DS]?T)\]', event['event_time'], flags=re.I|re.U)
+    tz_res = re.search(r'\[(UTC|[ECMP][DS]?T)\]', event.event_time, flags=re.I|re.U)
     local_tz = tz_res.group(1) if tz_res else 'EST'
 
     # Event timestamp is given local to the facility location, so timezones
@@ -511,38 +894,32 @@ def process_event(event):
     # because it's apparently relative to NRC headquarters. In both cases,
     # the converted datetime object is placed in the time field and the
     # original date field is discarded.
-    event['event_time'] = convert_time(event['event_date'], 
-                                       event['event_time'], use_dst)
-    event['report_time'] = convert_time(event['report_date'],
-                                        event['report_time'])
-    del event['event_date'], event['report_date']
+    event.event_time = convert_time(event.event_date, event.event_time, use_dst)
+    event.report_time = convert_time(event.report_date, event.report_time)
+    del event.event_date, event.report_date
 
     # Process Unit field to get a list of reactors numbers involved in this
     # report instead of a string. The raw string is like "[1] [2] [ ]", where
     # the space within empty brackets is actually a non-breaking space (\xa0)
-    affected = [int(u) for u in re.findall(r'\[(\d+)\]', event['unit'], re.U)]
-    del event['unit']
+    affected = [int(u) for u in re.findall(r'\[(\d+)\]', event.unit, re.U)]
+    del event.unit
     # Merge list of affected units into reactor status list. Convert various
     # numeric fields in the list to ints. The "critical" field appears to be
     # a flag, so it's cast to boolean.
-    for unit in event['reactor_status']:
-        unit['unit'] = int(unit['unit'])
-        if unit['unit'] in affected:
-            unit['affected'] = True
+    for unit in event.reactor_status:
+        unit.unit = int(unit.unit)
+        if unit.unit in affected:
+            unit.affected = True
         else:
-            unit['affected'] = False
-        unit['initial_power'] = int(unit['initial_power'])
-        unit['current_power'] = int(unit['current_power'])
-        assert unit['critical'] == 'Y' or unit['critical'] == 'N'
-        unit['critical'] = True if unit['critical'] == 'Y' else False
+            unit.affected = False
+        unit.initial_power = int(unit.initial_power)
+        unit.current_power = int(unit.current_power)
+        assert unit.critical == 'Y' or unit.critical == 'N'
+        unit.critical = True if unit.critical == 'Y' else False
     
     # Look for updates in body and parse into separate timestamped entries.
-    updates = [{
-        'time': event['event_time'],
-        'header': '',
-        'body': [],
-    }]
-    for graf in event['body']:
+    updates = [Update(event.event_time, '', [])]
+    for graf in event.body:
         # The lines introducing updates are almost but not quite consistent.
         # Usually they start with "* * * " followed by "UPDATE" or "RETRACTION"
         # but sometimes there are no spaces, or there are more or fewer stars,
@@ -568,20 +945,68 @@ def process_event(event):
                 if date_str == '89/16/03':
                     date_str = '8/16/03'
                 timestamp = convert_time(date_str, time_str, use_dst)
-            updates.append({
-                'time': timestamp,
-                'header': header,
-                'body': [],
-            })
+            updates.append(Update(timestamp, header, []))
         else:
-            updates[-1]['body'].append(graf)
-    event['updates'] = updates
+            updates[-1].body.append(graf)
+    event.updates = updates
 
 def convert_time(date_part, time_part=None, use_dst=True):
     """ Takes a date string and time string in local time and converts 
     to a datetime object in UTC.
     
+    The same few timestamps come up again and again (every event on a page
+    shares its update date, updates repeat the report time, etc.), so
+    results are memoized. Formats NRC actually uses are handled by regexes,
+    and only anything unrecognized goes through dateutil.
+    
+    """
+    key = (date_part, time_part, use_dst)
+    try:
+        return _time_cache[key]
+    except KeyError:
+        pass
+    result = _fast_convert_time(date_part, time_part, use_dst)
+    if result is None:
+        result = _dateutil_convert_time(date_part, time_part, use_dst)
+    if len(_time_cache) >= TIME_CACHE_SIZE:
+        _time_cache.clear()
+    _time_cache[key] = result
+    return result
+
+def _fast_convert_time(date_part, time_part, use_dst):
+    """ convert_time for known formats. Returns None if the input doesn't
+    match, so the caller can fall back to dateutil.
+    
     """
+    date_res = TIME_DATE_RE.match(date_part)
+    if not date_res:
+        return None
+    month, day, year = [int(p) for p in date_res.groups()]
+    # Handle two-year dates by treating everything above 60 as 20th century.
+    if year < 100:
+        year += 1900 if year > 60 else 2000
+    try:
+        if not (time_part and TIME_DIGIT_RE.search(time_part)):
+            return datetime.date(year, month, day)
+        time_res = TIME_CLOCK_RE.match(time_part)
+        if not time_res:
+            return None
+        zone = time_res.group(3) or time_res.group(4) or 'EST'
+        # Special timezone handling for Arizona (see note with TIMEZONES).
+        if not use_dst and zone == 'MST':
+            zone = 'AZMST'
+        tz = TIMEZONES.get(zone)
+        if tz is None:
+            return None
+        time_obj = datetime.datetime(year, month, day, int(time_res.group(1)),
+                                     int(time_res.group(2)), tzinfo=tz)
+    except ValueError:
+        # Out of range, like hour 24 or month 13. dateutil sometimes manages
+        # to make sense of these by swapping day and month.
+        return None
+    return time_obj.astimezone(TIMEZONES['UTC'])
+
+def _dateutil_convert_time(date_part, time_part, use_dst):
     # Check for a time component. Some events only have a date, but the time
     # field still has a timezone identifier in it. If there are no numbers 
     # in the time field, return a date-only object.
@@ -601,44 +1026,200 @@ def convert_time(date_part, time_part=None, use_dst=True):
         time_obj = dateutil.parser.parse(date_part)
         return time_obj.date()
 
-def parser_open(url):
-    """ Fetch a URL and create a BeautifulSoup object from the response. Uses
-    a rudimentary cache for pages, so the parser can be tested and run 
-    repeatedly without constantly hitting NRC servers.
+def fetch_page(url):
+    """ Fetch a URL and return the response body. Pages are kept in a cache
+    (see page_cache.py), so the parser can be tested and run repeatedly
+    without constantly hitting NRC servers. Once a cached page is older than
+    its max age, it's revalidated with a conditional request, which costs a
+    304 instead of a full download if the page hasn't changed. Safe to call
+    from multiple threads.
+    
+    """
+    cache = get_page_cache()
+    entry = None
+    if cache:
+        with instrument.timer('cache_lookup', url):
+            manual = _manual_page(url)
+            if manual is not None:
+                print "(used manual copy)"
+                instrument.count('manual_pages', url=url)
+                return manual
+            entry = _cache_entry(cache, url)
+            max_age = EVENT_PAGE_MAX_AGE if url.endswith('html') else DIGEST_MAX_AGE
+            if entry and cache.is_fresh(entry, max_age):
+                print "(used cache)"
+                instrument.count('cache_hits', url=url)
+                return cache.read(entry)
+        instrument.count('cache_misses', url=url)
+    headers = cache.conditional_headers(entry) if entry else {}
+    # Wait our turn so requests to the server stay spaced out no matter how
+    # many threads are downloading. Retries are spaced out by the session's
+    # backoff instead.
+    with instrument.timer('throttle', url):
+        THROTTLE.wait(url)
+    try:
+        with instrument.timer('fetch', url):
+            instrument.count('requests', url=url)
+            response = SESSION.get(url, headers)
+    except urllib2.HTTPError:
+        instrument.count('http_errors', url=url)
+        raise
+    if response.status == 304 and entry:
+        print "(not modified)"
+        instrument.count('not_modified', url=url)
+        cache.revalidated(url, response.headers)
+        return cache.read(entry)
+    print "(hit server)"
+    # Counts what came over the wire, which is less than the page when it
+    # was gzipped.
+    instrument.count('bytes_downloaded', response.size, url=url)
+    if cache:
+        cache.store(url, response.body, response.headers)
+    return response.body
+
+def cached_page_digest(url):
+    """ Returns the SHA-1 of a page's cached content without reading it from
+    the cache, or None if the page isn't cached.
+    
+    """
+    cache = get_page_cache()
+    if not cache:
+        return None
+    manual = _manual_page(url)
+    if manual is not None:
+        return hashlib.sha1(manual).hexdigest()
+    entry = _cache_entry(cache, url)
+    return entry['hash'] if entry else None
+
+def cached_page(url):
+    """ Returns the cached body of a page regardless of its age, or None if
+    the page isn't cached. Never touches the network.
+    
+    """
+    cache = get_page_cache()
+    if not cache:
+        return None
+    with instrument.timer('cache_lookup', url):
+        manual = _manual_page(url)
+        if manual is not None:
+            instrument.count('manual_pages', url=url)
+            return manual
+        entry = _cache_entry(cache, url)
+        if not entry:
+            instrument.count('cache_misses', url=url)
+            return None
+        instrument.count('cache_hits', url=url)
+        return cache.read(entry)
+
+def _manual_page(url):
+    # Hand-edited pages always win. See cleanup_notes.md.
+    manual_path = os.path.join(PAGE_CACHE_BASE, 'manual', url.split('/')[-1])
+    if url.endswith('html') and os.path.exists(manual_path):
+        with open(manual_path) as f:
+            return f.read()
+    return None
+
+def _cache_entry(cache, url):
+    entry = cache.lookup(url)
+    # Pick up pages saved by the old flat cache layout.
+    legacy_path = os.path.join(PAGE_CACHE_BASE, url.split('/')[-1])
+    if not entry and url.endswith('html') and os.path.exists(legacy_path):
+        cache.import_file(url, legacy_path)
+        entry = cache.lookup(url)
+    return entry
+
+def get_page_cache():
+    """ Returns the PageCache for PAGE_CACHE_BASE, or None if caching is
+    turned off. The cache is opened on first use.
+    
+    """
+    global _page_cache
+    if not PAGE_CACHE_BASE:
+        return None
+    with _page_cache_lock:
+        if _page_cache is None or _page_cache.base != PAGE_CACHE_BASE:
+            _page_cache = page_cache.PageCache(PAGE_CACHE_BASE)
+        return _page_cache
+
+def lxml_event_soup(body):
+    """ Builds a tree for an HTML event page with lxml, keeping only the
+    anchors and tables that parse_event_page_html looks at. This is several
+    times faster than html5lib, but lxml sometimes nests the tables inside
+    an unclosed <br>, so the tree is checked with event_tables_ok before it's
+    used. Returns None if lxml isn't installed or the check fails.
+    
+    """
+    try:
+        parsed = BeautifulSoup(body, 'lxml', parse_only=SoupStrainer(['a', 'table']))
+    except FeatureNotFound:
+        return None
+    if not event_tables_ok(parsed):
+        return None
+    return parsed
+
+def event_tables_ok(parsed):
+    """ Checks that every event anchor in a tree is followed by the sibling
+    tables the HTML parser expects: a metadata table with at least six cells
+    and, for power reactor events, a reactor status table with seven cells
+    per row and a table holding the event text.
+    
+    """
+    for anchor in parsed('a', attrs={'name': EVENT_ANCHOR_RE}):
+        # Collect the tables between this anchor and the next event anchor.
+        tables = []
+        for sibling in anchor.find_next_siblings(['a', 'table']):
+            if sibling.name == 'a' and EVENT_ANCHOR_RE.match(sibling.get('name', '')):
+                break
+            if sibling.name == 'table':
+                tables.append(sibling)
+        if not tables:
+            continue
+        meta_cells = tables[0]('td')
+        if len(meta_cells) < 6:
+            return False
+        if 'RETRACTED' in (meta_cells[0].string or ''):
+            meta_cells.pop(0)
+        if meta_cells[0].string != 'Power Reactor':
+            continue
+        if len(tables) < 3:
+            return False
+        if any(len(row('td')) != 7 for row in tables[1]('tr')[1:]):
+            return False
+    return True
+
+def parser_open(url, body=None):
+    """ Create a BeautifulSoup object for a page. If the page body has already
+    been downloaded, pass it as `body`; otherwise it's fetched with fetch_page.
     
     """
-    cacheable, stale, cache_name = False, False, ""
-    page = None
-    # Yearly digest pages, which don't end in .html, aren't cached.
-    if PAGE_CACHE_BASE and url.endswith('html'):
-        cacheable = True
-        cache_name = url.split('/')[-1]
-        # Try opening the cached file. If that fails, set a flag to download it.
-        try:
-            page = urllib2.urlopen('file://' + PAGE_CACHE_BASE + cache_name)
-            print "(used cache)"
-        except urllib2.URLError as e:
-            stale = True
-    # Fallback to downloading page.
-    if stale or not cacheable:
-        page = urllib2.urlopen(url)
-        print "(hit server)"
-        # Force delay between requests to take it easy on the server.
-        sleep(1)
-    body = page.read()
-    # Cache event pages.
-    if stale and cacheable:
-        with open(PAGE_CACHE_BASE + cache_name, 'w') as f:
-            f.write(body)
+    if body is None:
+        body = fetch_page(url)
     # Specify html5lib because it seems to give best results. lxml had problems
     # with not closing <br> tags, so tables would get lost inside the line break
     # and no longer be siblings as expected.
     return BeautifulSoup(body, 'html5lib')
 
+def free_tree(parsed):
+    """ Breaks up a parse tree once it's no longer needed. BeautifulSoup trees
+    are full of reference cycles, so otherwise they stay in memory until the
+    cycle collector gets around to them. Calling decompose() on the soup
+    object only clears the root, so each top-level element is done too.
+    
+    """
+    for element in list(parsed.contents):
+        if isinstance(element, Tag):
+            element.decompose()
+    parsed.decompose()
+
 def freeze_time(obj):
-    """ Add support for datetime objects to the JSON serializer. """
+    """ Add support for datetime objects and event records to the JSON
+    serializer.
+
+    """
     if isinstance(obj, datetime.datetime) or isinstance(obj, datetime.date):
         return obj.isoformat()
+    if isinstance(obj, Record):
+        return obj.to_dict()
     return obj
 
 if __name__ == "__main__":
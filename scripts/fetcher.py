@@ -0,0 +1,141 @@
+""" Threaded page fetcher for the scrapers.
+
+Downloads are handed to a small pool of worker threads so that waiting on the
+network overlaps with parsing pages that have already arrived. Politeness is
+enforced separately from concurrency: every request to a host first has to
+take a token from that host's bucket, so adding workers never increases the
+request rate beyond what's configured.
+
+"""
+
+import sys
+import time
+import threading
+import urlparse
+import Queue
+
+
+class TokenBucket(object):
+    """ Classic token bucket. Tokens refill continuously at `rate` per second
+    up to `capacity`, and each request consumes one. A rate of None or zero
+    disables the limit.
+
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate) if rate else None
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available, then consume it. """
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            # Sleep outside the lock so other threads can check the bucket.
+            time.sleep(wait)
+
+
+class HostThrottle(object):
+    """ Keeps one TokenBucket per host, created on first use. """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        """ Block until a request to the host in `url` is allowed. """
+        host = urlparse.urlsplit(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+class FetchScheduler(object):
+    """ Runs a fetch function over a stream of URLs with a bounded pool of
+    worker threads.
+
+    `fetch` is called with a single URL and should return the page body. The
+    scheduler doesn't do any rate limiting itself; `fetch` is expected to call
+    HostThrottle.wait() before it actually touches the network, which lets
+    cache hits skip the wait entirely.
+
+    """
+    def __init__(self, fetch, workers=4, lookahead=None):
+        self.fetch = fetch
+        self.workers = max(1, workers)
+        # How many URLs can be in flight or finished-but-unconsumed at once.
+        # Bounding this keeps memory flat and keeps the URL generator (which
+        # downloads digest pages) from racing too far ahead.
+        self.lookahead = lookahead or self.workers * 2
+
+    def map(self, urls):
+        """ Generator that yields (url, body) tuples in the same order as
+        `urls`. Pages are downloaded in the background while the caller
+        works on earlier results. An exception raised while fetching a page
+        is re-raised here when that page's turn comes up.
+
+        """
+        todo = Queue.Queue()
+        done = Queue.Queue()
+        threads = []
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, args=(todo, done))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        urls = iter(urls)
+        results = {}
+        submitted = next_idx = 0
+        exhausted = False
+        try:
+            while True:
+                # Top up the window of outstanding work.
+                while not exhausted and submitted - next_idx < self.lookahead:
+                    try:
+                        url = urls.next()
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    todo.put((submitted, url))
+                    submitted += 1
+                if next_idx == submitted:
+                    break
+                # Wait for the next page in order, stashing any that finish
+                # out of order.
+                while next_idx not in results:
+                    idx, url, body, exc_info = done.get()
+                    results[idx] = (url, body, exc_info)
+                url, body, exc_info = results.pop(next_idx)
+                next_idx += 1
+                if exc_info:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                yield url, body
+        finally:
+            for t in threads:
+                todo.put(None)
+
+    def _worker(self, todo, done):
+        while True:
+            item = todo.get()
+            if item is None:
+                return
+            idx, url = item
+            try:
+                done.put((idx, url, self.fetch(url), None))
+            except Exception:
+                done.put((idx, url, None, sys.exc_info()))
@@ -0,0 +1,170 @@
+""" Persistent HTTP client for the scrapers.
+
+urllib2 opens a new connection for every page and gives up on the first
+error. An HTTPSession keeps idle keep-alive connections to each host in a
+small pool and reuses them, asks for gzip and undoes it, follows redirects,
+and retries server errors (5xx), timeouts and dropped connections with
+jittered exponential backoff, so one bad response doesn't end a long crawl.
+
+Each attempt is timed under the "request" stage (see instrument.py), and
+retries are counted, so slow or flaky stretches show up in the metrics. The
+response also carries its own latency.
+
+Responses that still fail after the last retry, and other error statuses,
+raise urllib2.HTTPError like urlopen does. 304 Not Modified is returned as a
+normal response, since it's expected for conditional requests.
+
+"""
+
+import time
+import zlib
+import random
+import socket
+import httplib
+import urllib2
+import urlparse
+import threading
+
+import instrument
+
+# Statuses that are followed to their Location.
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class Response(object):
+    """ A finished response. `headers` has a getheader method, like the
+    headers from urlopen, and `body` has already been decompressed. `size` is
+    the number of bytes that came over the wire, and `latency` the seconds
+    taken by the last attempt.
+
+    """
+    def __init__(self, url, status, reason, headers, body, size, latency, attempts):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.size = size
+        self.latency = latency
+        self.attempts = attempts
+
+
+class HTTPSession(object):
+    """ Pools keep-alive connections per host and retries failed requests.
+    Safe to share between threads; each request has a connection to itself
+    while it runs.
+
+    `retries` is the number of extra attempts after the first. The wait
+    before retry n (counting from 0) is drawn from between half and all of
+    backoff * 2**n seconds, capped at max_backoff, so threads that failed
+    together don't all come back at once.
+
+    """
+    def __init__(self, timeout=60, retries=3, backoff=1.0, max_backoff=60,
+                 pool_size=4, user_agent=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.user_agent = user_agent
+        # (scheme, host:port) -> idle connections
+        self.pool = {}
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None):
+        """ GETs a URL, following redirects. Returns a Response. """
+        for i in range(MAX_REDIRECTS + 1):
+            response = self._get(url, headers or {})
+            if response.status not in REDIRECTS or not response.headers.getheader('Location'):
+                return response
+            url = urlparse.urljoin(url, response.headers.getheader('Location'))
+        raise urllib2.HTTPError(url, response.status, "Too many redirects", response.headers, None)
+
+    def close(self):
+        """ Closes every idle connection. """
+        with self.lock:
+            pools, self.pool = self.pool, {}
+        for connections in pools.values():
+            for conn in connections:
+                conn.close()
+
+    def backoff_delay(self, attempt):
+        """ Seconds to wait before retry number `attempt`, from 0. """
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return random.uniform(delay / 2.0, delay)
+
+    def _get(self, url, headers):
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_headers = {'Accept-Encoding': 'gzip'}
+        if self.user_agent:
+            request_headers['User-Agent'] = self.user_agent
+        request_headers.update(headers)
+        attempt = 0
+        while True:
+            conn, reused = self._checkout(key)
+            start = time.time()
+            try:
+                with instrument.timer('request', url):
+                    conn.request('GET', path, headers=request_headers)
+                    raw = conn.getresponse()
+                    data = raw.read()
+            except (socket.error, httplib.HTTPException) as e:
+                conn.close()
+                # A pooled connection may have been closed by the server
+                # while it sat idle. That's not the server failing, so try
+                # again straight away on a new connection.
+                if reused and not isinstance(e, socket.timeout):
+                    continue
+                if attempt >= self.retries:
+                    raise
+                print "(%s, retrying)" % (e or type(e).__name__)
+            else:
+                latency = time.time() - start
+                if raw.will_close:
+                    conn.close()
+                else:
+                    self._checkin(key, conn)
+                if raw.status < 500 or attempt >= self.retries:
+                    break
+                print "(server error %d, retrying)" % (raw.status)
+            instrument.count('retries', url=url)
+            time.sleep(self.backoff_delay(attempt))
+            attempt += 1
+
+        body = data
+        if raw.getheader('Content-Encoding', '').lower() == 'gzip':
+            # 16 + MAX_WBITS tells zlib to expect a gzip header.
+            body = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        response = Response(url, raw.status, raw.reason, raw.msg, body, len(data), latency,
+                            attempt + 1)
+        if raw.status >= 400:
+            raise urllib2.HTTPError(url, raw.status, raw.reason, raw.msg, None)
+        return response
+
+    def _checkout(self, key):
+        """ Returns an idle connection to a host, or a new one, and whether
+        it's been used before.
+
+        """
+        with self.lock:
+            idle = self.pool.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, netloc = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _checkin(self, key, conn):
+        with self.lock:
+            idle = self.pool.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
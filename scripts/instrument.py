@@ -0,0 +1,211 @@
+""" Stage timings and counters for the scrapers.
+
+Code marks out the stages of its work with `timer`, and counts things with
+`count`, both optionally tagged with the URL of the page being worked on.
+Nothing is recorded until `enable` is called, and while it's off `timer`
+hands back a shared do-nothing context manager, so leaving the calls in
+costs about as much as an attribute lookup.
+
+At the end of a run, `Metrics.summary` has the totals per stage and per page,
+and the metrics can be written out as JSON or as a Prometheus textfile (for
+node_exporter's textfile collector).
+
+"""
+
+import os
+import json
+import time
+import datetime
+import tempfile
+import threading
+
+# Prefix for the names of metrics in the Prometheus textfile.
+PROMETHEUS_PREFIX = 'us_reactors_scraper'
+
+_metrics = None
+
+
+class Metrics(object):
+    """ Durations per stage and counters, totaled for the whole run and for
+    each page. Safe to update from multiple threads.
+
+    """
+    def __init__(self):
+        self.started = time.time()
+        # stage -> [calls, total seconds, longest call]
+        self.stages = {}
+        self.counters = {}
+        # url -> {'stages': {stage: seconds}, 'counters': {name: n}}
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds, url=None):
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            if url:
+                page = self._page(url)['stages']
+                page[stage] = page.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1, url=None):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            if url:
+                page = self._page(url)['counters']
+                page[name] = page.get(name, 0) + n
+
+    def snapshot(self):
+        """ Everything recorded so far, as plain data that can be passed
+        between processes and added to another Metrics with `merge`.
+
+        """
+        with self.lock:
+            return {
+                'stages': dict((k, list(v)) for k, v in self.stages.items()),
+                'counters': dict(self.counters),
+                'pages': json.loads(json.dumps(self.pages)),
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for stage, (calls, seconds, longest) in snapshot['stages'].items():
+                totals = self.stages.setdefault(stage, [0, 0.0, 0.0])
+                totals[0] += calls
+                totals[1] += seconds
+                totals[2] = max(totals[2], longest)
+            for name, n in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for url, other in snapshot['pages'].items():
+                page = self._page(url)
+                for kind in ('stages', 'counters'):
+                    for name, value in other[kind].items():
+                        page[kind][name] = page[kind].get(name, 0) + value
+
+    def cache_hit_ratio(self):
+        """ Share of page cache lookups that didn't need the network, or None
+        if there weren't any.
+
+        """
+        hits = self.counters.get('cache_hits', 0)
+        lookups = hits + self.counters.get('cache_misses', 0)
+        return float(hits) / lookups if lookups else None
+
+    def summary(self):
+        with self.lock:
+            stages = dict((stage, {
+                'calls': calls,
+                'seconds': round(seconds, 6),
+                'max_seconds': round(longest, 6),
+            }) for stage, (calls, seconds, longest) in self.stages.items())
+            counters = dict(self.counters)
+            pages = json.loads(json.dumps(self.pages))
+        return {
+            'started': datetime.datetime.utcfromtimestamp(self.started).isoformat() + 'Z',
+            'seconds': round(time.time() - self.started, 6),
+            'stages': stages,
+            'counters': counters,
+            'cache_hit_ratio': self.cache_hit_ratio(),
+            'pages': pages,
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4, sort_keys=True)
+
+    def write_prometheus(self, path):
+        """ Writes the run totals in the Prometheus text format. Per-page
+        numbers are left out to keep the number of series down. The file is
+        renamed into place so a collector never reads half of it.
+
+        """
+        summary = self.summary()
+        lines = []
+        def metric(name, kind, help_text, samples):
+            name = '%s_%s' % (PROMETHEUS_PREFIX, name)
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, labels, repr(float(value))))
+        stages = sorted(summary['stages'].items())
+        metric('stage_seconds_total', 'counter', "Time spent in each stage.",
+               [('{stage="%s"}' % s, v['seconds']) for s, v in stages])
+        metric('stage_calls_total', 'counter', "Times each stage ran.",
+               [('{stage="%s"}' % s, v['calls']) for s, v in stages])
+        metric('stage_max_seconds', 'gauge', "Longest single run of each stage.",
+               [('{stage="%s"}' % s, v['max_seconds']) for s, v in stages])
+        for name, value in sorted(summary['counters'].items()):
+            metric('%s_total' % name, 'counter', "Count of %s." % name.replace('_', ' '),
+                   [('', value)])
+        if summary['cache_hit_ratio'] is not None:
+            metric('cache_hit_ratio', 'gauge', "Share of page cache lookups that were hits.",
+                   [('', summary['cache_hit_ratio'])])
+        metric('run_seconds', 'gauge', "Length of the run.", [('', summary['seconds'])])
+        metric('last_run_timestamp_seconds', 'gauge', "When the run started.",
+               [('', self.started)])
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.metrics')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+
+    def _page(self, url):
+        if url not in self.pages:
+            self.pages[url] = {'stages': {}, 'counters': {}}
+        return self.pages[url]
+
+
+class _Timer(object):
+    def __init__(self, metrics, stage, url):
+        self.metrics = metrics
+        self.stage = stage
+        self.url = url
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.stage, time.time() - self.start, self.url)
+        return False
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable():
+    """ Starts recording into a new Metrics, which is returned. """
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def disable():
+    global _metrics
+    _metrics = None
+
+
+def current():
+    """ The Metrics being recorded into, or None if instrumentation is off. """
+    return _metrics
+
+
+def timer(stage, url=None):
+    """ Context manager that adds the time spent inside it to `stage`. """
+    if _metrics is None:
+        return _NULL_TIMER
+    return _Timer(_metrics, stage, url)
+
+
+def count(name, n=1, url=None):
+    if _metrics is not None:
+        _metrics.count(name, n, url)
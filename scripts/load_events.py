@@ -0,0 +1,323 @@
+#!/usr/bin/python
+
+""" Loads events written by events_scraper.py into the database.
+
+Works in chunks: every Facility, Reactor, CFRSection and EventPerson is loaded
+into memory once up front (facilities and reactors into an AliasIndex, see
+aliases.py), and each chunk of events is written with a handful
+of bulk queries inside a single transaction. Events are matched on their NRC
+event number, so running the loader again only touches events that changed.
+The search index (see search.py) and the per-facility and per-reactor event
+stats (see stats.py) are updated for the same events.
+
+usage: load_events.py eventsdir
+
+"""
+
+import os
+import sys
+import json
+import glob
+
+import dateutil.parser
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from us_reactors.models import EventNotification, EventReactorStatus, \
+    CFRSection, EventPerson, DataVersion
+from us_reactors import search, stats
+from us_reactors.aliases import AliasIndex
+from records import Event
+from event_index import EventIndex
+
+# Number of events written per transaction.
+CHUNK_SIZE = 500
+
+# EventNotification fields that come straight from the scraped event. Existing
+# rows are only rewritten if one of these, or the event's reactor statuses,
+# CFR sections or people, has changed.
+EVENT_FIELDS = [
+    'url', 'subject', 'body', 'emergency_status', 'report_time', 'event_time',
+    'update_date', 'crawl_time', 'retracted', 'facility_id',
+    'nrc_notified_by', 'hq_ops_officer',
+]
+# EventReactorStatus fields that come from the scraped event.
+STATUS_FIELDS = [
+    'critical', 'scram', 'inital_mode', 'current_mode', 'initial_power', 'current_power',
+]
+
+
+def main(argv):
+    try:
+        base = argv[1]
+    except IndexError:
+        print "usage: %s eventsdir" % (argv[0])
+        return 1
+    if not os.path.isdir(base):
+        print "Error opening %s: not a directory" % (base)
+        return 1
+    loader = EventLoader()
+    counts = loader.load(read_events(base))
+    print "Done. %(inserted)d inserted, %(updated)d updated, " \
+          "%(unchanged)d unchanged, %(skipped)d skipped" % counts
+    for line in loader.aliases.report():
+        print line
+
+
+def read_events(base):
+    """ Generator that yields the latest version of every event in an events
+    directory, in event number order. Uses the canonical records from the
+    event index if there is one (see event_index.py); otherwise handles both
+    the one-file-per-event layout and JSON Lines shards.
+
+    """
+    if os.path.exists(os.path.join(base, EventIndex.INDEX_NAME)):
+        for event in EventIndex(base).events():
+            yield event
+        return
+    index_path = os.path.join(base, 'events-index.json')
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        names = index.keys()
+    else:
+        index = None
+        names = [os.path.basename(p)[:-5] for p in glob.glob(os.path.join(base, '*-*.json'))]
+    # Output names are "<event number>-<page date>". An event shows up again
+    # on later pages as it's updated, so only the newest page counts.
+    latest = {}
+    for name in names:
+        number, page_date = [int(p) for p in name.split('-')]
+        if page_date > latest.get(number, (0, None))[0]:
+            latest[number] = (page_date, name)
+    for number in sorted(latest):
+        name = latest[number][1]
+        if index is None:
+            with open(os.path.join(base, name + '.json')) as f:
+                yield Event.from_dict(json.load(f))
+        else:
+            shard, offset, length = index[name]
+            with open(os.path.join(base, shard), 'rb') as f:
+                f.seek(offset)
+                yield Event.from_dict(json.loads(f.read(length)))
+
+
+class EventLoader(object):
+    """ Bulk loads scraped events. Lookup tables are built once when the
+    loader is created, and grow as new CFR sections and people are added.
+
+    """
+    def __init__(self, aliases=None):
+        self.aliases = aliases or AliasIndex()
+        self.sections = dict(((s, t), i) for i, s, t in
+                             CFRSection.objects.values_list('id', 'section', 'title'))
+        self.people = dict(((n, o), i) for i, n, o in
+                           EventPerson.objects.values_list('id', 'name', 'organization'))
+
+    def load(self, events):
+        """ Loads an iterable of scraped events. Returns a dict of counts. """
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        chunk = []
+        for event in events:
+            chunk.append(event)
+            if len(chunk) >= CHUNK_SIZE:
+                self._load_chunk(chunk, counts)
+                chunk = []
+        if chunk:
+            self._load_chunk(chunk, counts)
+        return counts
+
+    def _load_chunk(self, events, counts):
+        with transaction.commit_on_success():
+            self._write_chunk(events, counts)
+
+    def _write_chunk(self, events, counts):
+        rows = {}
+        for event in events:
+            row = self.convert(event)
+            if row is None:
+                counts['skipped'] += 1
+                continue
+            rows[row['event_num']] = row
+        existing = dict((r['event_num'], r) for r in EventNotification.objects.filter(
+            event_num__in=rows.keys()).values('id', 'event_num', *EVENT_FIELDS))
+        related = self._related([r['id'] for r in existing.values()])
+
+        new = [n for n in rows if n not in existing]
+        changed = [n for n in rows if n in existing and
+                   self._differs(rows[n], existing[n], related[existing[n]['id']])]
+        counts['inserted'] += len(new)
+        counts['updated'] += len(changed)
+        counts['unchanged'] += len(rows) - len(new) - len(changed)
+
+        # Changed events keep their ids, but their related rows are replaced.
+        # update() wants the foreign key by field name, not column name.
+        for n in changed:
+            values = dict(rows[n]['fields'])
+            values['facility'] = values.pop('facility_id')
+            EventNotification.objects.filter(pk=existing[n]['id']).update(**values)
+        changed_ids = [existing[n]['id'] for n in changed]
+        stats_update = stats.EventStatsUpdate()
+        if changed_ids:
+            # Take the old versions of changed events back out of the stats.
+            for n in changed:
+                old = existing[n]
+                stats_update.add(old['facility_id'], related[old['id']]['statuses'],
+                                 old['retracted'], old['event_time'], -1)
+            EventReactorStatus.objects.filter(event__in=changed_ids).delete()
+            for field in ('cfr_sections', 'people'):
+                through = getattr(EventNotification, field).through
+                through.objects.filter(eventnotification__in=changed_ids).delete()
+
+        EventNotification.objects.bulk_create(
+            [EventNotification(event_num=n, **rows[n]['fields']) for n in new])
+        # bulk_create doesn't return primary keys, so look them up.
+        ids = dict(EventNotification.objects.filter(event_num__in=new).values_list('event_num', 'id'))
+        ids.update((n, existing[n]['id']) for n in changed)
+
+        self._add_lookups(CFRSection, self.sections, ('section', 'title'),
+                          [rows[n]['sections'] for n in ids])
+        self._add_lookups(EventPerson, self.people, ('name', 'organization'),
+                          [rows[n]['people'] for n in ids])
+
+        statuses = []
+        section_links = []
+        people_links = []
+        SectionLink = EventNotification.cfr_sections.through
+        PersonLink = EventNotification.people.through
+        for n, event_id in ids.items():
+            row = rows[n]
+            stats_update.add(row['fields']['facility_id'], row['statuses'],
+                             row['fields']['retracted'], row['fields']['event_time'])
+            for reactor_id, status in row['statuses']:
+                statuses.append(EventReactorStatus(event_id=event_id, reactor_id=reactor_id, **status))
+            for key in set(row['sections']):
+                section_links.append(SectionLink(eventnotification_id=event_id,
+                                                 cfrsection_id=self.sections[key]))
+            for key in set(row['people']):
+                people_links.append(PersonLink(eventnotification_id=event_id,
+                                               eventperson_id=self.people[key]))
+        EventReactorStatus.objects.bulk_create(statuses)
+        SectionLink.objects.bulk_create(section_links)
+        PersonLink.objects.bulk_create(people_links)
+        search.index_events(ids.values())
+        stats_update.save()
+        if new or changed:
+            DataVersion.bump()
+
+    def _add_lookups(self, model, lookup, fields, key_lists):
+        """ Creates rows for any lookup keys that aren't in the database yet,
+        then adds their ids to the in-memory lookup table.
+
+        """
+        missing = set()
+        for keys in key_lists:
+            missing.update(k for k in keys if k not in lookup)
+        if not missing:
+            return
+        model.objects.bulk_create([model(**dict(zip(fields, k))) for k in missing])
+        # bulk_create doesn't return primary keys, so look them up.
+        query = model.objects.filter(**{fields[0] + '__in': set(k[0] for k in missing)})
+        for row in query.values_list('id', *fields):
+            lookup.setdefault(tuple(row[1:]), row[0])
+
+    def _related(self, event_ids):
+        """ The reactor statuses, CFR sections and people stored for events,
+        keyed by event id, in the same form convert() returns them.
+
+        """
+        related = dict((i, {'statuses': [], 'sections': [], 'people': []}) for i in event_ids)
+        if not event_ids:
+            return related
+        for status in EventReactorStatus.objects.filter(event__in=event_ids).values(
+                'event', 'reactor', *STATUS_FIELDS):
+            reactor_id = status.pop('reactor')
+            related[status.pop('event')]['statuses'].append((reactor_id, status))
+        links = (
+            ('sections', EventNotification.cfr_sections.through,
+             ('cfrsection__section', 'cfrsection__title')),
+            ('people', EventNotification.people.through,
+             ('eventperson__name', 'eventperson__organization')),
+        )
+        for key, through, fields in links:
+            for row in through.objects.filter(eventnotification__in=event_ids).values_list(
+                    'eventnotification', *fields):
+                related[row[0]][key].append(tuple(row[1:]))
+        return related
+
+    def _differs(self, row, existing, related):
+        """ Whether a converted event differs from its row in the database,
+        or from the related rows stored with it.
+
+        """
+        if any(row['fields'][f] != existing[f] for f in EVENT_FIELDS):
+            return True
+        return (sorted(row['statuses']) != sorted(related['statuses']) or
+                set(row['sections']) != set(related['sections']) or
+                set(row['people']) != set(related['people']))
+
+    def convert(self, event):
+        """ Turns a scraped event into the values needed for the database.
+        Returns None if the facility can't be matched to a Facility row.
+
+        """
+        # Other units at the site are listed too, but weren't involved.
+        units = [unit for unit in event.reactor_status if getattr(unit, 'affected', True)]
+        facility_id = self.aliases.facility(event.facility, [unit.unit for unit in units])
+        if facility_id is None:
+            return None
+        fields = {
+            'url': event.url,
+            'subject': event.subject[:255],
+            'body': '\n\n'.join(event.body),
+            'emergency_status': event.emergency[:25],
+            'report_time': db_datetime(event.report_time),
+            'event_time': db_datetime(event.event_time),
+            'update_date': dateutil.parser.parse(event.update_date).date(),
+            'crawl_time': db_datetime(event.crawl_time),
+            'retracted': event.retracted,
+            'facility_id': facility_id,
+            'nrc_notified_by': event.nrc_notified_by[:100],
+            'hq_ops_officer': event.hq_ops_officer[:100],
+        }
+        statuses = []
+        for unit in units:
+            reactor_id = self.aliases.reactor(facility_id, unit.unit, event.facility)
+            if reactor_id is None:
+                continue
+            statuses.append((reactor_id, {
+                'critical': unit.critical,
+                'scram': unit.scram[:3],
+                'inital_mode': unit.initial_mode[:25],
+                'current_mode': unit.current_mode[:25],
+                'initial_power': unit.initial_power,
+                'current_power': unit.current_power,
+            }))
+        # The HTML parser splits section names that contain " - " into extra
+        # tuple items, so glue them back together.
+        sections = [(s[0][:50], ' - '.join(s[1:])[:50]) for s in event.cfr10_sections]
+        people = [(p.name[:100], (p.organization or '')[:100]) for p in event.people]
+        return {
+            'event_num': event.event_number,
+            'fields': fields,
+            'statuses': statuses,
+            'sections': sections,
+            'people': people,
+        }
+
+
+def db_datetime(value):
+    """ Converts a timestamp from the scraper's JSON (ISO 8601, always UTC)
+    to a datetime for the database. Date-only values become midnight UTC.
+
+    """
+    parsed = dateutil.parser.parse(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if not settings.USE_TZ:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
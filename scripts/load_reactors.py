@@ -5,91 +5,164 @@ import re
 import datetime
 
 import csvkit
+from django.db import transaction
 
-from us_reactors.models import Facility, Reactor, VENDORS
+from us_reactors.models import Facility, Reactor, DataVersion, VENDORS
+import reactors_xml2csv
+
+# Reactor fields set from the CSV. wiki_url is filled in by hand, so it's
+# left alone.
+REACTOR_FIELDS = [
+    'unit', 'nrc_id', 'nrc_url', 'nrc_photo', 'type', 'containment', 'vendor',
+    'model', 'engineer', 'constructor', 'permit_issued_on', 'license_issued_on',
+    'operational_on', 'license_renewed_on', 'license_expires_on', 'capacity',
+    'thermal_capacity', 'active', 'latitude', 'longitude', 'facility_id',
+]
 
 def main(argv):
     try:
         raw_in = open(argv[1], 'rb')
     except IndexError:
-        print "usage: %s csvfile" % (argv[0])
+        print "usage: %s csvfile [xmlfile]" % (argv[0])
         return 1
     except IOError as e:
         print "Error opening %s: %s" %(argv[1], e.strerror)
         return 1
-    csv_in = csvkit.CSVKitDictReader(raw_in)
-    for record in csv_in:
-        print "%s: %s" % (record['docket'], record['NRC Reactor Unit Web Page'])
-        r = load_reactor(record)
-        print "-> saved as %d" % (r.id)
-
-def load_reactor(record):
-    plant = find_facility(record)
-    r = Reactor()
+    if len(argv) > 2:
+        # Excel export and XML file, joined here instead of with csvjoin.
+        records = join_reactor_sources(raw_in, argv[2])
+    else:
+        # A file that was already merged by hand.
+        records = csvkit.CSVKitDictReader(raw_in)
+    counts = load_reactors(records)
+    print "Done. %(facilities)d new facilities. Reactors: %(inserted)d inserted, " \
+          "%(updated)d updated, %(unchanged)d unchanged" % counts
+
+def join_reactor_sources(excel_in, xml_path):
+    """ Generator that joins rows from the Excel export (an open CSV file) with
+    the facilities in operatingreactors.xml on docket number. The smaller XML
+    side is read into a dict, then the CSV is streamed past it. Header names
+    have runs of spaces collapsed and trailing spaces removed, so they match
+    the names load_reactors expects. Rows with no match are skipped, same as
+    csvjoin would.
+
+    """
+    xml_rows = dict((row['docket'], row) for row in reactors_xml2csv.read_reactors_xml(xml_path))
+    csv_in = csvkit.CSVKitDictReader(excel_in)
+    names = dict((name, normalize_header(name)) for name in csv_in.fieldnames)
+    for row in csv_in:
+        record = dict((names[k], v) for k, v in row.iteritems())
+        docket = int(record['Docket Number'])
+        if docket not in xml_rows:
+            print "No XML entry for docket %d, skipping" % (docket)
+            continue
+        record.update(xml_rows[docket])
+        yield record
+
+def normalize_header(name):
+    """ Collapses whitespace in a CSV header name. The Excel export has
+    headers like "Docket  Number" and "Licensee ".
+    
+    """
+    return ' '.join(name.split())
+
+def load_reactors(records):
+    """ Creates or updates the reactors and facilities for an iterable of
+    input rows, all in one transaction. Reactors are matched on their NRC
+    docket number, so the same file can be loaded again safely. Returns a
+    dict of counts.
+    
+    """
+    counts = {'facilities': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0}
+    with transaction.commit_on_success():
+        facility_ids = dict(Facility.objects.values_list('short_name', 'id'))
+        new_facilities = {}
+        rows = []
+        for record in records:
+            short_name = parse_short_name(record['NRC Reactor Unit Web Page'])[0]
+            if short_name not in facility_ids and short_name not in new_facilities:
+                new_facilities[short_name] = Facility(**facility_values(record))
+            rows.append((short_name, reactor_values(record)))
+        if new_facilities:
+            Facility.objects.bulk_create(new_facilities.values())
+            # bulk_create doesn't return primary keys, so look them up.
+            facility_ids.update(Facility.objects.filter(
+                short_name__in=new_facilities.keys()).values_list('short_name', 'id'))
+            counts['facilities'] = len(new_facilities)
+
+        existing = dict((r['nrc_id'], r) for r in Reactor.objects.values('id', *REACTOR_FIELDS))
+        new_reactors = []
+        for short_name, values in rows:
+            values['facility_id'] = facility_ids[short_name]
+            old = existing.get(values['nrc_id'])
+            if old is None:
+                new_reactors.append(Reactor(**values))
+                counts['inserted'] += 1
+            elif any(values[f] != old[f] for f in REACTOR_FIELDS):
+                # update() wants the foreign key by field name, not column name.
+                values['facility'] = values.pop('facility_id')
+                Reactor.objects.filter(pk=old['id']).update(**values)
+                counts['updated'] += 1
+            else:
+                counts['unchanged'] += 1
+        Reactor.objects.bulk_create(new_reactors)
+        if counts['facilities'] or counts['inserted'] or counts['updated']:
+            DataVersion.bump()
+    return counts
+
+def reactor_values(record):
+    """ Reactor field values for an input row, apart from the facility. """
+    r = {}
     # A few facilities have only one reactor and don't include a numbered unit.
     name, unit = parse_name(record['Plant Name, Unit Number'])
-    r.name = name
-    r.unit = unit if unit else 0
-    r.nrc_id = int(record['docket'])
-    r.nrc_url = record['nrc_url']
-    r.nrc_photo = record['nrc_photo']
-    r.type, r.containment = record['Reactor and Containment Type'].split('-')
+    r['unit'] = unit if unit else 0
+    r['nrc_id'] = int(record['docket'])
+    r['nrc_url'] = record['nrc_url']
+    r['nrc_photo'] = record['nrc_photo']
+    r['type'], r['containment'] = record['Reactor and Containment Type'].split('-')
     # Vendor and model are derived from the same column. Requires some cleanup
     # because Combustion Engineering models are stored weird.
     model_raw = record['Nuclear Steam System Supplier and Design Type']
     if model_raw.startswith('COMB'):
         model_raw = model_raw.replace('COMB ', '')
-    r.model = model_raw
+    r['model'] = model_raw
+    r['vendor'] = ''
     for vendor_code, vendor_name in VENDORS:
         if vendor_code in model_raw:
-            r.vendor = vendor_code
+            r['vendor'] = vendor_code
             break
-    r.engineer = record['Architect-Engineer']
+    r['engineer'] = record['Architect-Engineer']
     # Not a typo. Field name is spelled wrong in data.
-    r.constructor = record['Contructor']
-    r.permit_issued_on = parse_date(record['Construction Permit Issued'])
-    r.license_issued_on = parse_date(record['Operating License Issued'])
-    r.operational_on = parse_date(record['Commercial Operation'])
+    r['constructor'] = record['Contructor']
+    r['permit_issued_on'] = parse_date(record['Construction Permit Issued'])
+    r['license_issued_on'] = parse_date(record['Operating License Issued'])
+    r['operational_on'] = parse_date(record['Commercial Operation'])
+    r['license_renewed_on'] = None
     if record['Renewed Operating License Issued']:
-        r.license_renewed_on = parse_date(record['Renewed Operating License Issued'])
-    r.license_expires_on = parse_date(record['Operating License Expires'])
-    r.capacity = float(record['capacity'])
-    r.thermal_capacity = float(record['Licensed MWt'])
-    r.active = True
-    r.latitude = float(record['latitude'])
-    r.longitude = float(record['longitude'])
-    r.facility = plant
-    r.save()
+        r['license_renewed_on'] = parse_date(record['Renewed Operating License Issued'])
+    r['license_expires_on'] = parse_date(record['Operating License Expires'])
+    r['capacity'] = float(record['capacity'])
+    r['thermal_capacity'] = float(record['Licensed MWt'])
+    r['active'] = True
+    r['latitude'] = float(record['latitude'])
+    r['longitude'] = float(record['longitude'])
     return r
 
-def find_facility(record):
-    """ Lookup the Facility object associated with an input row. Creates the
-    Facility record in the database if it doesn't exist yet.
-    
-    """
-    name = parse_short_name(record['NRC Reactor Unit Web Page'])[0]
-    try:
-        facility = Facility.objects.get(short_name=name)
-        return facility
-    except Facility.DoesNotExist:
-        # Create the Facility record using the data row.
-        return load_facility(record)
-
-def load_facility(record):
-    f = Facility()
+def facility_values(record):
+    """ Facility field values for an input row. """
+    f = {}
     # Ignore the unit number returned by with both names.
-    f.name = parse_name(record['Plant Name, Unit Number'])[0]
-    f.short_name = parse_short_name(record['NRC Reactor Unit Web Page'])[0]
+    f['name'] = parse_name(record['Plant Name, Unit Number'])[0]
+    f['short_name'] = parse_short_name(record['NRC Reactor Unit Web Page'])[0]
     # City and state are in a field that also includes the relative distance
     # to the nearest larger city. Needless to say that data can be ignored.
     # Some rows are formatted wrong, such as not capitalizing both letters in
     # the state code or using a period instead of a comma.
     parts = re.match(r'(.+?)[,.]\s+(\w{2})\s?\(', record['Location'])
-    f.city = parts.group(1)
-    f.state = parts.group(2).upper()
-    f.region = int(record['NRC Region'])
-    f.operator = record['Licensee']
-    f.save()
+    f['city'] = parts.group(1)
+    f['state'] = parts.group(2).upper()
+    f['region'] = int(record['NRC Region'])
+    f['operator'] = record['Licensee']
     return f
 
 def parse_name(raw):
@@ -0,0 +1,65 @@
+""" Record of what was produced from each daily page.
+
+For every page URL the manifest keeps the SHA-1 of the page content, the
+parser engine and version that handled it, and the output files it produced.
+A page only needs to be parsed again when one of those has changed, and
+outputs listed for a page but no longer produced by it can be removed.
+
+"""
+
+import os
+import json
+import tempfile
+
+
+class Manifest(object):
+    def __init__(self, path):
+        self.path = path
+        self.changed = False
+        try:
+            with open(path) as f:
+                self.pages = json.load(f)
+        except IOError:
+            self.pages = {}
+
+    def is_current(self, url, digest, engine, version, exists):
+        """ Whether the outputs for a page are up to date: the page content
+        and parser are the same as last time, and every output still exists
+        according to the `exists` function.
+
+        """
+        entry = self.pages.get(url)
+        if not entry:
+            return False
+        if (entry['hash'], entry['engine'], entry['version']) != (digest, engine, version):
+            return False
+        return all(exists(name) for name in entry['outputs'])
+
+    def record(self, url, digest, engine, version, outputs):
+        """ Saves the result of parsing a page. Returns the outputs from the
+        previous run of this page that weren't produced this time.
+
+        """
+        old = self.pages.get(url)
+        self.pages[url] = {
+            'hash': digest,
+            'engine': engine,
+            'version': version,
+            'outputs': sorted(outputs),
+        }
+        self.changed = True
+        if not old:
+            return []
+        return sorted(set(old['outputs']) - set(outputs))
+
+    def save(self):
+        """ Write the manifest to disk if it has changed. """
+        if not self.changed:
+            return
+        # Write to a temp file and rename so the manifest is never left
+        # half-written.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.pages, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.path)
+        self.changed = False
@@ -0,0 +1,180 @@
+""" On-disk cache for downloaded pages.
+
+Page bodies are gzipped and stored under the SHA-1 of their content, sharded
+into subdirectories by the first two hex digits of the hash:
+
+    <base>/index.json
+    <base>/3f/3f0c...e1.gz
+
+The index maps each URL to the hash of its current content, when it was last
+fetched or revalidated, and the ETag and Last-Modified headers needed to make a
+conditional request the next time around. Identical pages share one file.
+
+"""
+
+import os
+import json
+import gzip
+import time
+import hashlib
+import tempfile
+import threading
+
+
+class PageCache(object):
+    # Write the index out after this many changes so a crash in the middle of
+    # a long crawl doesn't lose everything.
+    AUTOSAVE_EVERY = 25
+
+    def __init__(self, base):
+        self.base = base
+        self.index_path = os.path.join(base, 'index.json')
+        self.lock = threading.RLock()
+        self.unsaved = 0
+        if not os.path.isdir(base):
+            os.makedirs(base)
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except IOError:
+            self.index = {}
+
+    def lookup(self, url):
+        """ Returns the index entry for a URL, or None if it isn't cached. """
+        with self.lock:
+            entry = self.index.get(url)
+            return dict(entry) if entry else None
+
+    def urls(self):
+        """ Returns a list of every cached URL. """
+        with self.lock:
+            return self.index.keys()
+
+    def is_fresh(self, entry, max_age):
+        """ Whether an entry was fetched or revalidated within `max_age`
+        seconds. A max_age of None means cached pages never go stale.
+
+        """
+        if max_age is None:
+            return True
+        return time.time() - entry['fetched'] < max_age
+
+    def read(self, entry):
+        """ Returns the uncompressed page body for an index entry. """
+        with gzip.open(self._blob_path(entry['hash']), 'rb') as f:
+            return f.read()
+
+    def conditional_headers(self, entry):
+        """ Request headers that let the server answer 304 Not Modified if
+        the cached copy is still current.
+
+        """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, body, headers=None, fetched=None):
+        """ Add or replace the cached copy of a URL. `headers` is the
+        response's header object (anything with a getheader method).
+
+        """
+        digest = hashlib.sha1(body).hexdigest()
+        path = self._blob_path(digest)
+        # Content addressing means an existing file already has this body.
+        # Compressing is slow, so it's done outside the lock, but the file
+        # is only moved into place under it: another thread could be
+        # dropping the same content for a URL that's moved on, and the blob
+        # has to exist by the time the index points at it.
+        tmp = self._write_blob(path, body) if not os.path.exists(path) else None
+        with self.lock:
+            if tmp and not os.path.exists(path):
+                os.rename(tmp, path)
+            elif tmp:
+                os.remove(tmp)
+            elif not os.path.exists(path):
+                # Dropped since we looked.
+                os.rename(self._write_blob(path, body), path)
+            old = self.index.get(url)
+            self.index[url] = {
+                'hash': digest,
+                'fetched': fetched or time.time(),
+                'etag': headers.getheader('ETag') if headers else None,
+                'last_modified': headers.getheader('Last-Modified') if headers else None,
+            }
+            if old and old['hash'] != digest:
+                self._drop_blob(old['hash'])
+            self._changed()
+
+    def revalidated(self, url, headers=None):
+        """ Record that the server confirmed the cached copy is current. """
+        with self.lock:
+            entry = self.index[url]
+            entry['fetched'] = time.time()
+            # Servers may send updated validators along with a 304.
+            if headers and headers.getheader('ETag'):
+                entry['etag'] = headers.getheader('ETag')
+            if headers and headers.getheader('Last-Modified'):
+                entry['last_modified'] = headers.getheader('Last-Modified')
+            self._changed()
+
+    def import_file(self, url, path):
+        """ Copy a page from an uncompressed file into the cache, keeping the
+        file's modification time as the fetch time. Used to pick up pages from
+        the old flat cache layout.
+
+        """
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.store(url, body, fetched=os.path.getmtime(path))
+        return body
+
+    def save(self):
+        """ Write the index to disk if it has changed. """
+        with self.lock:
+            if not self.unsaved:
+                return
+            # Write to a temp file and rename so the index is never left
+            # half-written.
+            fd, tmp = tempfile.mkstemp(dir=self.base, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.index, f)
+            os.rename(tmp, self.index_path)
+            self.unsaved = 0
+
+    def _changed(self):
+        self.unsaved += 1
+        if self.unsaved >= self.AUTOSAVE_EVERY:
+            self.save()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.base, digest[0:2], digest + '.gz')
+
+    def _write_blob(self, path, body):
+        """ Compresses a page into a temp file next to `path`, and returns
+        the temp file's path.
+
+        """
+        shard = os.path.dirname(path)
+        try:
+            os.makedirs(shard)
+        except OSError:
+            # Already exists, possibly created by another thread.
+            if not os.path.isdir(shard):
+                raise
+        fd, tmp = tempfile.mkstemp(dir=shard, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9) as f:
+                f.write(body)
+        return tmp
+
+    def _drop_blob(self, digest):
+        # Other URLs might share the same content.
+        if any(e['hash'] == digest for e in self.index.itervalues()):
+            return
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
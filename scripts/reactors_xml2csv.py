@@ -10,21 +10,35 @@ INPUT_FILE = "data/operatingreactors.xml"
 
 HEADER_FIELDS = [u'docket', u'latitude', u'longitude', u'nrc_url', u'nrc_photo', u'capacity']
 
-# lxml segfaults when I pass it the filename, so open it first
-fin = open(INPUT_FILE)
-source = etree.parse(fin)
-converted = csv.writer(sys.stdout, HEADER_FIELDS)
-# Fake writeheader() because my Python is outdated.
-converted.writerow(HEADER_FIELDS)
-
-for facility in source.findall('facility'):
-    row = [
-        int(facility.get('id')),
-        # Latitude and longitude left as strings for now to maintain precision.
-        facility.find('latitude').text,
-        facility.find('longitude').text,
-        'http://www.nrc.gov' + facility.find('url').text,
-        'http://www.nrc.gov' + facility.find('photourl').text,
-        float(facility.find('output').text.replace(' MWe', '')),
-    ]
-    converted.writerow(row)
\ No newline at end of file
+def main(argv):
+    converted = csv.writer(sys.stdout, HEADER_FIELDS)
+    # Fake writeheader() because my Python is outdated.
+    converted.writerow(HEADER_FIELDS)
+    for row in read_reactors_xml(argv[1] if len(argv) > 1 else INPUT_FILE):
+        converted.writerow([row[f] for f in HEADER_FIELDS])
+
+def read_reactors_xml(path):
+    """ Generator that yields a dict of HEADER_FIELDS for each facility
+    element in the XML file. Elements are discarded as soon as they've been
+    read, so the whole document is never held in memory.
+
+    """
+    # lxml segfaults when I pass it the filename, so open it first
+    with open(path) as fin:
+        for event, facility in etree.iterparse(fin, tag='facility'):
+            yield {
+                'docket': int(facility.get('id')),
+                # Latitude and longitude left as strings for now to maintain precision.
+                'latitude': facility.find('latitude').text,
+                'longitude': facility.find('longitude').text,
+                'nrc_url': 'http://www.nrc.gov' + facility.find('url').text,
+                'nrc_photo': 'http://www.nrc.gov' + facility.find('photourl').text,
+                'capacity': float(facility.find('output').text.replace(' MWe', '')),
+            }
+            facility.clear()
+            # Also drop references from the root to the finished siblings.
+            while facility.getprevious() is not None:
+                del facility.getparent()[0]
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv))
@@ -0,0 +1,152 @@
+""" Record types for parsed events.
+
+Events used to be nested dicts, which costs a hash table per event, per
+reactor status row and per update. These classes keep their fields in
+__slots__ instead. A field that hasn't been set (or has been deleted, like
+the raw fields process_event replaces) raises AttributeError when read and is
+left out of the JSON, just like a missing dict key was, so the output files
+are unchanged.
+
+Strings that repeat across many events, like reactor modes, scram codes, CFR
+sections and people, go through `intern_string` so every event shares one
+copy. That also turns strings from the HTML parser, which keep the whole
+parse tree alive, into plain unicode.
+
+"""
+
+from collections import namedtuple
+
+_strings = {}
+# Stands in for fields that haven't been set.
+_UNSET = object()
+
+
+def intern_string(value):
+    """ Returns the shared copy of a string. Only use this for fields with a
+    limited set of values; the table is never emptied.
+
+    """
+    if value is None:
+        return None
+    if type(value) not in (str, unicode):
+        value = unicode(value)
+    return _strings.setdefault(value, value)
+
+
+class Record(object):
+    """ Base class for the record types. Fields can be given in __slots__
+    order or by name.
+
+    """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+        for name, value in kwargs.iteritems():
+            setattr(self, name, value)
+
+    def fields(self):
+        """ The fields that are set, as a dict. Values aren't converted, so
+        nested records stay records.
+
+        """
+        values = {}
+        for name in self.__slots__:
+            value = getattr(self, name, _UNSET)
+            if value is not _UNSET:
+                values[name] = value
+        return values
+
+    def to_dict(self):
+        return self.fields()
+
+    def __getstate__(self):
+        return self.fields()
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.fields() == other.fields()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % item for item in sorted(self.fields().items())))
+
+
+class ReactorStatus(Record):
+    """ One row of an event's reactor status table. The first seven fields are
+    in the same order as the table's columns (see REACTOR_STATUS_FIELDS in
+    events_scraper.py).
+
+    """
+    __slots__ = ('unit', 'scram', 'critical', 'initial_power', 'initial_mode',
+                 'current_power', 'current_mode', 'affected')
+
+    def __init__(self, *args, **kwargs):
+        Record.__init__(self, *args, **kwargs)
+        for name in ('scram', 'initial_mode', 'current_mode'):
+            if hasattr(self, name):
+                setattr(self, name, intern_string(getattr(self, name)))
+
+
+class Update(Record):
+    """ The original report or an update to it: a timestamp (None if the
+    header didn't have one), the header line and the paragraphs that follow.
+
+    """
+    __slots__ = ('time', 'header', 'body')
+
+
+class Person(namedtuple('Person', 'name organization')):
+    """ Someone notified about an event. Serializes as a [name, organization]
+    list, the same as the tuples it replaces.
+
+    """
+    __slots__ = ()
+
+    def __new__(cls, name, organization=None):
+        return super(Person, cls).__new__(cls, intern_string(name), intern_string(organization))
+
+
+class Event(Record):
+    """ An event report. The parsers fill in the raw fields as strings, then
+    process_event converts them and deletes the ones that aren't kept
+    (region, state, rx_type, unit, event_date and report_date).
+
+    """
+    __slots__ = ('url', 'retracted', 'crawl_time', 'type', 'event_number', 'facility',
+                 'region', 'state', 'unit', 'rx_type', 'nrc_notified_by', 'hq_ops_officer',
+                 'emergency', 'cfr10_sections', 'report_date', 'report_time', 'event_date',
+                 'event_time', 'update_date', 'people', 'reactor_status', 'subject', 'body',
+                 'updates')
+
+    @classmethod
+    def from_dict(cls, values):
+        """ Rebuilds an event from its JSON. Timestamps are left as strings. """
+        event = cls(**values)
+        if 'reactor_status' in values:
+            event.reactor_status = [ReactorStatus(**s) for s in values['reactor_status']]
+        if 'updates' in values:
+            event.updates = [Update(**u) for u in values['updates']]
+        if 'people' in values:
+            event.people = [Person(*p) for p in values['people']]
+        if 'cfr10_sections' in values:
+            event.cfr10_sections = [section_tuple(s) for s in values['cfr10_sections']]
+        for name in ('type', 'facility', 'emergency', 'nrc_notified_by', 'hq_ops_officer'):
+            if name in values:
+                setattr(event, name, intern_string(values[name]))
+        return event
+
+
+def section_tuple(parts):
+    """ A CFR section as a tuple of interned strings: the section number and
+    the title, which the HTML parser sometimes splits into more parts.
+
+    """
+    return tuple(intern_string(p) for p in parts)
@@ -0,0 +1,112 @@
+""" Full-text search over event notifications.
+
+The index lives in its own table next to the Django models, and which kind
+of table depends on the database:
+
+SQLite uses an FTS5 virtual table whose rowid is the event id, ranked with
+bm25 so that matches in the subject count for more than matches in the body.
+
+PostgreSQL uses a table of precomputed tsvectors with a GIN index, ranked
+with ts_rank. The subject gets weight A and the body weight B.
+
+Other databases fall back to an unranked case-insensitive LIKE.
+
+The body already contains the text of every update, so updates are searched
+along with the original report. The table is created by syncdb (see
+management/__init__.py) and kept current by load_events.py, which reindexes
+each event it inserts or changes.
+
+"""
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from us_reactors.models import EventNotification
+
+SEARCH_TABLE = 'us_reactors_eventsearch'
+EVENT_TABLE = EventNotification._meta.db_table
+# SQLite's default limit on query parameters is 999.
+BATCH_SIZE = 500
+
+
+def create_index(**kwargs):
+    """ Creates the search table if it doesn't exist yet and indexes any
+    events already in the database. Safe to call repeatedly.
+
+    """
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    if SEARCH_TABLE in connection.introspection.table_names():
+        return
+    cursor = connection.cursor()
+    if connection.vendor == 'sqlite':
+        cursor.execute("CREATE VIRTUAL TABLE %s USING fts5(subject, body, tokenize='porter')"
+                       % SEARCH_TABLE)
+    else:
+        # No foreign key, so flushing the event table isn't blocked by this.
+        cursor.execute("CREATE TABLE %s (event_id integer PRIMARY KEY, document tsvector NOT NULL)"
+                       % SEARCH_TABLE)
+        cursor.execute("CREATE INDEX %s_document ON %s USING gin(document)"
+                       % (SEARCH_TABLE, SEARCH_TABLE))
+    index_events(EventNotification.objects.values_list('id', flat=True))
+    transaction.commit_unless_managed()
+
+
+def index_events(event_ids):
+    """ Adds or replaces the index entries for the given events. Ids of events
+    that no longer exist are removed from the index.
+
+    """
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    event_ids = list(event_ids)
+    cursor = connection.cursor()
+    for start in range(0, len(event_ids), BATCH_SIZE):
+        batch = event_ids[start:start + BATCH_SIZE]
+        placeholders = ', '.join(['%s'] * len(batch))
+        if connection.vendor == 'sqlite':
+            cursor.execute("DELETE FROM %s WHERE rowid IN (%s)" % (SEARCH_TABLE, placeholders), batch)
+            cursor.execute("INSERT INTO %s (rowid, subject, body) SELECT id, subject, body FROM %s "
+                           "WHERE id IN (%s)" % (SEARCH_TABLE, EVENT_TABLE, placeholders), batch)
+        else:
+            cursor.execute("DELETE FROM %s WHERE event_id IN (%s)" % (SEARCH_TABLE, placeholders), batch)
+            cursor.execute("INSERT INTO %s (event_id, document) SELECT id, "
+                           "setweight(to_tsvector('english', subject), 'A') || "
+                           "setweight(to_tsvector('english', body), 'B') FROM %s "
+                           "WHERE id IN (%s)" % (SEARCH_TABLE, EVENT_TABLE, placeholders), batch)
+    # Raw queries don't mark a managed transaction as dirty by themselves.
+    transaction.commit_unless_managed()
+
+
+def search_events(query, queryset=None):
+    """ Returns a queryset of events matching all the words in `query`, best
+    matches first. Pass a filtered queryset to narrow the search further.
+
+    """
+    if queryset is None:
+        queryset = EventNotification.objects.all()
+    words = query.split()
+    if connection.vendor == 'sqlite':
+        # Quote every word so punctuation in the query can't be read as FTS5
+        # syntax. Quoted words are still stemmed, and all of them must match.
+        match = ' '.join('"%s"' % w.replace('"', '""') for w in words)
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=['%s.rowid = %s.id' % (SEARCH_TABLE, EVENT_TABLE),
+                   '%s MATCH %%s' % SEARCH_TABLE],
+            params=[match],
+            select={'rank': 'bm25(%s, 10.0, 1.0)' % SEARCH_TABLE},
+            order_by=['rank'])
+    elif connection.vendor == 'postgresql':
+        tsquery = "plainto_tsquery('english', %s)"
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=['%s.event_id = %s.id' % (SEARCH_TABLE, EVENT_TABLE),
+                   '%s.document @@ %s' % (SEARCH_TABLE, tsquery)],
+            params=[query],
+            select={'rank': 'ts_rank(%s.document, %s)' % (SEARCH_TABLE, tsquery)},
+            select_params=[query],
+            order_by=['-rank'])
+    for word in words:
+        queryset = queryset.filter(Q(subject__icontains=word) | Q(body__icontains=word))
+    return queryset.order_by('-event_time')
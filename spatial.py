@@ -0,0 +1,173 @@
+""" In-memory spatial index over reactor and facility locations.
+
+Points are bucketed into a grid of one-degree cells, so a radius search only
+computes distances for points in the handful of cells the circle overlaps,
+and a nearest-neighbor search works outwards through rings of cells around
+the starting point until nothing further out could be closer. Longitudes don't wrap
+around at 180 degrees, which doesn't matter for U.S. sites.
+
+There are only about a hundred reactors, so the index is built from the
+database in one query and kept in memory. It's rebuilt whenever the data
+version (see DataVersion) changes, which the loaders bump.
+
+"""
+
+import math
+import threading
+
+from us_reactors.models import Reactor, DataVersion
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * math.pi / 180
+
+
+def distance(lat1, lon1, lat2, lon2):
+    """ Great-circle distance in miles, using the haversine formula. """
+    lat1, lon1, lat2, lon2 = [math.radians(v) for v in (lat1, lon1, lat2, lon2)]
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex(object):
+    """ Grid of (latitude, longitude, item) points. """
+    CELL_DEGREES = 1.0
+
+    def __init__(self, points):
+        self.cells = {}
+        self.size = 0
+        for lat, lon, item in points:
+            self.cells.setdefault(self._cell(lat, lon), []).append((lat, lon, item))
+            self.size += 1
+
+    def within(self, lat, lon, miles):
+        """ Items within `miles` of a point, as (distance, item) tuples,
+        closest first.
+
+        """
+        lat_cells = int(math.ceil(miles / MILES_PER_DEGREE / self.CELL_DEGREES))
+        # Degrees of longitude shrink towards the poles, so the same distance
+        # covers more of them.
+        widest = min(abs(lat) + lat_cells * self.CELL_DEGREES, 89.0)
+        lon_miles = MILES_PER_DEGREE * math.cos(math.radians(widest))
+        lon_cells = int(math.ceil(miles / lon_miles / self.CELL_DEGREES))
+        row, col = self._cell(lat, lon)
+        # A big radius covers far more cells than are occupied, so go
+        # through the occupied ones instead of every cell in the box.
+        if (2 * lat_cells + 1) * (2 * lon_cells + 1) > len(self.cells):
+            cells = [points for (r, c), points in self.cells.iteritems()
+                     if abs(r - row) <= lat_cells and abs(c - col) <= lon_cells]
+        else:
+            cells = [self.cells.get((r, c), ())
+                     for r in xrange(row - lat_cells, row + lat_cells + 1)
+                     for c in xrange(col - lon_cells, col + lon_cells + 1)]
+        found = []
+        for points in cells:
+            for plat, plon, item in points:
+                d = distance(lat, lon, plat, plon)
+                if d <= miles:
+                    found.append((d, item))
+        found.sort(key=lambda f: f[0])
+        return found
+
+    def nearest(self, lat, lon, k):
+        """ The `k` items closest to a point, as (distance, item) tuples,
+        closest first.
+
+        """
+        if k < 1:
+            return []
+        row, col = self._cell(lat, lon)
+        # Group the occupied cells into square rings around the point. With
+        # so few points, most cells are empty, so it's quicker to go through
+        # the occupied ones than to walk outwards cell by cell.
+        rings = {}
+        for (r, c), points in self.cells.iteritems():
+            rings.setdefault(max(abs(r - row), abs(c - col)), []).extend(points)
+        found = []
+        for ring in sorted(rings):
+            # Anything in this ring or beyond is more than ring - 1 cells away
+            # in latitude or longitude, so at least this many miles.
+            if len(found) >= k and found[k - 1][0] <= self._bound(lat, ring - 1):
+                break
+            found.extend((distance(lat, lon, plat, plon), item) for plat, plon, item in rings[ring])
+            found.sort(key=lambda f: f[0])
+        return found[:k]
+
+    def _bound(self, lat, cells):
+        """ Smallest distance from a point at `lat` to anything more than
+        `cells` cells away in latitude or longitude. Longitude is the weaker
+        bound: sin(distance) >= cos(other latitude) * sin(longitude
+        difference), and anything past `widest` is further off in latitude.
+
+        """
+        widest = min(abs(lat) + (cells + 1) * self.CELL_DEGREES, 89.0)
+        spread = math.radians(min(cells * self.CELL_DEGREES, 90.0))
+        return EARTH_RADIUS_MILES * math.asin(math.cos(math.radians(widest)) * math.sin(spread))
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lat / self.CELL_DEGREES)),
+                int(math.floor(lon / self.CELL_DEGREES)))
+
+
+# Built indexes: (data version etag, reactor index, facility index).
+_indexes = None
+_indexes_lock = threading.Lock()
+
+
+def get_indexes(version=None):
+    """ Returns (reactor index, facility index) for the current data,
+    rebuilding them if the loaders have changed anything. Pass a DataVersion
+    row that's already been looked up to save a query.
+
+    """
+    global _indexes
+    if version is None:
+        version = DataVersion.current()
+    etag = version.etag if version else None
+    with _indexes_lock:
+        if _indexes is None or _indexes[0] != etag:
+            _indexes = (etag,) + build_indexes()
+        return _indexes[1:]
+
+
+def build_indexes():
+    """ Builds the reactor and facility indexes from the database. Facilities
+    are placed at the average location of their reactors.
+
+    """
+    reactors = []
+    sites = {}
+    for r in Reactor.objects.select_related('facility').only(
+            'unit', 'latitude', 'longitude', 'facility__name', 'facility__short_name'):
+        if r.latitude is None or r.longitude is None:
+            continue
+        reactors.append((r.latitude, r.longitude, {
+            'id': r.id,
+            'title': r.title,
+            'facility': r.facility_id,
+        }))
+        site = sites.setdefault(r.facility_id, [r.facility.name, []])
+        site[1].append((r.latitude, r.longitude))
+    facilities = []
+    for facility_id, (name, locations) in sites.items():
+        lat = sum(l[0] for l in locations) / len(locations)
+        lon = sum(l[1] for l in locations) / len(locations)
+        facilities.append((lat, lon, {'id': facility_id, 'name': name}))
+    return GridIndex(reactors), GridIndex(facilities)
+
+
+def reactors_near(lat, lon, miles=None, k=None, facilities=False, version=None):
+    """ Reactors (or facilities) within `miles` of a point, or the `k`
+    nearest. Returns a list of dicts with a 'distance' in miles, closest
+    first.
+
+    """
+    index = get_indexes(version)[1 if facilities else 0]
+    if miles is not None:
+        found = index.within(lat, lon, miles)
+        if k is not None:
+            found = found[:k]
+    else:
+        found = index.nearest(lat, lon, k)
+    return [dict(item, distance=round(d, 2)) for d, item in found]
@@ -0,0 +1,4 @@
+-- Run by syncdb after the table is created. For an existing database, run it
+-- by hand (see "manage.py sqlcustom us_reactors").
+CREATE INDEX us_reactors_eventnotification_facility_event_time
+    ON us_reactors_eventnotification (facility_id, event_time);
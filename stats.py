@@ -0,0 +1,114 @@
+""" Per-facility and per-reactor event stats.
+
+FacilityEventStats and ReactorEventStats hold running totals of events,
+scrams and retractions, plus the time of the latest event. load_events.py
+adjusts them by the difference each chunk of events makes rather than
+counting again, so reading them is a single row lookup.
+
+"""
+
+from django.db import transaction
+from django.db.models import Max
+
+from us_reactors.models import EventNotification, EventReactorStatus, \
+    FacilityEventStats, ReactorEventStats
+
+
+class EventStatsUpdate(object):
+    """ Collects changes to the per-facility and per-reactor event stats for
+    one chunk of events, then applies them with one query per facility or
+    reactor touched.
+
+    """
+    def __init__(self):
+        # Keyed by (stats model, facility or reactor id). Values are
+        # [events, scrams, retractions] deltas.
+        self.deltas = {}
+        self.latest = {}
+        # Keys whose last event time has to be looked up again, because the
+        # event that set it was changed.
+        self.stale = set()
+
+    def add(self, facility_id, statuses, retracted, event_time, sign=1):
+        """ Counts an event, or takes it back out if sign is -1. `statuses` is
+        a list of (reactor id, status dict) tuples.
+
+        """
+        scrams = [reactor_id for reactor_id, status in statuses
+                  if status['scram'] not in ('', 'N')]
+        keys = [(FacilityEventStats, facility_id, bool(scrams))]
+        keys.extend((ReactorEventStats, reactor_id, reactor_id in scrams)
+                    for reactor_id, status in statuses)
+        for model, key, scram in keys:
+            delta = self.deltas.setdefault((model, key), [0, 0, 0])
+            delta[0] += sign
+            delta[1] += sign * scram
+            delta[2] += sign * retracted
+            if sign > 0:
+                latest = self.latest.get((model, key))
+                if latest is None or event_time > latest:
+                    self.latest[(model, key)] = event_time
+            else:
+                self.stale.add((model, key))
+
+    def save(self):
+        for model, owner in ((FacilityEventStats, 'facility'), (ReactorEventStats, 'reactor')):
+            keys = [k for m, k in self.deltas if m is model]
+            if not keys:
+                continue
+            existing = dict((getattr(s, owner + '_id'), s) for s in
+                            model.objects.filter(**{owner + '__in': keys}))
+            new = []
+            for key in keys:
+                events, scrams, retractions = self.deltas[(model, key)]
+                latest = self.latest.get((model, key))
+                stats = existing.get(key)
+                if stats is None:
+                    new.append(model(events=events, scrams=scrams, retractions=retractions,
+                                     last_event_time=latest, **{owner + '_id': key}))
+                    continue
+                last = stats.last_event_time
+                if (model, key) in self.stale:
+                    last = last_event_time(model, key)
+                elif latest and (not last or latest > last):
+                    last = latest
+                if (events, scrams, retractions) == (0, 0, 0) and last == stats.last_event_time:
+                    continue
+                stats.last_event_time = last
+                stats.events += events
+                stats.scrams += scrams
+                stats.retractions += retractions
+                stats.save()
+            model.objects.bulk_create(new)
+
+
+def last_event_time(model, key):
+    """ Looks up the time of the newest event for a facility or reactor. """
+    if model is FacilityEventStats:
+        events = EventNotification.objects.filter(facility=key)
+    else:
+        events = EventNotification.objects.filter(reactors=key)
+    return events.aggregate(Max('event_time'))['event_time__max']
+
+
+def rebuild_stats(**kwargs):
+    """ Recounts the stats for every facility and reactor from scratch. Runs
+    after syncdb creates the stats tables; otherwise only needed if events
+    were changed by hand.
+
+    """
+    if kwargs.get('created_models') is not None and \
+            FacilityEventStats not in kwargs['created_models']:
+        return
+    with transaction.commit_on_success():
+        FacilityEventStats.objects.all().delete()
+        ReactorEventStats.objects.all().delete()
+        stats = EventStatsUpdate()
+        statuses = {}
+        for event_id, reactor_id, scram in EventReactorStatus.objects.values_list(
+                'event', 'reactor', 'scram'):
+            statuses.setdefault(event_id, []).append((reactor_id, {'scram': scram}))
+        for event_id, facility_id, retracted, event_time in EventNotification.objects.values_list(
+                'id', 'facility', 'retracted', 'event_time'):
+            stats.add(facility_id, statuses.get(event_id, []), retracted, event_time)
+        stats.save()
@@ -5,8 +5,47 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import os
+import glob
+import csv
+import json
+import time
+import pickle
+import random
+import gzip
+import shutil
+import urllib2
+import datetime
+import tempfile
+import threading
+import StringIO
+import BaseHTTPServer
+import SocketServer
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import TestCase
 
+from us_reactors.models import Facility, Reactor, EventNotification, EventReactorStatus, \
+    EventPerson, FacilityEventStats, ReactorEventStats, DataVersion
+from us_reactors import stats, spatial, analytics, aliases
+from us_reactors import admin as us_reactors_admin
+from us_reactors.scripts import fetcher, http_session, page_cache, instrument, records, \
+    events_scraper, event_writer, event_index, load_events, load_reactors, reactors_xml2csv, bench_times, \
+    bench_suite
+
+FIXTURE_PAGES = os.path.join(os.path.dirname(__file__), 'fixtures', 'pages')
+
+
+def fixture_page(name):
+    with open(os.path.join(FIXTURE_PAGES, name)) as f:
+        return f.read()
+
+
+def page_url(name):
+    return events_scraper.EVENT_DAY_URL_TMPL % (name[0:4], name.replace('en.html', ''))
+
 
 class SimpleTest(TestCase):
     def test_basic_addition(self):
@@ -14,3 +53,1118 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class FetchSchedulerTest(TestCase):
+    def test_results_in_input_order(self):
+        """
+        Pages that finish out of order are still yielded in input order.
+        """
+        def fetch(url):
+            time.sleep(random.random() / 100)
+            return url.upper()
+        urls = ['page%d' % i for i in range(20)]
+        scheduler = fetcher.FetchScheduler(fetch, workers=4)
+        self.assertEqual(list(scheduler.map(urls)),
+                         [(u, u.upper()) for u in urls])
+
+    def test_fetch_errors_are_reraised(self):
+        def fetch(url):
+            if url == 'bad':
+                raise IOError(url)
+            return url
+        scheduler = fetcher.FetchScheduler(fetch, workers=2)
+        results = scheduler.map(['good', 'bad', 'good'])
+        self.assertEqual(results.next(), ('good', 'good'))
+        self.assertRaises(IOError, results.next)
+
+    def test_throttle_limits_rate_per_host(self):
+        throttle = fetcher.HostThrottle(50)
+        start = time.time()
+        for i in range(6):
+            throttle.wait('http://a.example/%d' % i)
+        # The first request is free, the other five wait 1/50s each.
+        self.assertTrue(time.time() - start >= 0.09)
+        # A different host has its own bucket and doesn't wait.
+        start = time.time()
+        throttle.wait('http://b.example/')
+        self.assertTrue(time.time() - start < 0.01)
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves every path with the same page and an ETag, answering 304 when the
+    client already has it. Requests are recorded on the server.
+    """
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(self.server.page)))
+        self.end_headers()
+        self.wfile.write(self.server.page)
+
+    def log_message(self, *args):
+        pass
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.requests = []
+        self.server.page = '<html>' + 'event text ' * 1000 + '</html>'
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/2008/20080227en.html' % (self.server.server_address[1])
+        self.saved = (events_scraper.PAGE_CACHE_BASE,
+                      events_scraper.EVENT_PAGE_MAX_AGE,
+                      events_scraper.THROTTLE)
+        events_scraper.PAGE_CACHE_BASE = self.base
+        events_scraper.THROTTLE = fetcher.HostThrottle(None)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        (events_scraper.PAGE_CACHE_BASE,
+         events_scraper.EVENT_PAGE_MAX_AGE,
+         events_scraper.THROTTLE) = self.saved
+        shutil.rmtree(self.base)
+
+    def test_pages_are_stored_compressed(self):
+        cache = page_cache.PageCache(self.base)
+        cache.store(self.url, self.server.page)
+        entry = cache.lookup(self.url)
+        path = os.path.join(self.base, entry['hash'][0:2], entry['hash'] + '.gz')
+        self.assertTrue(os.path.getsize(path) < len(self.server.page) / 4)
+        self.assertEqual(cache.read(entry), self.server.page)
+        # The index survives reopening the cache.
+        cache.save()
+        self.assertEqual(page_cache.PageCache(self.base).lookup(self.url), entry)
+
+    def test_shared_blob_survives_concurrent_replace(self):
+        cache = page_cache.PageCache(self.base)
+        other = 'http://example.com/other.html'
+        cache.store(other, self.server.page)
+        class ReplaceFirst(object):
+            # Another thread replaces `other` just before store() takes the
+            # lock, after it's seen the blob already exists.
+            def __init__(self, lock):
+                self.lock = lock
+                self.pending = True
+            def __enter__(self):
+                if self.pending:
+                    self.pending = False
+                    cache.store(other, 'changed')
+                return self.lock.__enter__()
+            def __exit__(self, *exc_info):
+                return self.lock.__exit__(*exc_info)
+        cache.lock = ReplaceFirst(cache.lock)
+        cache.store(self.url, self.server.page)
+        self.assertEqual(cache.read(cache.lookup(self.url)), self.server.page)
+
+    def test_fresh_pages_skip_the_server(self):
+        events_scraper.EVENT_PAGE_MAX_AGE = None
+        self.assertEqual(events_scraper.fetch_page(self.url), self.server.page)
+        self.assertEqual(events_scraper.fetch_page(self.url), self.server.page)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_stale_pages_are_revalidated(self):
+        events_scraper.EVENT_PAGE_MAX_AGE = 0
+        events_scraper.fetch_page(self.url)
+        self.assertEqual(events_scraper.fetch_page(self.url), self.server.page)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1].get('if-none-match'), '"v1"')
+
+    def test_fetch_metrics(self):
+        events_scraper.EVENT_PAGE_MAX_AGE = None
+        metrics = instrument.enable()
+        try:
+            events_scraper.fetch_page(self.url)
+            events_scraper.fetch_page(self.url)
+        finally:
+            instrument.disable()
+        self.assertEqual(metrics.counters['requests'], 1)
+        self.assertEqual(metrics.counters['bytes_downloaded'], len(self.server.page))
+        self.assertEqual(metrics.cache_hit_ratio(), 0.5)
+        self.assertEqual(metrics.stages['fetch'][0], 1)
+        self.assertEqual(metrics.stages['cache_lookup'][0], 2)
+        self.assertEqual(metrics.pages[self.url]['counters']['cache_hits'], 1)
+
+
+class FlakyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on slow responses on purpose.
+        pass
+
+
+class FlakyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Keep-alive server that works through a script of (status, delay)
+    responses, then answers 200 straight away. Pages are gzipped when the
+    client asks. Each request's client port and headers are recorded.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.client_address[1], dict(self.headers)))
+            status, delay = self.server.script.pop(0) if self.server.script else (200, 0)
+        time.sleep(delay)
+        body = self.server.page if status == 200 else 'error'
+        self.send_response(status)
+        if status == 200 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=data, mode='wb') as f:
+                f.write(body)
+            body = data.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPSessionTest(TestCase):
+    def setUp(self):
+        self.server = FlakyServer(('127.0.0.1', 0), FlakyHandler)
+        self.server.requests = []
+        self.server.script = []
+        self.server.lock = threading.Lock()
+        self.server.page = '<html>' + 'event text ' * 1000 + '</html>'
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/2008/20080227en.html' % (self.server.server_address[1])
+        self.session = http_session.HTTPSession(timeout=0.2, retries=2, backoff=0.01)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused_and_gzipped(self):
+        first = self.session.get(self.url)
+        second = self.session.get(self.url)
+        self.assertEqual((first.status, first.body), (200, self.server.page))
+        self.assertEqual(second.body, self.server.page)
+        self.assertTrue(first.size < len(self.server.page) / 4)
+        ports = [port for port, headers in self.server.requests]
+        self.assertEqual(ports[0], ports[1])
+        self.assertEqual(self.server.requests[0][1]['accept-encoding'], 'gzip')
+
+    def test_server_errors_and_timeouts_are_retried(self):
+        self.server.script = [(503, 0), (200, 0.5)]
+        metrics = instrument.enable()
+        try:
+            response = self.session.get(self.url)
+        finally:
+            instrument.disable()
+        self.assertEqual(response.body, self.server.page)
+        self.assertEqual(response.attempts, 3)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(metrics.counters['retries'], 2)
+        self.assertEqual(metrics.stages['request'][0], 3)
+        # The attempt that timed out took at least the timeout.
+        self.assertTrue(metrics.stages['request'][2] >= 0.2)
+
+    def test_latency_is_recorded(self):
+        self.server.script = [(200, 0.1)]
+        self.assertTrue(self.session.get(self.url).latency >= 0.1)
+
+    def test_gives_up_after_last_retry(self):
+        self.server.script = [(500, 0)] * 3
+        try:
+            self.session.get(self.url)
+            self.fail("no error raised")
+        except urllib2.HTTPError as e:
+            self.assertEqual(e.code, 500)
+        self.assertEqual(len(self.server.requests), 3)
+        # Client errors aren't retried.
+        self.server.script = [(404, 0)]
+        self.assertRaises(urllib2.HTTPError, self.session.get, self.url)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_backoff_is_jittered_and_capped(self):
+        session = http_session.HTTPSession(backoff=1.0, max_backoff=5)
+        delays = [session.backoff_delay(2) for i in range(50)]
+        self.assertTrue(all(2.0 <= d <= 4.0 for d in delays))
+        self.assertTrue(len(set(delays)) > 1)
+        self.assertTrue(all(2.5 <= session.backoff_delay(10) <= 5 for i in range(50)))
+
+
+class ParseCachedTest(TestCase):
+    def setUp(self):
+        self.cache_base = tempfile.mkdtemp()
+        self.events_base = tempfile.mkdtemp() + '/'
+        self.saved = (events_scraper.PAGE_CACHE_BASE, events_scraper.PARSED_EVENTS_BASE)
+        events_scraper.PAGE_CACHE_BASE = self.cache_base
+        events_scraper.PARSED_EVENTS_BASE = self.events_base
+
+    def tearDown(self):
+        events_scraper.PAGE_CACHE_BASE, events_scraper.PARSED_EVENTS_BASE = self.saved
+        shutil.rmtree(self.cache_base)
+        shutil.rmtree(self.events_base)
+
+    def event_files(self):
+        return sorted(n for n in os.listdir(self.events_base) if n[0].isdigit())
+
+    def test_matches_serial_parse(self):
+        url = page_url('20080228en.html')
+        body = fixture_page('20080228en.html')
+        events_scraper.get_page_cache().store(url, body)
+        events_scraper.parse_cached([url, page_url('20080229en.html')], processes=2)
+        serial = events_scraper.parse_page(url, body)
+        self.assertEqual(self.event_files(),
+                         ['43989-20080228.json', '44003-20080228.json', '44004-20080228.json'])
+        for event in serial:
+            path = '%s%d-20080228.json' % (self.events_base, event.event_number)
+            with open(path) as f:
+                written = json.load(f)
+            frozen = json.loads(json.dumps(event, default=events_scraper.freeze_time))
+            del written['crawl_time'], frozen['crawl_time']
+            self.assertEqual(written, frozen)
+
+    def test_only_changed_pages_are_parsed(self):
+        url = page_url('20080228en.html')
+        body = fixture_page('20080228en.html')
+        cache = events_scraper.get_page_cache()
+        cache.store(url, body)
+        events_scraper.parse_cached([url], processes=1)
+        digest = cache.lookup(url)['hash']
+        manifest = events_scraper.open_manifest()
+        exists = events_scraper.open_writer().exists
+        self.assertTrue(manifest.is_current(url, digest, 'lxml', events_scraper.PARSER_VERSION, exists))
+        self.assertFalse(manifest.is_current(url, digest, 'lxml', events_scraper.PARSER_VERSION + 1, exists))
+        # Unchanged page is left alone.
+        path = self.events_base + '43989-20080228.json'
+        os.utime(path, (0, 0))
+        events_scraper.parse_cached([url], processes=1)
+        self.assertEqual(os.path.getmtime(path), 0)
+        # A page that no longer has an event loses that event's output.
+        cache.store(url, body.replace('name="en44004"', 'name="gone"'))
+        events_scraper.parse_cached([url], processes=1)
+        self.assertEqual(self.event_files(), ['43989-20080228.json', '44003-20080228.json'])
+        self.assertNotEqual(os.path.getmtime(path), 0)
+
+    def test_legacy_pages_are_saved_to_cache(self):
+        url = page_url('20080228en.html')
+        with open(os.path.join(self.cache_base, '20080228en.html'), 'wb') as f:
+            f.write(fixture_page('20080228en.html'))
+        events_scraper.parse_cached([url], processes=1)
+        self.assertNotEqual(page_cache.PageCache(self.cache_base).lookup(url), None)
+
+    def test_metrics_from_workers(self):
+        url = page_url('20080228en.html')
+        events_scraper.get_page_cache().store(url, fixture_page('20080228en.html'))
+        metrics = instrument.enable()
+        try:
+            events_scraper.parse_cached([url], processes=2)
+        finally:
+            instrument.disable()
+        summary = metrics.summary()
+        for stage in ('cache_lookup', 'tree_build', 'extract', 'process_event', 'write'):
+            self.assertTrue(stage in summary['pages'][url]['stages'], stage)
+        self.assertEqual(summary['stages']['process_event']['calls'], 3)
+        self.assertEqual(summary['counters']['events_written'], 3)
+        self.assertEqual(summary['cache_hit_ratio'], 1.0)
+        path = os.path.join(self.events_base, 'metrics.prom')
+        metrics.write_prometheus(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue('us_reactors_scraper_events_written_total 3.0' in lines)
+        # Events are written one at a time as they come out of the parser.
+        self.assertTrue('us_reactors_scraper_stage_calls_total{stage="write"} 3.0' in lines)
+
+    def test_events_are_written_as_parsed(self):
+        url = page_url('20080228en.html')
+        writer = events_scraper.open_writer()
+        written = []
+        def events():
+            for event in events_scraper.page_events(url, fixture_page('20080228en.html')):
+                # The previous event is already out by the time the next one
+                # is parsed.
+                written.append([writer.exists(name) for name in written_names])
+                written_names.append('%d-20080228' % (event.event_number))
+                yield event
+        written_names = []
+        count = events_scraper.record_page(events_scraper.open_manifest(), writer, url,
+                                           'digest', events())
+        self.assertEqual(count, 3)
+        self.assertEqual(written, [[], [True], [True, True]])
+        self.assertEqual(self.event_files(),
+                         ['43989-20080228.json', '44003-20080228.json', '44004-20080228.json'])
+
+    def test_existing_events_are_indexed(self):
+        # Events written before there was an event index, by a run whose
+        # pages haven't changed since.
+        url = page_url('20080228en.html')
+        earlier = page_url('20080227en.html')
+        body = fixture_page('20080228en.html')
+        cache = events_scraper.get_page_cache()
+        cache.store(url, body)
+        cache.store(earlier, body.replace('name="en44003"', 'name="gone"'))
+        manifest = events_scraper.open_manifest()
+        writer = events_scraper.open_writer()
+        for page in (earlier, url):
+            events_scraper.record_page(manifest, writer, page, cache.lookup(page)['hash'],
+                                       events_scraper.page_events(
+                                           page, events_scraper.cached_page(page)))
+        manifest.save()
+        self.assertFalse(os.path.exists(self.events_base + event_index.EventIndex.INDEX_NAME))
+
+        events_scraper.parse_cached([earlier, url], processes=1)
+        index = events_scraper.open_event_index(events_scraper.open_writer())
+        self.assertEqual(index.versions(43989), ['43989-20080227', '43989-20080228'])
+        self.assertEqual([e.event_number for e in load_events.read_events(self.events_base)],
+                         [43989, 44003, 44004])
+
+
+class HtmlEngineTest(TestCase):
+    def parse(self, engine):
+        events = events_scraper.parse_event_page_html(
+            page_url('20080228en.html'), fixture_page('20080228en.html'), engine)
+        for event in events:
+            del event.crawl_time
+        return events
+
+    def test_engines_find_identical_events(self):
+        fast = self.parse('lxml')
+        self.assertEqual([e.event_number for e in fast], [43989, 44003, 44004])
+        self.assertEqual(fast, self.parse('html5lib'))
+
+    def test_tree_is_freed_after_last_event(self):
+        trees = []
+        lxml_event_soup = events_scraper.lxml_event_soup
+        def capture(body):
+            trees.append(lxml_event_soup(body))
+            return trees[-1]
+        events_scraper.lxml_event_soup = capture
+        try:
+            events = events_scraper.page_events(page_url('20080228en.html'),
+                                                fixture_page('20080228en.html'))
+            self.assertEqual(events.next().event_number, 43989)
+            self.assertNotEqual(trees[0].contents, [])
+            self.assertEqual([e.event_number for e in events], [44003, 44004])
+        finally:
+            events_scraper.lxml_event_soup = lxml_event_soup
+        self.assertEqual(trees[0].contents, [])
+
+    def test_lxml_tree_passes_checks(self):
+        self.assertTrue(events_scraper.lxml_event_soup(fixture_page('20080228en.html')))
+
+    def test_misplaced_tables_fail_checks(self):
+        # Reactor status and text tables swallowed by the metadata table, as
+        # happens when lxml mishandles a <br>.
+        body = fixture_page('20080228en.html')
+        body = body.replace('</table>\n<br>\n<table', '<br>\n<table', 2)
+        self.assertEqual(events_scraper.lxml_event_soup(body), None)
+
+
+class FixturePageTest(TestCase):
+    """
+    Parses every page in the fixtures directory and compares the events with
+    the JSON file saved next to it.
+    """
+    def test_pages_match_saved_events(self):
+        pages = sorted(glob.glob(os.path.join(FIXTURE_PAGES, '*en.html')))
+        self.assertTrue(pages)
+        for path in pages:
+            name = os.path.basename(path)
+            events = events_scraper.parse_page(page_url(name), fixture_page(name))
+            for event in events:
+                del event.crawl_time
+            with open(path.replace('.html', '.json')) as f:
+                expected = json.load(f)
+            self.assertEqual(json.loads(json.dumps(events, default=events_scraper.freeze_time)),
+                             expected, name)
+
+    def test_text_quirks(self):
+        split = ['|' + 'a' * 40, 'b' * 37 + '|']
+        lines = ['.', '\x0C', '.+---', '|  |'] + split + [
+                 'NOT FOR PUBLIC DISTRIBUTION', '38521  38522', '+-']
+        cleaned = list(events_scraper._text_clean_lines(lines))
+        self.assertEqual(cleaned, ['', '', '', '+---', split[0] + ' ' + split[1],
+                                   '38521  38522', '', '+-'])
+
+
+class ConvertTimeTest(TestCase):
+    def test_matches_dateutil(self):
+        pages = [(page_url(os.path.basename(p)), fixture_page(os.path.basename(p)))
+                 for p in glob.glob(os.path.join(FIXTURE_PAGES, '*en.html'))]
+        timestamps = bench_times.collect_timestamps(pages)
+        self.assertTrue(len(timestamps) > 20)
+        # Odd inputs that should fall through to dateutil.
+        timestamps.update([('13/02/2008', '10:30 [CST]', True), ('02/27/2008', '1030 CST', True),
+                           ('02/27/2008', '10:30 [HST]', True), ('Feb 27, 2008', None, True),
+                           ('12/03/01', '[CST]', True), ('02/28/2008', '03:15 [MST]', False)])
+        self.assertEqual(bench_times.mismatches(timestamps), [])
+
+
+class BenchSuiteTest(TestCase):
+    def test_stages_cover_corpus(self):
+        pages = bench_suite.load_pages(sorted(glob.glob(os.path.join(FIXTURE_PAGES, '*en.html'))))
+        results = dict((stage, bench_suite.run_stage(stage, pages, repeat=1))
+                       for stage in bench_suite.STAGES)
+        self.assertEqual(results['text']['pages'] + results['html']['pages'], len(pages))
+        total = results['text']['events'] + results['html']['events']
+        self.assertEqual(results['process_event']['events'], total)
+        self.assertEqual(results['serialize']['events'], total)
+        self.assertEqual(bench_suite.compare(results, results), [])
+
+    def test_compare_flags_regressions(self):
+        base = {'html': {'pages_per_sec': 40.0, 'events_per_sec': 160.0, 'peak_kb': 8000}}
+        slower = {'html': {'pages_per_sec': 29.0, 'events_per_sec': 150.0, 'peak_kb': 9000}}
+        self.assertEqual(bench_suite.compare(slower, base, 0.25),
+                         ["html: pages_per_sec fell from 40.0 to 29.0"])
+        bigger = {'html': {'pages_per_sec': 40.0, 'events_per_sec': 160.0, 'peak_kb': 12000}}
+        self.assertEqual(bench_suite.compare(bigger, base, 0.25),
+                         ["html: peak_kb rose from 8000 to 12000"])
+
+
+class RecordsTest(TestCase):
+    def test_events_share_repeated_strings(self):
+        events = []
+        for name in ('20011203en.html', '20080228en.html'):
+            events.extend(events_scraper.parse_page(page_url(name), fixture_page(name)))
+        modes = [s.current_mode for e in events for s in e.reactor_status]
+        self.assertEqual(len(set(map(id, modes))), len(set(modes)))
+        self.assertEqual(type(events[-1].reactor_status[0].scram), unicode)
+        # Raw fields that process_event dropped aren't written out.
+        self.assertFalse(hasattr(events[0], 'region'))
+        self.assertFalse('region' in json.loads(json.dumps(events[0], default=events_scraper.freeze_time)))
+
+    def test_pickle_and_json_round_trip(self):
+        event = events_scraper.parse_page(page_url('20080228en.html'),
+                                          fixture_page('20080228en.html'))[0]
+        self.assertEqual(pickle.loads(pickle.dumps(event, pickle.HIGHEST_PROTOCOL)), event)
+        self.assertEqual(pickle.loads(pickle.dumps(event)), event)
+        frozen = json.loads(json.dumps(event, default=events_scraper.freeze_time))
+        loaded = records.Event.from_dict(frozen)
+        self.assertEqual(loaded.people[0].organization, 'R2DO')
+        self.assertEqual(json.loads(json.dumps(loaded, default=events_scraper.freeze_time)), frozen)
+
+
+class ShardWriterTest(TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def events(self, *numbers):
+        return [records.Event(event_number=n, subject='EVENT %d' % n) for n in numbers]
+
+    def writer(self, **kwargs):
+        return event_writer.ShardWriter(self.base, events_scraper.freeze_time, **kwargs)
+
+    def test_events_can_be_read_back_by_name(self):
+        writer = self.writer()
+        self.assertEqual(writer.write(20080228, self.events(1, 2)), ['1-20080228', '2-20080228'])
+        writer.write(20090301, self.events(3))
+        writer.close()
+        self.assertEqual(sorted(f for f in os.listdir(self.base) if f.endswith('.jsonl')),
+                         ['events-2008-0000.jsonl', 'events-2009-0000.jsonl'])
+        # Reopening picks up the saved index.
+        writer = self.writer()
+        self.assertEqual(writer.read('2-20080228'), self.events(2)[0].to_dict())
+        self.assertEqual(writer.read('3-20090301'), self.events(3)[0].to_dict())
+
+    def test_shards_roll_over_at_max_bytes(self):
+        writer = self.writer(max_bytes=80)
+        writer.write(20080228, self.events(1, 2, 3))
+        writer.close()
+        self.assertEqual(sorted(f for f in os.listdir(self.base) if f.endswith('.jsonl')),
+                         ['events-2008-0000.jsonl', 'events-2008-0001.jsonl'])
+        self.assertEqual(writer.read('3-20080228'), self.events(3)[0].to_dict())
+
+    def test_compact_drops_replaced_lines(self):
+        writer = self.writer()
+        writer.write(20080228, self.events(1, 2))
+        writer.write(20080228, self.events(2))
+        writer.remove('1-20080228')
+        writer.compact()
+        with open(os.path.join(self.base, 'events-2008-0000.jsonl')) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        self.assertFalse(writer.exists('1-20080228'))
+        self.assertEqual(writer.read('2-20080228'), self.events(2)[0].to_dict())
+
+    def test_compact_keeps_event_index(self):
+        writer = self.writer()
+        index = event_index.EventIndex(self.base, events_scraper.freeze_time)
+        for event in self.events(1, 2):
+            for name in writer.write(20080228, [event]):
+                index.add(name, event)
+        writer.remove('1-20080228')
+        index.close()
+        writer.compact()
+        self.assertTrue(os.path.exists(os.path.join(self.base, event_index.EventIndex.RECORDS_NAME)))
+        self.assertEqual([e.subject for e in load_events.read_events(self.base)],
+                         ['EVENT 1', 'EVENT 2'])
+
+
+class EventIndexTest(TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        # 43989 with both of its updates, and the version from the day
+        # before, which only had the original report.
+        self.event = fixture_events('20080228en.json')[0]
+        self.earlier = self.copy(self.event)
+        self.earlier.url = page_url('20080227en.html')
+        self.earlier.updates = self.event.updates[:1]
+        self.earlier.subject = 'AUTOMATIC SCRAM'
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def index(self):
+        return event_index.EventIndex(self.base, events_scraper.freeze_time)
+
+    def copy(self, event):
+        return records.Event.from_dict(json.loads(json.dumps(event, default=events_scraper.freeze_time)))
+
+    def test_versions_merge_into_latest(self):
+        index = self.index()
+        # Pages can be parsed out of order; the newest page still wins.
+        self.assertEqual(index.add('43989-20080228', self.event), 'new')
+        self.assertEqual(index.add('43989-20080227', self.earlier), 'unchanged')
+        self.assertEqual(index.add('43989-20080228', self.event), 'seen')
+        index.close()
+        index = self.index()
+        self.assertEqual(index.versions(43989), ['43989-20080227', '43989-20080228'])
+        self.assertEqual(index.latest(43989), self.event)
+        self.assertEqual(index.latest(1), None)
+
+        # A retraction on a later page that drops the old updates from its
+        # text still keeps them in the canonical record.
+        retraction = self.copy(self.event)
+        retraction.url = page_url('20080305en.html')
+        retraction.retracted = True
+        retraction.updates = [records.Update('2008-03-05T15:00:00+00:00',
+                                             'RETRACTION AT 1000 EST ON 03/05/2008', ['Retracted.'])]
+        self.assertEqual(index.add('43989-20080305', retraction), 'updated')
+        latest = index.latest(43989)
+        self.assertTrue(latest.retracted)
+        self.assertEqual(latest.url, retraction.url)
+        self.assertEqual([u.time for u in latest.updates], [
+            '2008-02-27T16:30:00+00:00', '2008-02-28T19:20:00+00:00', '2008-03-05T15:00:00+00:00'])
+
+        index.remove('43989-20080305')
+        self.assertEqual(index.versions(43989), ['43989-20080227', '43989-20080228'])
+        index.compact()
+        with open(os.path.join(self.base, event_index.EventIndex.RECORDS_NAME)) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        self.assertEqual(index.latest(43989), latest)
+
+    def test_scraper_and_loader_use_index(self):
+        saved = events_scraper.PARSED_EVENTS_BASE
+        events_scraper.PARSED_EVENTS_BASE = self.base + '/'
+        try:
+            url = page_url('20080228en.html')
+            for i in range(2):
+                writer = events_scraper.open_writer()
+                index = events_scraper.open_event_index(writer)
+                events_scraper.record_page(events_scraper.open_manifest(), writer,
+                                           url, 'digest', events_scraper.page_events(
+                                               url, fixture_page('20080228en.html')), index)
+                index.close()
+        finally:
+            events_scraper.PARSED_EVENTS_BASE = saved
+        # The second run saw the same events again and left them alone.
+        with open(os.path.join(self.base, event_index.EventIndex.RECORDS_NAME)) as f:
+            self.assertEqual(len(f.readlines()), 3)
+        events = list(load_events.read_events(self.base))
+        self.assertEqual([e.event_number for e in events], [43989, 44003, 44004])
+        self.assertEqual(events[0].updates, self.event.updates)
+
+
+def create_reactors(sites):
+    """ Creates a Facility for each (short name, units) pair, with a
+    Reactor for every unit.
+
+    """
+    day = datetime.date(1970, 1, 1)
+    for name, units in sites:
+        facility = Facility.objects.create(
+            name=name.title(), short_name=name, city='', state='AZ', region=4, operator='')
+        for unit in units:
+            Reactor.objects.create(
+                facility=facility, unit=unit, nrc_id=Reactor.objects.count() + 1,
+                nrc_url='http://www.nrc.gov/', nrc_photo='http://www.nrc.gov/',
+                type='PWR', containment='DRYAMB', vendor='CE', model='CE80-2L',
+                engineer='BECH', constructor='BECH', permit_issued_on=day,
+                license_issued_on=day, operational_on=day, license_expires_on=day,
+                capacity=1000, thermal_capacity=3000)
+
+
+def fixture_events(name):
+    """ Saved events for a fixture page, with a crawl time added back. """
+    with open(os.path.join(FIXTURE_PAGES, name)) as f:
+        events = [records.Event.from_dict(e) for e in json.load(f)]
+    for event in events:
+        event.crawl_time = '2008-02-29T00:00:00+00:00'
+    return events
+
+
+class LoadEventsTest(TestCase):
+    def setUp(self):
+        create_reactors([('BROWNS FERRY', [1, 2, 3]), ('PALO VERDE', [1, 2, 3])])
+        self.events = fixture_events('20080228en.json')
+
+    def test_load_is_idempotent(self):
+        counts = load_events.EventLoader().load(self.events)
+        self.assertEqual(counts, {'inserted': 2, 'updated': 0, 'unchanged': 0, 'skipped': 1})
+        event = EventNotification.objects.get(event_num=44003)
+        self.assertEqual([r.unit for r in event.reactors.order_by('unit')], [1, 2, 3])
+        self.assertEqual(EventNotification.objects.get(event_num=43989).cfr_sections.count(), 2)
+        people = EventPerson.objects.count()
+
+        self.events[0].subject = 'UPDATED'
+        counts = load_events.EventLoader().load(self.events)
+        self.assertEqual(counts, {'inserted': 0, 'updated': 1, 'unchanged': 1, 'skipped': 1})
+        self.assertEqual(EventNotification.objects.get(event_num=43989).subject, 'UPDATED')
+        self.assertEqual(EventReactorStatus.objects.count(), 4)
+        self.assertEqual(EventPerson.objects.count(), people)
+
+    def test_reactor_status_change_is_loaded(self):
+        load_events.EventLoader().load(self.events)
+        event = [e for e in self.events if e.event_number == 44003][0]
+        event.reactor_status[0].current_power = 0
+        event.reactor_status[0].scram = 'A/R'
+        counts = load_events.EventLoader().load(self.events)
+        self.assertEqual(counts, {'inserted': 0, 'updated': 1, 'unchanged': 1, 'skipped': 1})
+        status = EventReactorStatus.objects.get(event__event_num=44003,
+                                                reactor__unit=event.reactor_status[0].unit)
+        self.assertEqual((status.current_power, status.scram), (0, 'A/R'))
+        self.assertEqual((status.reactor.event_stats.events, status.reactor.event_stats.scrams),
+                         (1, 1))
+
+    def test_unchanged_chunk_only_reads(self):
+        load_events.EventLoader().load(self.events)
+        loader = load_events.EventLoader()
+        # The events, then their reactor statuses, CFR sections and people.
+        with self.assertNumQueries(4):
+            loader.load(self.events)
+
+
+class AliasIndexTest(TestCase):
+    def setUp(self):
+        create_reactors([('INDIAN POINT', [2, 3]), ('DAVIS-BESSE', [1]), ('V.C. SUMMER', [1]),
+                         ('JOSEPH M. FARLEY', [1, 2]), ('MILLSTONE EAST', [2, 3]),
+                         ('MILLSTONE WEST', [1]), ('PALO VERDE', [1, 2, 3])])
+        for short_name, name in [('INDIAN POINT', 'Indian Point Energy Center'),
+                                 ('V.C. SUMMER', 'Virgil C. Summer Nuclear Station'),
+                                 ('MILLSTONE EAST', 'Millstone Power Station'),
+                                 ('MILLSTONE WEST', 'Millstone Nuclear Plant')]:
+            Facility.objects.filter(short_name=short_name).update(name=name)
+
+    def facility(self, short_name):
+        return Facility.objects.get(short_name=short_name).id
+
+    def test_names_resolve(self):
+        with self.assertNumQueries(2):
+            index = aliases.AliasIndex({
+                'FARLEY': 'Joseph M. Farley',
+                'SUMMER STATION': 'Virgil C. Summer',
+                'HATCH': 'Edwin I. Hatch',
+                'MILLSTONE POINT': 'Millstone',
+            })
+        self.assertEqual(index.facility('INDIAN POINT'), self.facility('INDIAN POINT'))
+        self.assertEqual(index.facility('Indian Point Energy Center'), self.facility('INDIAN POINT'))
+        self.assertEqual(index.facility('DAVIS BESSE'), self.facility('DAVIS-BESSE'))
+        self.assertEqual(index.facility('SUMMER'), self.facility('V.C. SUMMER'))
+        # Curated aliases, matched against the names as typed or without
+        # generic words.
+        self.assertEqual(index.facility('FARLEY'), self.facility('JOSEPH M. FARLEY'))
+        self.assertEqual(index.facility('SUMMER STATION'), self.facility('V.C. SUMMER'))
+        # A shared name is settled by the units involved.
+        self.assertEqual(index.facility('MILLSTONE', [3]), self.facility('MILLSTONE EAST'))
+        self.assertEqual(index.facility('MILLSTONE', [1]), self.facility('MILLSTONE WEST'))
+        self.assertEqual(index.facility('MILLSTONE'), None)
+        self.assertEqual(index.resolve('PALO VERDE', 2), Reactor.objects.get(
+            facility=self.facility('PALO VERDE'), unit=2).id)
+        # Single-reactor sites match whatever unit the event gives.
+        self.assertEqual(index.resolve('DAVIS BESSE', 0), Reactor.objects.get(
+            facility=self.facility('DAVIS-BESSE')).id)
+        self.assertEqual(index.resolve('PALO VERDE', 4), None)
+        self.assertEqual(index.facility('MILLSTONE'), None)
+        self.assertEqual(index.facility('HOPE CREEK'), None)
+        self.assertEqual(index.report(), [
+            "Aliases that don't match a single facility:",
+            "  HATCH -> Edwin I. Hatch",
+            "  MILLSTONE POINT -> Millstone",
+            "Unresolved facilities:",
+            "  HOPE CREEK (1 events)",
+            "  MILLSTONE (2 events)",
+            "Unresolved units:",
+            "  PALO VERDE unit 4",
+        ])
+
+    def test_loader_uses_aliases(self):
+        Facility.objects.filter(short_name='PALO VERDE').update(
+            name='Palo Verde Nuclear Generating Station', short_name='Palo Verde')
+        loader = load_events.EventLoader()
+        counts = loader.load(fixture_events('20080228en.json'))
+        # Browns Ferry isn't in this set of facilities.
+        self.assertEqual(counts['skipped'], 1)
+        self.assertEqual(loader.aliases.unresolved, {'BROWNS FERRY': 1})
+        self.assertEqual(EventNotification.objects.get(event_num=44004).facility_id,
+                         self.facility('INDIAN POINT'))
+        event = EventNotification.objects.get(event_num=44003)
+        self.assertEqual(event.facility_id, self.facility('Palo Verde'))
+        self.assertEqual([r.unit for r in event.reactors.order_by('unit')], [1, 2, 3])
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        create_reactors([('BROWNS FERRY', [1, 2, 3]), ('PALO VERDE', [1, 2, 3]),
+                         ('INDIAN POINT', [2, 3]), ('COOPER', [1]), ('FERMI', [2]),
+                         ('DRESDEN', [2, 3])])
+        for name in ['20011203en.json', '20030122en.json', '20080228en.json']:
+            load_events.EventLoader().load(fixture_events(name))
+
+    def search(self, **params):
+        response = self.client.get(reverse('search_events'), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_ranked_results(self):
+        results = self.search(q='turbine trip')['results']
+        self.assertEqual(results[0]['event_num'], 43989)
+        self.assertTrue(self.search(q='sirens')['total'] > 0)
+        # Stemming and stray punctuation in the query.
+        self.assertEqual(self.search(q='"turbine" trips-')['results'][0]['event_num'], 43989)
+
+    def test_index_follows_updates(self):
+        events = fixture_events('20080228en.json')
+        events[0].subject = 'ZEBRA MUSSELS IN INTAKE'
+        load_events.EventLoader().load(events)
+        self.assertEqual([r['event_num'] for r in self.search(q='zebra')['results']], [43989])
+
+    def test_filters_and_pages(self):
+        everything = self.search(q='licensee', per_page=2)
+        self.assertTrue(everything['total'] > 2)
+        self.assertEqual(len(everything['results']), 2)
+        facility = Facility.objects.get(short_name='PALO VERDE')
+        for result in self.search(q='licensee', facility=facility.id)['results']:
+            self.assertEqual(result['facility__name'], 'Palo Verde')
+        in_2008 = self.search(q='licensee', start='2008-01-01', end='2008-12-31')
+        self.assertTrue(0 < in_2008['total'] < everything['total'])
+        response = self.client.get(reverse('search_events'), {'q': 'x', 'start': 'soon'})
+        self.assertEqual(response.status_code, 400)
+
+
+class LoadReactorsTest(TestCase):
+    def record(self, docket, unit):
+        return {
+            'docket': str(docket),
+            'Plant Name, Unit Number': 'Palo Verde Nuclear Generating Station, Unit %d' % unit,
+            'NRC Reactor Unit Web Page': 'Palo Verde %d' % unit,
+            'nrc_url': 'http://www.nrc.gov/info-finder/reactor/palo%d.html' % unit,
+            'nrc_photo': 'http://www.nrc.gov/images/palo%d.jpg' % unit,
+            'Reactor and Containment Type': 'PWR-DRYAMB',
+            'Nuclear Steam System Supplier and Design Type': 'COMB CE80-2L',
+            'Architect-Engineer': 'BECH',
+            'Contructor': 'BECH',
+            'Construction Permit Issued': '05/25/1976',
+            'Operating License Issued': '06/01/1985',
+            'Commercial Operation': '01/28/86',
+            'Renewed Operating License Issued': '',
+            'Operating License Expires': '06/01/2045',
+            'capacity': '1311',
+            'Licensed MWt': '3990',
+            'latitude': '33.38',
+            'longitude': '-112.86',
+            'Location': 'Wintersburg, AZ (50 miles W of Phoenix)',
+            'NRC Region': '4',
+            'Licensee': 'Arizona Public Service Company',
+        }
+
+    def test_reload_is_idempotent(self):
+        records = [self.record(5000528, 1), self.record(5000529, 2)]
+        counts = load_reactors.load_reactors(records)
+        self.assertEqual(counts, {'facilities': 1, 'inserted': 2, 'updated': 0, 'unchanged': 0})
+        reactor = Reactor.objects.get(nrc_id=5000529)
+        self.assertEqual((reactor.unit, reactor.vendor, reactor.model), (2, 'CE', 'CE80-2L'))
+        self.assertEqual(reactor.facility.state, 'AZ')
+
+        records[1]['capacity'] = '1314'
+        records.append(self.record(5000530, 3))
+        # Lookups, one update, the insert and the data version bump.
+        with self.assertNumQueries(5):
+            counts = load_reactors.load_reactors(records)
+        self.assertEqual(counts, {'facilities': 0, 'inserted': 1, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(Reactor.objects.get(nrc_id=5000529).capacity, 1314)
+        self.assertEqual(Facility.objects.count(), 1)
+
+    def test_join_reactor_sources(self):
+        base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base)
+        xml_path = os.path.join(base, 'operatingreactors.xml')
+        with open(xml_path, 'w') as f:
+            f.write('<markers>')
+            for docket, unit in [(5000528, 1), (5000529, 2)]:
+                f.write('<facility id="0%d"><latitude>33.38</latitude><longitude>-112.86</longitude>'
+                        '<url>/palo%d.html</url><photourl>/palo%d.jpg</photourl>'
+                        '<output>1311 MWe</output></facility>' % (docket, unit, unit))
+            f.write('</markers>')
+        excel = dict((k, v) for k, v in self.record(5000529, 2).items()
+                     if k not in reactors_xml2csv.HEADER_FIELDS)
+        # Header names as they come out of the Excel export.
+        excel['Docket  Number'] = '05000529'
+        excel['Licensee '] = excel.pop('Licensee')
+        csv_path = os.path.join(base, 'operating-reactors.csv')
+        with open(csv_path, 'wb') as f:
+            writer = csv.DictWriter(f, sorted(excel))
+            writer.writerow(dict((k, k) for k in excel))
+            # The second row has no match in the XML.
+            writer.writerows([excel, dict(excel, **{'Docket  Number': '05000999'})])
+        with open(csv_path, 'rb') as f:
+            records = list(load_reactors.join_reactor_sources(f, xml_path))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['Licensee'], 'Arizona Public Service Company')
+        self.assertEqual(records[0]['nrc_url'], 'http://www.nrc.gov/palo2.html')
+        load_reactors.load_reactors(records)
+        self.assertEqual(Reactor.objects.get().capacity, 1311)
+
+
+class EventStatsTest(TestCase):
+    def setUp(self):
+        create_reactors([('BROWNS FERRY', [1, 2, 3]), ('PALO VERDE', [1, 2, 3])])
+
+    def snapshot(self):
+        return (sorted(FacilityEventStats.objects.values_list(
+                    'facility__short_name', 'events', 'scrams', 'retractions', 'last_event_time')),
+                sorted(ReactorEventStats.objects.values_list(
+                    'reactor__nrc_id', 'events', 'scrams', 'retractions', 'last_event_time')))
+
+    def test_loader_keeps_stats_current(self):
+        events = fixture_events('20080228en.json')
+        load_events.EventLoader().load(events)
+        browns_ferry = Facility.objects.get(short_name='BROWNS FERRY').event_stats
+        self.assertEqual((browns_ferry.events, browns_ferry.scrams, browns_ferry.retractions),
+                         (1, 1, 0))
+        self.assertEqual(Reactor.objects.get(facility__short_name='PALO VERDE', unit=3)
+                         .event_stats.events, 1)
+
+        # Retract the scram and move it a day earlier.
+        events[0].retracted = True
+        events[0].event_time = '2008-02-26T16:30:00+00:00'
+        events[0].reactor_status[0].scram = 'N'
+        load_events.EventLoader().load(events)
+        browns_ferry = FacilityEventStats.objects.get(pk=browns_ferry.pk)
+        self.assertEqual((browns_ferry.events, browns_ferry.scrams, browns_ferry.retractions),
+                         (1, 0, 1))
+        self.assertEqual(browns_ferry.last_event_time.day, 26)
+
+        incremental = self.snapshot()
+        stats.rebuild_stats()
+        self.assertEqual(self.snapshot(), incremental)
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        create_reactors([('BROWNS FERRY', [1, 2, 3]), ('PALO VERDE', [1, 2, 3]),
+                         ('INDIAN POINT', [2, 3]), ('COOPER', [1]), ('FERMI', [2]),
+                         ('DRESDEN', [2, 3])])
+        for name in ['20011203en.json', '20030122en.json', '20080228en.json']:
+            load_events.EventLoader().load(fixture_events(name))
+
+    def get(self, name, queries, params=None, **kwargs):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse(name, kwargs=kwargs), params or {})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_lists(self):
+        # Each view also looks up the data version.
+        facilities = self.get('facility_list', 3)['facilities']
+        self.assertEqual([len(f['reactors']) for f in facilities], [3, 1, 2, 1, 2, 3])
+        reactors = self.get('reactor_list', 2)['reactors']
+        self.assertEqual(reactors[0]['short_title'], 'BROWNS FERRY 1')
+
+    def test_event_pages_follow_cursor(self):
+        everything = self.get('event_list', 2, {'limit': 100})['events']
+        self.assertEqual(len(everything), EventNotification.objects.count())
+        seen = []
+        params = {'limit': 3}
+        while True:
+            page = self.get('event_list', 2, params)
+            seen.extend(page['events'])
+            if not page['next']:
+                break
+            params['before'] = page['next']
+        self.assertEqual(seen, everything)
+        times = [e['event_time'] for e in seen]
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_event_detail(self):
+        event = self.get('event_detail', 5, event_num=44003)
+        self.assertEqual([r['title'] for r in event['reactors']],
+                         ['Palo Verde, Unit 1', 'Palo Verde, Unit 2', 'Palo Verde, Unit 3'])
+        self.assertTrue(event['cfr_sections'])
+        response = self.client.get(reverse('event_detail', kwargs={'event_num': 1}))
+        self.assertEqual(response.status_code, 404)
+
+
+class EventAdminTest(TestCase):
+    def setUp(self):
+        create_reactors([('BROWNS FERRY', [1, 2, 3]), ('PALO VERDE', [1, 2, 3])])
+        load_events.EventLoader().load(fixture_events('20080228en.json'))
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def test_changelist_and_inline(self):
+        response = self.client.get(reverse('admin:us_reactors_eventnotification_changelist'))
+        self.assertContains(response, 'AUTOMATIC REACTOR SCRAM')
+        event = EventNotification.objects.get(event_num=44003)
+        response = self.client.get(reverse('admin:us_reactors_eventnotification_change',
+                                           args=[event.id]))
+        self.assertContains(response, 'Event 44003 at PALO VERDE 3')
+
+    def test_estimated_count(self):
+        class AlwaysEstimate(us_reactors_admin.EstimatedCountPaginator):
+            EXACT_BELOW = 0
+        EventNotification.objects.order_by('id')[0].delete()
+        events = EventNotification.objects.all()
+        # The highest id is still 2 after deleting the first event.
+        self.assertEqual(AlwaysEstimate(events, 10).count, 2)
+        self.assertEqual(us_reactors_admin.EstimatedCountPaginator(events, 10).count, 1)
+        self.assertEqual(AlwaysEstimate(events.filter(retracted=False), 10).count, 1)
+
+    def test_filtered_changelist_estimates_total(self):
+        url = reverse('admin:us_reactors_eventnotification_changelist')
+        saved = us_reactors_admin.EstimatedCountPaginator.EXACT_BELOW
+        us_reactors_admin.EstimatedCountPaginator.EXACT_BELOW = 0
+        connection.use_debug_cursor = True
+        try:
+            del connection.queries[:]
+            response = self.client.get(url, {'q': '44003'})
+            queries = [q['sql'] for q in connection.queries]
+        finally:
+            connection.use_debug_cursor = None
+            us_reactors_admin.EstimatedCountPaginator.EXACT_BELOW = saved
+        self.assertEqual(response.context['cl'].full_result_count, 2)
+        self.assertContains(response, '2 total')
+        counts = [q for q in queries if 'COUNT(*)' in q and 'us_reactors_eventnotification' in q]
+        # Only the filtered count; the total comes from the estimate.
+        self.assertEqual(len(counts), 1)
+        self.assertTrue('WHERE' in counts[0])
+
+
+class VersionedViewTest(TestCase):
+    def setUp(self):
+        create_reactors([('BROWNS FERRY', [1, 2, 3]), ('PALO VERDE', [1, 2, 3])])
+        self.events = fixture_events('20080228en.json')
+        load_events.EventLoader().load(self.events)
+        self.url = reverse('event_detail', kwargs={'event_num': 43989})
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(response['Last-Modified'])
+        # Only the version row is read for a 304, and for a cached response.
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(json.loads(response.content)['subject'], self.events[0].subject)
+
+    def test_loading_invalidates(self):
+        etag = self.client.get(self.url)['ETag']
+        self.events[0].subject = 'UPDATED'
+        load_events.EventLoader().load(self.events)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content)['subject'], 'UPDATED')
+
+
+class SpatialTest(TestCase):
+    def test_grid_matches_brute_force(self):
+        rand = random.Random(17)
+        points = [(rand.uniform(25, 49), rand.uniform(-125, -67), i) for i in range(300)]
+        index = spatial.GridIndex(points)
+        for trial in range(50):
+            lat, lon = rand.uniform(20, 55), rand.uniform(-130, -60)
+            by_distance = sorted((spatial.distance(lat, lon, p[0], p[1]), p[2]) for p in points)
+            self.assertEqual([f[1] for f in index.nearest(lat, lon, 7)],
+                             [f[1] for f in by_distance[:7]])
+            self.assertEqual([f[1] for f in index.within(lat, lon, 150)],
+                             [f[1] for f in by_distance if f[0] <= 150])
+        # A radius covering the whole country only looks at occupied cells.
+        start = time.time()
+        self.assertEqual(len(index.within(80, -100, 12000)), len(points))
+        self.assertTrue(time.time() - start < 1)
+
+    def test_view_and_rebuild(self):
+        create_reactors([('PALO VERDE', [1, 2, 3]), ('COOPER', [1])])
+        Reactor.objects.filter(facility__short_name='PALO VERDE').update(latitude=33.39, longitude=-112.86)
+        Reactor.objects.filter(facility__short_name='COOPER').update(latitude=40.36, longitude=-95.64)
+        DataVersion.bump()
+        # Phoenix is about 50 miles from Palo Verde.
+        url = reverse('reactors_near')
+        response = json.loads(self.client.get(url, {'lat': 33.45, 'lon': -112.07, 'miles': 60}).content)
+        self.assertEqual([r['title'] for r in response['reactors']],
+                         ['Palo Verde, Unit 1', 'Palo Verde, Unit 2', 'Palo Verde, Unit 3'])
+        response = json.loads(self.client.get(
+            url, {'lat': 33.45, 'lon': -112.07, 'k': 2, 'type': 'facilities'}).content)
+        self.assertEqual([f['name'] for f in response['facilities']], ['Palo Verde', 'Cooper'])
+        self.assertEqual(self.client.get(url, {'lat': 'north', 'lon': 0}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'lat': 89, 'lon': 0, 'miles': 100000}).status_code, 400)
+
+        # Loading bumps the data version, which rebuilds the index.
+        Reactor.objects.filter(facility__short_name='COOPER').update(latitude=33.5, longitude=-112.1)
+        DataVersion.bump()
+        nearest = spatial.reactors_near(33.45, -112.07, k=1)
+        self.assertEqual(nearest[0]['title'], 'Cooper, Unit 1')
+
+
+class AnalyticsTest(TestCase):
+    def setUp(self):
+        create_reactors([('BROWNS FERRY', [1, 2, 3]), ('PALO VERDE', [1, 2, 3]),
+                         ('INDIAN POINT', [2, 3]), ('COOPER', [1]), ('FERMI', [2]),
+                         ('DRESDEN', [2, 3])])
+        Reactor.objects.filter(facility__short_name__in=['BROWNS FERRY', 'COOPER']).update(
+            vendor='GE', operational_on=datetime.date(2002, 1, 1))
+        for name in ['20011203en.json', '20030122en.json', '20080228en.json']:
+            load_events.EventLoader().load(fixture_events(name))
+
+    def test_scram_rates_match_loop(self):
+        statuses = EventReactorStatus.objects.filter(event__retracted=False).select_related(
+            'event', 'reactor')
+        times = [s.event.event_time for s in statuses]
+        start, end = min(times), max(times)
+        expected = {}
+        for reactor in Reactor.objects.all():
+            began = max(start, datetime.datetime.combine(reactor.operational_on, datetime.time())
+                        .replace(tzinfo=start.tzinfo))
+            years = max((end - began).total_seconds(), 0) / analytics.SECONDS_PER_YEAR
+            group = expected.setdefault(reactor.vendor, [0, 0.0])
+            group[1] += years
+        for s in statuses:
+            if s.scram not in ('', 'N'):
+                expected[s.reactor.vendor][0] += 1
+        rates = analytics.scram_rates(by='vendor')
+        self.assertEqual(sorted((r['vendor'], r['scrams'], r['reactor_years']) for r in rates),
+                         sorted((v, e[0], round(e[1], 2)) for v, e in expected.items()))
+
+    def test_power_drops_and_caching(self):
+        drops = analytics.power_drops(50)
+        self.assertIn(43989, [d['event_num'] for d in drops])
+        self.assertTrue(all(d['drop'] > 50 for d in drops))
+        with self.assertNumQueries(1):
+            self.assertEqual(analytics.power_drops(50), drops)
+        EventNotification.objects.filter(event_num=43989).update(retracted=True)
+        DataVersion.bump()
+        self.assertNotIn(43989, [d['event_num'] for d in analytics.power_drops(50)])
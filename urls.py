@@ -0,0 +1,10 @@
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns('us_reactors.views',
+    url(r'^facilities/$', 'facility_list', name='facility_list'),
+    url(r'^reactors/$', 'reactor_list', name='reactor_list'),
+    url(r'^reactors/near/$', 'reactors_near', name='reactors_near'),
+    url(r'^events/$', 'event_list', name='event_list'),
+    url(r'^events/search/$', 'search_events', name='search_events'),
+    url(r'^events/(?P<event_num>\d+)/$', 'event_detail', name='event_detail'),
+)
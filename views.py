@@ -1 +1,294 @@
-# Create your views here.
+import json
+import math
+import hashlib
+import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from us_reactors.models import Facility, Reactor, EventNotification, EventReactorStatus, \
+    DataVersion
+from us_reactors import search, spatial
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+EVENT_PAGE_SIZE = 50
+EVENT_MAX_PAGE_SIZE = 200
+NEAR_DEFAULT_COUNT = 5
+NEAR_MAX_COUNT = 100
+# Half the earth's circumference. Every point on earth is within this distance.
+NEAR_MAX_MILES = spatial.EARTH_RADIUS_MILES * math.pi
+# Format of the event time in event list cursors.
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S'
+# Cached responses are keyed by data version, so they never go stale. This
+# just stops old versions from hanging around forever.
+RESPONSE_CACHE_SECONDS = 24 * 60 * 60
+
+
+def json_response(data):
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder),
+                        content_type='application/json')
+
+
+def data_version(request):
+    # Looked up once per request, because condition() asks for the ETag and
+    # the Last-Modified time separately.
+    if not hasattr(request, '_data_version'):
+        request._data_version = DataVersion.current()
+    return request._data_version
+
+
+def version_etag(request, *args, **kwargs):
+    version = data_version(request)
+    return version.etag if version else None
+
+
+def version_last_modified(request, *args, **kwargs):
+    version = data_version(request)
+    return version.updated if version else None
+
+
+def versioned(view):
+    """ Decorator for views whose output only depends on the URL and the
+    loaded data. Adds ETag and Last-Modified headers from the data version
+    and answers conditional requests with a 304 after a single query on the
+    version table. Other successful responses are kept in the cache until the
+    loaders bump the version.
+
+    """
+    @wraps(view)
+    def cached_view(request, *args, **kwargs):
+        version = data_version(request)
+        key = 'us_reactors.views:%s:%s' % (version.etag if version else '',
+                                           hashlib.md5(request.get_full_path()).hexdigest())
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response, RESPONSE_CACHE_SECONDS)
+        return response
+    return condition(etag_func=version_etag, last_modified_func=version_last_modified)(cached_view)
+
+
+@versioned
+def facility_list(request):
+    """ Every facility, with the ids and unit numbers of its reactors. """
+    facilities = list(Facility.objects.order_by('name').values(
+        'id', 'name', 'short_name', 'city', 'state', 'region', 'operator'))
+    reactors = {}
+    for reactor in Reactor.objects.order_by('unit').values('id', 'unit', 'facility'):
+        reactors.setdefault(reactor.pop('facility'), []).append(reactor)
+    for facility in facilities:
+        facility['reactors'] = reactors.get(facility['id'], [])
+    return json_response({'facilities': facilities})
+
+
+@versioned
+def reactor_list(request):
+    """ Every reactor, optionally only those at one `facility` (id). """
+    reactors = Reactor.objects.select_related('facility').only(
+        'unit', 'nrc_id', 'nrc_url', 'type', 'vendor', 'model', 'capacity', 'active',
+        'latitude', 'longitude', 'facility__name', 'facility__short_name')
+    if request.GET.get('facility'):
+        try:
+            reactors = reactors.filter(facility=int(request.GET['facility']))
+        except ValueError:
+            return HttpResponseBadRequest("Bad facility id")
+    results = []
+    for r in reactors.order_by('facility__name', 'unit'):
+        results.append({
+            'id': r.id,
+            'title': r.title,
+            'short_title': r.short_title,
+            'unit': r.unit,
+            'nrc_id': r.nrc_id,
+            'nrc_url': r.nrc_url,
+            'type': r.type,
+            'vendor': r.vendor,
+            'model': r.model,
+            'capacity': r.capacity,
+            'active': r.active,
+            'latitude': r.latitude,
+            'longitude': r.longitude,
+            'facility': r.facility_id,
+        })
+    return json_response({'reactors': results})
+
+
+@versioned
+def reactors_near(request):
+    """ Reactors within `miles` of the point at `lat` and `lon`, or the `k`
+    nearest ones (5 if neither is given). Pass `type=facilities` to search
+    facilities instead of individual reactors.
+
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lon = float(request.GET['lon'])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("lat/lon out of range")
+        miles = float(request.GET['miles']) if request.GET.get('miles') else None
+        k = int(request.GET['k']) if request.GET.get('k') else None
+        if miles is None and k is None:
+            k = NEAR_DEFAULT_COUNT
+        if k is not None and not 1 <= k <= NEAR_MAX_COUNT:
+            raise ValueError("k must be from 1 to %d" % NEAR_MAX_COUNT)
+        if miles is not None and not 0 <= miles <= NEAR_MAX_MILES:
+            raise ValueError("miles must be from 0 to %d" % NEAR_MAX_MILES)
+    except KeyError as e:
+        return HttpResponseBadRequest("Missing parameter: %s" % (e))
+    except ValueError as e:
+        return HttpResponseBadRequest("Bad parameter: %s" % (e))
+    facilities = request.GET.get('type') == 'facilities'
+    results = spatial.reactors_near(lat, lon, miles, k, facilities, data_version(request))
+    return json_response({'facilities' if facilities else 'reactors': results})
+
+
+@versioned
+def event_list(request):
+    """ Events newest first, optionally only those at one `facility` (id).
+    Pages are `limit` events long. Pass the `next` value from one page as
+    `before` to get the page after it. Cursors pick up exactly where the last
+    page ended: each page is read from the event_time index (or the
+    (facility_id, event_time) one, with a facility) starting at the cursor,
+    so deep pages cost the same as the first one, unlike OFFSET. Events that
+    share an event_time are ordered by id, which only sorts those few.
+
+    """
+    events = EventNotification.objects.order_by('-event_time', '-id')
+    try:
+        limit = min(int(request.GET.get('limit', EVENT_PAGE_SIZE)), EVENT_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError("limit")
+        if request.GET.get('facility'):
+            events = events.filter(facility=int(request.GET['facility']))
+        if request.GET.get('before'):
+            event_time, event_id = parse_cursor(request.GET['before'])
+            events = events.filter(Q(event_time__lt=event_time) |
+                                   Q(event_time=event_time, id__lt=event_id))
+    except ValueError as e:
+        return HttpResponseBadRequest("Bad parameter: %s" % (e))
+    # Ask for one extra row to find out if there's another page.
+    results = list(events.values('id', 'event_num', 'subject', 'event_time', 'emergency_status',
+                                 'retracted', 'facility', 'facility__short_name')[:limit + 1])
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = make_cursor(results[-1]['event_time'], results[-1]['id'])
+    return json_response({'events': results, 'next': next_cursor})
+
+
+@versioned
+def event_detail(request, event_num):
+    """ A single event with its reactors, CFR sections and people. """
+    try:
+        event = EventNotification.objects.select_related('facility').prefetch_related(
+            'cfr_sections', 'people').get(event_num=event_num)
+    except EventNotification.DoesNotExist:
+        return HttpResponseNotFound("No event %s" % (event_num))
+    statuses = EventReactorStatus.objects.filter(event=event).select_related(
+        'reactor__facility').order_by('reactor__unit')
+    return json_response({
+        'event_num': event.event_num,
+        'url': event.url,
+        'subject': event.subject,
+        'body': event.body,
+        'emergency_status': event.emergency_status,
+        'event_time': event.event_time,
+        'report_time': event.report_time,
+        'update_date': event.update_date,
+        'crawl_time': event.crawl_time,
+        'retracted': event.retracted,
+        'facility': {'id': event.facility.id, 'name': event.facility.name},
+        'reactors': [{
+            'id': s.reactor.id,
+            'title': s.reactor.title,
+            'critical': s.critical,
+            'scram': s.scram,
+            'initial_mode': s.inital_mode,
+            'current_mode': s.current_mode,
+            'initial_power': s.initial_power,
+            'current_power': s.current_power,
+        } for s in statuses],
+        'cfr_sections': [{'section': c.section, 'title': c.title} for c in event.cfr_sections.all()],
+        'people': [{'name': p.name, 'organization': p.organization} for p in event.people.all()],
+        'nrc_notified_by': event.nrc_notified_by,
+        'hq_ops_officer': event.hq_ops_officer,
+    })
+
+
+@versioned
+def search_events(request):
+    """ Ranked full-text search over event reports. Takes the search words in
+    `q`, plus optional `facility` (id), `start` and `end` (YYYY-MM-DD,
+    inclusive, on the event time), `emergency` (emergency class), `page` and
+    `per_page`.
+
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return HttpResponseBadRequest("Missing search query (q)")
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        per_page = min(int(request.GET.get('per_page', SEARCH_PAGE_SIZE)), SEARCH_MAX_PAGE_SIZE)
+        events = EventNotification.objects.all()
+        if request.GET.get('facility'):
+            events = events.filter(facility=int(request.GET['facility']))
+        if request.GET.get('start'):
+            events = events.filter(event_time__gte=parse_day(request.GET['start']))
+        if request.GET.get('end'):
+            end = parse_day(request.GET['end']) + datetime.timedelta(days=1)
+            events = events.filter(event_time__lt=end)
+    except ValueError as e:
+        return HttpResponseBadRequest("Bad search parameter: %s" % (e))
+    if request.GET.get('emergency'):
+        events = events.filter(emergency_status__iexact=request.GET['emergency'])
+    if per_page < 1:
+        return HttpResponseBadRequest("Bad search parameter: per_page")
+
+    events = search.search_events(query, events)
+    total = events.count()
+    start = (page - 1) * per_page
+    fields = ['event_num', 'subject', 'event_time', 'emergency_status', 'retracted', 'url',
+              'facility__name']
+    # The rank is needed for ordering, so it has to be selected too.
+    if 'rank' in events.query.extra_select:
+        fields.append('rank')
+    results = events.values(*fields)[start:start + per_page]
+    return json_response({
+        'query': query,
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'results': list(results),
+    })
+
+
+def parse_day(value):
+    """ Start of a YYYY-MM-DD day in UTC, as a datetime the database accepts. """
+    day = datetime.datetime.strptime(value, '%Y-%m-%d')
+    if settings.USE_TZ:
+        day = day.replace(tzinfo=timezone.utc)
+    return day
+
+
+def make_cursor(event_time, event_id):
+    """ Position of an event in the event list, as "<UTC time>-<id>". """
+    if timezone.is_aware(event_time):
+        event_time = event_time.astimezone(timezone.utc)
+    return '%s-%d' % (event_time.strftime(CURSOR_TIME_FORMAT), event_id)
+
+
+def parse_cursor(value):
+    """ Reverses make_cursor. Raises ValueError for anything malformed. """
+    event_time, event_id = value.split('-')
+    event_time = datetime.datetime.strptime(event_time, CURSOR_TIME_FORMAT)
+    if settings.USE_TZ:
+        event_time = event_time.replace(tzinfo=timezone.utc)
+    return event_time, int(event_id)